@@ -0,0 +1,34 @@
+from app.state.state import AgentState
+
+# Code languages of the artifacts shown to other agents
+ARTIFACT_LANGUAGES = {
+    "mindmap": "markdown",
+    "flowchart": "json",
+    "mermaid": "mermaid",
+    "charts": "json",
+    "drawio": "xml",
+    "infographic": "",
+}
+
+
+def current_artifact(state: AgentState, agent: str) -> str:
+    """The agent's current code on the conversation branch (loaded from session_artifact), or ""."""
+    return (state.get("artifacts") or {}).get(agent, "").strip()
+
+
+def source_artifact_section(state: AgentState, agent: str) -> str:
+    """Prompt section with the branch's latest artifact when another agent produced it.
+
+    The history only keeps a stand-in for that code, so converting or
+    discussing the previous diagram needs it in the prompt.
+    """
+    source = state.get("artifact_agent")
+    if not source or source == agent:
+        return ""
+    code = current_artifact(state, source)
+    if not code:
+        return ""
+    return (
+        f"\n\n### PREVIOUS DIAGRAM ({source})\n```{ARTIFACT_LANGUAGES.get(source, '')}\n{code}\n```\n"
+        "The latest diagram of this conversation. Use it as the source when the user refers to it."
+    )
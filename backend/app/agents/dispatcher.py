@@ -3,10 +3,72 @@ from langchain_core.messages import HumanMessage, SystemMessage
 from langgraph.graph import StateGraph, END
 from app.state.state import AgentState
 from app.core.config import settings
-from app.core.llm import get_llm, get_configured_llm
+from app.core.logger import logger
+from app.core.llm import LLMPriority, build_system_prompt, get_llm, get_configured_llm, llm_scheduler
+from app.agents.events import AGENT_SELECTED, NO_STREAM_CONFIG, emit_agent_event
+from app.agents.intent_classifier import intent_classifier, log_router_decision, message_text
+from app.core.metrics import metrics
+from app.services.response_cache import response_cache
 import re
+import time
+
+# Bump when the routing prompt changes meaning, to invalidate cached decisions
+ROUTER_PROMPT_VERSION = "2"
+
+ROUTER_AGENT_DESCRIPTIONS = {
+    "mindmap": "Best for hierarchical structures, brainstorming, outlining ideas, and organizing concepts. Output: Markdown/Markmap.",
+    "flow": "Best for standard Flowcharts ONLY. Output: React Flow JSON.",
+    "mermaid": "Best for Sequence Diagrams, Class Diagrams, State Diagrams, Gantt Charts, Git Graphs, Entity Relationship Diagrams (ERD), and User Journeys. Use this if user explicitly asks for 'Mermaid'. Output: Mermaid Syntax.",
+    "charts": "Best for quantitative data visualization (sales, stats, trends). Output: ECharts (Bar, Line, Pie, etc.).",
+    "drawio": "Best for professional, heavy-duty architecture diagrams, cloud infrastructure, and detailed UML. Use this ONLY if user explicitly asks for 'Draw.io' or complex 'architecture'.",
+    "infographic": "Best for infographics, data posters, visual storytelling, process visualization, comparison charts, timelines, and creative data presentation. Use this if user asks for 'information graphics', 'data poster', 'visual summary', or '信息图'.",
+    "general": "Handles greetings, questions unrelated to diagramming, or requests that don't fit other categories."
+}
+
+_descriptions_text = "\n".join([f"- '{key}': {desc}" for key, desc in ROUTER_AGENT_DESCRIPTIONS.items()])
+
+# Identical for every request, so providers can cache it as a prompt prefix;
+# the execution history, last agent and conversation follow it (see classify_intent)
+ROUTER_SYSTEM_PROMPT = f"""You are an intelligent DeepDiagram Router.
+    Your goal is to analyze the user's intent and route to the most appropriate diagram agent.
+    
+    (If the user's request is a follow-up, refinement, or "fix" for the previous result, FAVOUR the LAST ACTIVE AGENT given below unless they explicitly ask for a different tool or the topic has fundamentally shifted)
+
+    Context Awareness Rules:
+    1. IF "CURRENT VISUAL CONTEXT" is "Chart" AND user asks to "add", "remove", "change", "update" numbers or items -> YOU MUST ROUTE TO 'charts'.
+    2. IF "CURRENT VISUAL CONTEXT" is "Mindmap" AND user asks to "add node", "expand" -> YOU MUST ROUTE TO 'mindmap'.
+    3. IF "CURRENT VISUAL CONTEXT" is "Flowchart" AND user asks to "change shape", "connect" -> YOU MUST ROUTE TO 'flow'.
+    4. IF "CURRENT VISUAL CONTEXT" is "Mermaid Diagram" AND user asks to "add participant", "change flow" -> YOU MUST ROUTE TO 'mermaid'.
+    5. IF "CURRENT VISUAL CONTEXT" is "Draw.io Architecture" AND user asks to "add cloud component", "change layout" -> YOU MUST ROUTE TO 'drawio'.
+    6. IF user mentions "Mermaid" OR asks for "Sequence Diagram", "Class Diagram", "Gantt" -> YOU MUST ROUTE TO 'mermaid'.
+    
+    Agent Capabilities:
+    {_descriptions_text}
+    
+    Please analyze the user's latest message (which may include an image) and classify the intent.
+    Respond in the same language as the user's input (e.g., if the user asks in Chinese, respond in Chinese).
+    
+    Output ONLY keywords: 'mindmap', 'flow', 'mermaid', 'charts', 'drawio', 'general'.
+    """
 
 async def router_node(state: AgentState):
+    """
+    Routes the request and announces the selected agent on the custom stream.
+    """
+    result = await classify_intent(state)
+    emit_agent_event(AGENT_SELECTED, result["intent"])
+    return result
+
+def find_last_active_agent(messages: list) -> str | None:
+    """The agent that answered the latest previous turn, from the history's execution traces."""
+    for msg in reversed(messages[:-1]):
+        if msg.type == "ai" and "agentName:" in str(msg.content):
+            match = re.search(r"agentName:\s*(\w+)", str(msg.content))
+            if match:
+                return match.group(1)
+    return None
+
+async def classify_intent(state: AgentState):
     """
     Analyzes the user's input and determines the appropriate agent.
     Supports explicit routing via @agent syntax.
@@ -43,16 +105,6 @@ async def router_node(state: AgentState):
                 print(f"DEBUG ROUTER | Explicit Routing Triggered: {keyword} -> {intent_name} | Cleaned: {last_message.content}")
                 break
 
-    agent_descriptions = {
-        "mindmap": "Best for hierarchical structures, brainstorming, outlining ideas, and organizing concepts. Output: Markdown/Markmap.",
-        "flow": "Best for standard Flowcharts ONLY. Output: React Flow JSON.",
-        "mermaid": "Best for Sequence Diagrams, Class Diagrams, State Diagrams, Gantt Charts, Git Graphs, Entity Relationship Diagrams (ERD), and User Journeys. Use this if user explicitly asks for 'Mermaid'. Output: Mermaid Syntax.",
-        "charts": "Best for quantitative data visualization (sales, stats, trends). Output: ECharts (Bar, Line, Pie, etc.).",
-        "drawio": "Best for professional, heavy-duty architecture diagrams, cloud infrastructure, and detailed UML. Use this ONLY if user explicitly asks for 'Draw.io' or complex 'architecture'.",
-        "infographic": "Best for infographics, data posters, visual storytelling, process visualization, comparison charts, timelines, and creative data presentation. Use this if user asks for 'information graphics', 'data poster', 'visual summary', or '信息图'.",
-        "general": "Handles greetings, questions unrelated to diagramming, or requests that don't fit other categories."
-    }
-    
     # Identify Full Agent Execution History
     execution_history = []
     for msg in messages[:-1]:
@@ -69,13 +121,7 @@ async def router_node(state: AgentState):
     execution_history_text = "\n---\n".join(execution_history) if execution_history else "None"
     
     # Identify Last Active Agent
-    last_active_agent = "None"
-    for msg in reversed(messages[:-1]):
-        if msg.type == "ai" and "agentName:" in str(msg.content):
-            match = re.search(r"agentName:\s*(\w+)", str(msg.content))
-            if match:
-                last_active_agent = match.group(1)
-                break
+    last_active_agent = find_last_active_agent(messages) or "None"
     
     # If we have an explicit intent, we can skip the LLM call but we STILL want to return 
     # the intent inside the unified flow for consistency.
@@ -83,32 +129,18 @@ async def router_node(state: AgentState):
         print(f"DEBUG ROUTER | Proceeding with Explicit Intent: {explicit_intent}")
         return {"intent": explicit_intent}
 
-    descriptions_text = "\n".join([f"- '{key}': {desc}" for key, desc in agent_descriptions.items()])
-
-    system_prompt = f"""You are an intelligent DeepDiagram Router.
-    Your goal is to analyze the user's intent and route to the most appropriate diagram agent.
-    
-    AGENT EXECUTION HISTORY (Agents + Tools): 
-    {execution_history_text}
-    
-    LAST ACTIVE AGENT: {last_active_agent}
-    
-    (If the user's request is a follow-up, refinement, or "fix" for the previous result, FAVOUR the {last_active_agent} unless they explicitly ask for a different tool or the topic has fundamentally shifted)
+    # 1. Local fast path for first requests: the classifier only sees the prompt, so
+    #    follow-ups ("make it blue") go to the LLM router, which knows the last agent
+    prompt_text = message_text(last_message.content)
+    if last_active_agent == "None":
+        started = time.perf_counter()
+        predicted, confidence = intent_classifier.predict(prompt_text)
+        metrics.histogram("router_classifier_us").observe((time.perf_counter() - started) * 1_000_000)
+        if confidence >= settings.INTENT_CLASSIFIER_THRESHOLD:
+            metrics.counter("router_decisions_total", source="classifier", intent=predicted).inc()
+            logger.debug(f"Router fast path: {predicted} ({confidence:.2f})")
+            return {"intent": predicted}
 
-    Context Awareness Rules:
-    1. IF "CURRENT VISUAL CONTEXT" is "Chart" AND user asks to "add", "remove", "change", "update" numbers or items -> YOU MUST ROUTE TO 'charts'.
-    2. IF "CURRENT VISUAL CONTEXT" is "Mindmap" AND user asks to "add node", "expand" -> YOU MUST ROUTE TO 'mindmap'.
-    3. IF "CURRENT VISUAL CONTEXT" is "Flowchart" AND user asks to "change shape", "connect" -> YOU MUST ROUTE TO 'flow'.
-    4. IF "CURRENT VISUAL CONTEXT" is "Mermaid Diagram" AND user asks to "add participant", "change flow" -> YOU MUST ROUTE TO 'mermaid'.
-    5. IF "CURRENT VISUAL CONTEXT" is "Draw.io Architecture" AND user asks to "add cloud component", "change layout" -> YOU MUST ROUTE TO 'drawio'.
-    6. IF user mentions "Mermaid" OR asks for "Sequence Diagram", "Class Diagram", "Gantt" -> YOU MUST ROUTE TO 'mermaid'.
-    
-    Agent Capabilities:
-    {descriptions_text}
-    
-    Output ONLY keywords: 'mindmap', 'flow', 'mermaid', 'charts', 'drawio', 'general'.
-    """
-    
     # Helper to safely summarize PREVIOUS message content for history (concise text only)
     def summarize_history_content(content):
         if isinstance(content, list):
@@ -135,49 +167,68 @@ async def router_node(state: AgentState):
         content_summary = summarize_history_content(msg.content)
         conversation_text += f"{role}: {content_summary}\n"
     
-    # Final Routing Prompt
-    routing_instructions = f"""{system_prompt}
+    # Request-specific context, after the static routing prompt
+    routing_context = f"""
+    
+    AGENT EXECUTION HISTORY (Agents + Tools): 
+    {execution_history_text}
+    
+    LAST ACTIVE AGENT: {last_active_agent}
     
     CONVERSATION HISTORY (Summarized):
     {conversation_text}
-    
-    Please analyze the user's latest message (which may include an image) and classify the intent.
-    Respond in the same language as the user's input (e.g., if the user asks in Chinese, respond in Chinese).
     """
     
-    # Add time context
-    from app.core.llm import get_time_instructions
-    routing_instructions += get_time_instructions()
-    
-    # We pass the instruction as a SystemMessage and the ACTUAL last message as is.
-    # This ensures that if the last message has image_url, the LLM will see it as an image, NOT as long text tokens.
-    msgs_to_invoke = [
-        SystemMessage(content=routing_instructions),
-        messages[-1] # The real last message with multimodal content
-    ]
-    
     llm = get_configured_llm(state)
-    response = await llm.ainvoke(msgs_to_invoke)
-    intent = response.content.strip().lower()
+    # The time context does not affect routing: keep it out of the cache key
+    cache_key = response_cache.key(
+        "router", ROUTER_PROMPT_VERSION, response_cache.model_of(llm),
+        [SystemMessage(content=ROUTER_SYSTEM_PROMPT + routing_context), messages[-1]]
+    )
+    intent = await response_cache.get("router", cache_key)
+
+    if intent is None:
+        # Static prompt first, then the time context and this request's history
+        routing_instructions = build_system_prompt(ROUTER_SYSTEM_PROMPT, routing_context, thinking=False)
+
+        # We pass the instruction as a SystemMessage and the ACTUAL last message as is.
+        # This ensures that if the last message has image_url, the LLM will see it as an image, NOT as long text tokens.
+        msgs_to_invoke = [
+            SystemMessage(content=routing_instructions),
+            messages[-1] # The real last message with multimodal content
+        ]
+
+        started = time.perf_counter()
+        async with llm_scheduler.slot(LLMPriority.INTERACTIVE):
+            response = await llm.ainvoke(msgs_to_invoke, config=NO_STREAM_CONFIG)
+        intent = response.content.strip().lower()
+        await response_cache.set("router", cache_key, intent)
+        # Logged decisions are the classifier's training data
+        log_router_decision(prompt_text, normalize_intent(intent), (time.perf_counter() - started) * 1000)
     
     print(f"DEBUG ROUTER | Last Agent: {last_active_agent} | Raw Intent: {intent}")
+    intent = normalize_intent(intent)
+    metrics.counter("router_decisions_total", source="llm", intent=intent).inc()
+    return {"intent": intent}
 
+def normalize_intent(intent: str) -> str:
+    """Maps the router LLM's raw answer to an intent."""
     if "mindmap" in intent:
-        return {"intent": "mindmap"}
+        return "mindmap"
     elif "flow" in intent:
-        return {"intent": "flowchart"}
+        return "flowchart"
     elif "mermaid" in intent:
-        return {"intent": "mermaid"}
+        return "mermaid"
     elif "chart" in intent:
-        return {"intent": "charts"}
+        return "charts"
     elif "drawio" in intent or "draw.io" in intent or "architecture" in intent or "network" in intent:
-        return {"intent": "drawio"} 
+        return "drawio"
     elif "infographic" in intent or "信息图" in intent or "poster" in intent:
-        return {"intent": "infographic"}
+        return "infographic"
     elif "general" in intent:
-        return {"intent": "general"}
+        return "general"
     else:
-        return {"intent": "general"} # Default to general for safety
+        return "general" # Default to general for safety
 
 def route_decision(state: AgentState) -> Literal["mindmap_agent", "flow_agent", "mermaid_agent", "charts_agent", "drawio_agent", "infographic_agent", "general_agent"]:
     intent = state.get("intent")
@@ -1,6 +1,10 @@
 from langchain_core.messages import SystemMessage
+from langchain_core.runnables import RunnableConfig
 from app.state.state import AgentState
-from app.core.llm import get_configured_llm, get_thinking_instructions
+from app.core.llm import build_system_prompt, get_configured_llm
+from app.agents.artifacts import current_artifact, source_artifact_section
+from app.agents.editing import apply_edit, current_code_section
+from app.agents.events import AGENT_END, emit_agent_event, stream_agent_response
 
 DRAWIO_SYSTEM_PROMPT = """You are a Principal Cloud Solutions Architect and Draw.io (mxGraph) Master. Your goal is to generate professional, high-fidelity, and architecturally accurate Draw.io XML with rich visual details.
 
@@ -125,50 +129,31 @@ Simple client-server architecture with database backend.
 Output ONLY the design_concept and code tags, nothing else.
 """
 
-def extract_current_code_from_messages(messages) -> str:
-    """Extract the latest drawio code from message history."""
-    for msg in reversed(messages):
-        # Check for tool messages (legacy format)
-        if msg.type == "tool" and msg.content:
-            stripped = msg.content.strip()
-            if '<mxfile' in stripped or '<mxGraphModel' in stripped:
-                return stripped
-        # Check for AI messages with steps containing tool_end
-        if msg.type == "ai" and hasattr(msg, 'additional_kwargs'):
-            steps = msg.additional_kwargs.get('steps', [])
-            for step in reversed(steps):
-                if step.get('type') == 'tool_end' and step.get('content'):
-                    content = step['content'].strip()
-                    if '<mxfile' in content or '<mxGraphModel' in content:
-                        return content
-    return ""
-
-async def drawio_agent_node(state: AgentState):
+async def drawio_agent_node(state: AgentState, config: RunnableConfig):
     messages = state['messages']
 
-    # Extract current code from history
-    current_code = extract_current_code_from_messages(messages)
+    # The agent's current code on this branch
+    current_code = current_artifact(state, "drawio")
 
     # Safety: Ensure no empty text content blocks reach the LLM
     for msg in messages:
         if hasattr(msg, 'content') and not msg.content:
             msg.content = "Generate a diagram"
 
-    # Build system prompt
-    system_content = DRAWIO_SYSTEM_PROMPT + get_thinking_instructions()
+    # Build system prompt: the static prompt first, so requests share a cacheable prefix
+    code_section = ""
     if current_code:
-        system_content += f"\n\n### CURRENT DIAGRAM CODE\n```xml\n{current_code}\n```\nApply changes to this code based on the user's request."
+        code_section = current_code_section("drawio", current_code, "CURRENT DIAGRAM CODE", "xml")
 
-    system_prompt = SystemMessage(content=system_content)
+    system_prompt = SystemMessage(content=build_system_prompt(DRAWIO_SYSTEM_PROMPT, code_section, source_artifact_section(state, "drawio")))
 
     llm = get_configured_llm(state)
 
     # Stream the response - the graph event handler will parse the JSON
-    full_response = None
-    async for chunk in llm.astream([system_prompt] + messages):
-        if full_response is None:
-            full_response = chunk
-        else:
-            full_response += chunk
+    prompt = [system_prompt] + messages
+    full_response = await stream_agent_response(llm, prompt, config, "drawio_agent")
+    # Edit mode: the model answered with a patch to the current code
+    full_response = await apply_edit("drawio", current_code, llm, prompt, full_response, config, "drawio_agent")
 
+    emit_agent_event(AGENT_END, "drawio_agent")
     return {"messages": [full_response]}
@@ -0,0 +1,134 @@
+import re
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.runnables import RunnableConfig
+from app.core.config import settings
+from app.core.llm import LLMPriority, llm_scheduler
+from app.core.logger import logger
+from app.core.metrics import metrics
+from app.core.patches import DRAWIO_CELLS, JSON_PATCH, LINE_EDITS, PatchError, apply_patch, number_lines, parse_patch
+from app.core.streaming import ResponseCollector, StreamingTagParser, ThinkTagSplitter
+from app.agents.events import ARTIFACT_PATCHED, PATCH_FAILED, emit_agent_event
+from app.agents.speculation import SPECULATIVE_RUN_KEY
+
+# Patch format per agent (intent)
+PATCH_FORMATS = {
+    "flowchart": JSON_PATCH,
+    "charts": JSON_PATCH,
+    "drawio": DRAWIO_CELLS,
+    "mermaid": LINE_EDITS,
+    "mindmap": LINE_EDITS,
+    "infographic": LINE_EDITS,
+}
+
+_PATCH = re.compile(r"<patch>\s*([\s\S]*?)\s*(?:</patch>|$)")
+
+PATCH_INSTRUCTIONS = {
+    JSON_PATCH: """Describe the change as an RFC 6902 JSON Patch against the JSON above: a JSON array of
+operations like {"op": "replace", "path": "/nodes/3/data/label", "value": "Checkout"}.
+Supported ops: add, remove, replace, move, copy, test. Array indices are 0-based; "/-" appends.""",
+    DRAWIO_CELLS: """Describe the change as a JSON array of cell operations addressed by cell id:
+- {"op": "update", "id": "n3", "attributes": {"value": "New label", "style": "..."}, "geometry": {"x": 120, "y": 80}}
+  (a null attribute value removes the attribute)
+- {"op": "add", "xml": "<mxCell id=\\"n9\\" value=\\"Cache\\" style=\\"...\\" vertex=\\"1\\" parent=\\"1\\"><mxGeometry x=\\"0\\" y=\\"0\\" width=\\"120\\" height=\\"60\\" as=\\"geometry\\"/></mxCell>"}
+- {"op": "replace", "id": "n3", "xml": "<mxCell id=\\"n3\\" .../>"}
+- {"op": "delete", "id": "n3"} (also removes its children and connected edges)
+New cells need ids that are not used yet.""",
+    LINE_EDITS: """Describe the change as a JSON array of line edits, using the line numbers shown above
+(the "N| " prefixes are not part of the code):
+- {"op": "replace", "start": 4, "end": 5, "lines": ["new line 4", "new line 5", "extra line"]}
+- {"op": "insert", "after": 7, "lines": ["inserted line"]} (after 0 inserts at the top)
+- {"op": "delete", "start": 9, "end": 9}
+Line numbers always refer to the code above; edits must not overlap.""",
+}
+
+EDIT_MODE_PROMPT = """
+
+### EDIT MODE
+Apply the user's request to the current code above. Do not repeat the unchanged code: instead of the <code> tag,
+output a <patch> tag after the design concept:
+
+<design_concept>
+What you change and why (1-2 sentences)
+</design_concept>
+
+<patch>
+[ ...operations... ]
+</patch>
+
+{instructions}
+
+If the request rewrites most of the diagram, output the complete new code in the <code> tag instead of a patch."""
+
+PATCH_FALLBACK_PROMPT = (
+    "Your patch could not be applied ({error}). Reply now with the complete updated code in the <code> tag "
+    "(without line numbers) and nothing else."
+)
+
+
+def edit_mode(agent: str, current_code: str) -> bool:
+    """Whether changes to `current_code` are requested as a patch."""
+    return (
+        settings.PATCH_EDITS.lower() == "true"
+        and agent in PATCH_FORMATS
+        and len(current_code) >= settings.PATCH_EDIT_MIN_CHARS
+    )
+
+
+def current_code_section(agent: str, current_code: str, title: str, language: str) -> str:
+    """Prompt section with the agent's current code: a patch request in edit mode, else a full rewrite."""
+    if not edit_mode(agent, current_code):
+        return f"\n\n### {title}\n```{language}\n{current_code}\n```\nApply changes to this code based on the user's request."
+    patch_format = PATCH_FORMATS[agent]
+    code = number_lines(current_code) if patch_format == LINE_EDITS else current_code
+    return f"\n\n### {title}\n```{language}\n{code}\n```" + EDIT_MODE_PROMPT.format(
+        instructions=PATCH_INSTRUCTIONS[patch_format]
+    )
+
+
+async def apply_edit(
+    agent: str, current_code: str, llm, messages: list, response: AIMessageChunk | None,
+    config: RunnableConfig | None, agent_name: str,
+) -> AIMessageChunk | None:
+    """Applies the patch of an edit-mode response to the current code.
+
+    The patched code is appended to the response as a <code> block and
+    pushed as an ARTIFACT_PATCHED event, which the route delivers as the
+    generated code (independently of its tag parser). A patch that does not apply is reported (PATCH_FAILED)
+    and the model is re-prompted once for the complete code, which streams
+    as usual. Responses without a patch (the model chose to rewrite) are
+    returned as they are.
+    """
+    if response is None or not edit_mode(agent, current_code):
+        return response
+    if ((config or {}).get("configurable") or {}).get(SPECULATIVE_RUN_KEY) is not None:
+        # The agent node adopting the speculation applies the patch
+        return response
+
+    text = response.content if isinstance(response.content, str) else ""
+    answer = text
+    if re.match(r"\s*<think>", text):
+        think_end = text.find(ThinkTagSplitter.END_TAG)
+        answer = text[think_end + len(ThinkTagSplitter.END_TAG):] if think_end != -1 else ""
+    match = _PATCH.search(answer)
+    if not match or StreamingTagParser.CODE_START_TAG in answer[:match.start()]:
+        metrics.counter("patch_edits_total", agent=agent, outcome="rewrite").inc()
+        return response
+
+    collector = ResponseCollector.from_config(config)
+    try:
+        code = apply_patch(PATCH_FORMATS[agent], current_code, parse_patch(match.group(1)))
+    except PatchError as e:
+        logger.warning(f"🩹 {agent_name}: patch could not be applied ({e}), regenerating the full code")
+        metrics.counter("patch_edits_total", agent=agent, outcome="failed").inc()
+        emit_agent_event(PATCH_FAILED, agent_name, error=str(e))
+        continuation = messages + [AIMessage(content=text), HumanMessage(content=PATCH_FALLBACK_PROMPT.format(error=e))]
+        async with llm_scheduler.slot(LLMPriority.INTERACTIVE):
+            async for chunk in llm.astream(continuation):
+                collector.add(chunk)
+        return collector.message()
+
+    metrics.counter("patch_edits_total", agent=agent, outcome="applied").inc()
+    metrics.histogram("patch_edit_ratio", agent=agent).observe(len(match.group(1)) / max(1, len(code)))
+    collector.add_text(f"\n{StreamingTagParser.CODE_START_TAG}\n{code}\n{StreamingTagParser.CODE_END_TAG}")
+    emit_agent_event(ARTIFACT_PATCHED, agent_name, code=code)
+    return collector.message()
@@ -0,0 +1,94 @@
+from contextlib import nullcontext
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.config import get_stream_writer
+from langgraph.constants import TAG_NOSTREAM
+from app.core.config import settings
+from app.core.llm import LLMPriority, llm_scheduler
+from app.core.logger import logger
+from app.core.metrics import metrics
+from app.core.streaming import ResponseCollector, ThinkTagSplitter
+from app.agents.speculation import SPECULATION_KEY, SPECULATIVE_RUN_KEY, ReplayChatModel
+
+# Custom stream events pushed by graph nodes (consumed with stream_mode="custom")
+AGENT_SELECTED = "agent_selected"
+AGENT_END = "agent_end"
+REASONING_CUTOFF = "reasoning_cutoff"
+# Edit mode (see app/agents/editing.py): the patched artifact, or a patch that did not apply
+ARTIFACT_PATCHED = "artifact_patched"
+PATCH_FAILED = "patch_failed"
+
+# Config for internal LLM calls (routing, template selection) whose tokens must not
+# reach the client through stream_mode="messages"
+NO_STREAM_CONFIG = {"tags": [TAG_NOSTREAM]}
+
+REASONING_CONTINUATION_PROMPT = (
+    "Your reasoning budget is used up. Do not think any further: reply now with the final answer, "
+    "following the output format required above exactly."
+)
+
+
+def emit_agent_event(event_type: str, agent: str, **data):
+    """Pushes an agent lifecycle event to the graph's custom stream."""
+    try:
+        writer = get_stream_writer()
+    except (RuntimeError, KeyError):
+        # Called outside of a graph run (e.g. a node invoked directly)
+        return
+    writer({"type": event_type, "agent": agent, **data})
+
+
+async def stream_agent_response(llm, messages: list, config: RunnableConfig | None, agent: str) -> AIMessageChunk | None:
+    """Streams an agent's answer into the run's ResponseCollector and returns the full message.
+
+    With REASONING_TOKEN_BUDGET set, a leading <think> block that outgrows the
+    budget is cut off: the provider stream is closed, the block is closed in
+    the collected text and the model is re-prompted once, with its reasoning
+    so far, to answer right away.
+
+    Inside a speculative run the output is only buffered; an agent node that
+    adopts a speculation streams the buffered and live output of that run
+    instead of calling the model (see app/agents/speculation.py).
+    """
+    configurable = (config or {}).get("configurable") or {}
+    speculative_run = configurable.get(SPECULATIVE_RUN_KEY)
+    if speculative_run is not None:
+        # Running ahead of the router: only buffer the output
+        async with llm_scheduler.slot(LLMPriority.INTERACTIVE):
+            return await speculative_run.record(llm, messages)
+
+    collector = ResponseCollector.from_config(config)
+    budget = settings.REASONING_TOKEN_BUDGET
+    splitter = ThinkTagSplitter() if budget > 0 else None
+
+    # The router agreed with a speculative run of this agent: take over its output
+    speculation = configurable.get(SPECULATION_KEY)
+    source = llm
+    if speculation is not None and await speculation.adopt(messages):
+        source = ReplayChatModel(speculation=speculation)
+
+    # A replayed speculation already holds its own scheduler slot
+    async with (llm_scheduler.slot(LLMPriority.INTERACTIVE) if source is llm else nullcontext()):
+        stream = source.astream(messages)
+        try:
+            async for chunk in stream:
+                collector.add(chunk)
+                if splitter and isinstance(chunk.content, str) and chunk.content:
+                    splitter.feed(chunk.content)
+                    if splitter.in_think and splitter.reasoning_tokens > budget:
+                        break
+            else:
+                return collector.message()
+        finally:
+            # Closes the provider stream when the budget cut it short
+            await stream.aclose()
+
+    logger.info(f"✂️ {agent}: reasoning budget of {budget} tokens exceeded, re-prompting for the answer")
+    metrics.counter("reasoning_cutoff_total", agent=agent).inc()
+    collector.add_text(ThinkTagSplitter.END_TAG)
+    emit_agent_event(REASONING_CUTOFF, agent, reasoning_tokens=splitter.reasoning_tokens)
+    continuation = messages + [AIMessage(content=collector.text), HumanMessage(content=REASONING_CONTINUATION_PROMPT)]
+    async with llm_scheduler.slot(LLMPriority.INTERACTIVE):
+        async for chunk in llm.astream(continuation):
+            collector.add(chunk)
+    return collector.message()
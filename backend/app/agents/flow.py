@@ -1,6 +1,10 @@
 from langchain_core.messages import SystemMessage
+from langchain_core.runnables import RunnableConfig
 from app.state.state import AgentState
-from app.core.llm import get_configured_llm, get_thinking_instructions
+from app.core.llm import build_system_prompt, get_configured_llm
+from app.agents.artifacts import current_artifact, source_artifact_section
+from app.agents.editing import apply_edit, current_code_section
+from app.agents.events import AGENT_END, emit_agent_event, stream_agent_response
 
 FLOW_SYSTEM_PROMPT = """You are a Senior Business Process Architect and workflow optimization expert. Your goal is to generate premium, enterprise-grade flowcharts in JSON for React Flow.
 
@@ -76,50 +80,31 @@ Your process design decisions and optimization rationale here (1-3 sentences)
 Output ONLY these two tags, nothing else. The JSON must be valid and complete.
 """
 
-def extract_current_code_from_messages(messages) -> str:
-    """Extract the latest flowchart code from message history."""
-    for msg in reversed(messages):
-        # Check for tool messages (legacy format)
-        if msg.type == "tool" and msg.content:
-            stripped = msg.content.strip()
-            if '"nodes":' in stripped and '"edges":' in stripped:
-                return stripped
-        # Check for AI messages with steps containing tool_end
-        if msg.type == "ai" and hasattr(msg, 'additional_kwargs'):
-            steps = msg.additional_kwargs.get('steps', [])
-            for step in reversed(steps):
-                if step.get('type') == 'tool_end' and step.get('content'):
-                    content = step['content'].strip()
-                    if '"nodes":' in content and '"edges":' in content:
-                        return content
-    return ""
-
-async def flow_agent_node(state: AgentState):
+async def flow_agent_node(state: AgentState, config: RunnableConfig):
     messages = state['messages']
 
-    # Extract current code from history
-    current_code = extract_current_code_from_messages(messages)
+    # The agent's current code on this branch
+    current_code = current_artifact(state, "flowchart")
 
     # Safety: Ensure no empty text content blocks reach the LLM
     for msg in messages:
         if hasattr(msg, 'content') and not msg.content:
             msg.content = "Generate a flowchart"
 
-    # Build system prompt
-    system_content = FLOW_SYSTEM_PROMPT + get_thinking_instructions()
+    # Build system prompt: the static prompt first, so requests share a cacheable prefix
+    code_section = ""
     if current_code:
-        system_content += f"\n\n### CURRENT FLOWCHART CODE (JSON)\n```json\n{current_code}\n```\nApply changes to this code based on the user's request."
+        code_section = current_code_section("flowchart", current_code, "CURRENT FLOWCHART CODE (JSON)", "json")
 
-    system_prompt = SystemMessage(content=system_content)
+    system_prompt = SystemMessage(content=build_system_prompt(FLOW_SYSTEM_PROMPT, code_section, source_artifact_section(state, "flowchart")))
 
     llm = get_configured_llm(state)
 
     # Stream the response - the graph event handler will parse the JSON
-    full_response = None
-    async for chunk in llm.astream([system_prompt] + messages):
-        if full_response is None:
-            full_response = chunk
-        else:
-            full_response += chunk
+    prompt = [system_prompt] + messages
+    full_response = await stream_agent_response(llm, prompt, config, "flow_agent")
+    # Edit mode: the model answered with a patch to the current code
+    full_response = await apply_edit("flowchart", current_code, llm, prompt, full_response, config, "flow_agent")
 
+    emit_agent_event(AGENT_END, "flow_agent")
     return {"messages": [full_response]}
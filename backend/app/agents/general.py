@@ -1,11 +1,11 @@
 from langchain_core.messages import SystemMessage
+from langchain_core.runnables import RunnableConfig
 from app.state.state import AgentState
-from app.core.llm import get_llm, get_configured_llm
+from app.core.llm import build_system_prompt, get_configured_llm
+from app.agents.artifacts import source_artifact_section
+from app.agents.events import AGENT_END, emit_agent_event, stream_agent_response
 
-async def general_agent_node(state: AgentState):
-    messages = state['messages']
-    
-    system_prompt = SystemMessage(content="""You are DeepDiagram, a helpful AI assistant specialized in creating diagrams.
+GENERAL_SYSTEM_PROMPT = """You are DeepDiagram, a helpful AI assistant specialized in creating diagrams.
     
     Your capabilities:
     1. Mindmaps (using Markmap/Markdown)
@@ -18,13 +18,19 @@ async def general_agent_node(state: AgentState):
     LANGUAGE: Respond in the same language as the user's input.
     
     DO NOT call any tools. Just chat.
-    """)
+    """
+
+
+async def general_agent_node(state: AgentState, config: RunnableConfig):
+    messages = state['messages']
     
     llm = get_configured_llm(state)
     
-    # Add time context to system prompt
-    from app.core.llm import get_time_instructions
-    system_prompt.content += get_time_instructions()
+    # Static prompt first, then the time context and the diagram the user may ask about
+    system_prompt = SystemMessage(content=build_system_prompt(
+        GENERAL_SYSTEM_PROMPT, source_artifact_section(state, "general"), thinking=False
+    ))
     
-    response = await llm.ainvoke([system_prompt] + messages)
+    response = await stream_agent_response(llm, [system_prompt] + messages, config, "general_agent")
+    emit_agent_event(AGENT_END, "general_agent")
     return {"messages": [response]}
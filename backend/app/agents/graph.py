@@ -1,6 +1,9 @@
+from langchain_core.runnables import RunnableConfig
 from langgraph.graph import StateGraph, END
 from app.state.state import AgentState
-from app.agents.dispatcher import router_node, route_decision
+from app.core.config import settings
+from app.agents.dispatcher import router_node, route_decision, find_last_active_agent
+from app.agents.speculation import SPECULATION_KEY, Speculation
 from app.agents.mindmap import mindmap_agent_node as mindmap_agent
 from app.agents.flow import flow_agent_node as flow_agent
 from app.agents.mermaid import mermaid_agent_node as mermaid_agent
@@ -9,18 +12,62 @@ from app.agents.drawio import drawio_agent_node as drawio_agent
 from app.agents.infographic import infographic_agent_node as infographic_agent
 from app.agents.general import general_agent_node as general_agent
 
+# Agent node per intent, for speculative execution
+AGENT_NODES = {
+    "mindmap": mindmap_agent,
+    "flowchart": flow_agent,
+    "mermaid": mermaid_agent,
+    "charts": charts_agent,
+    "drawio": drawio_agent,
+    "infographic": infographic_agent,
+    "general": general_agent,
+}
+
+async def speculative_router_node(state: AgentState, config: RunnableConfig):
+    """
+    Routes the request. With SPECULATIVE_EXECUTION, follow-up turns start the
+    last active agent concurrently with routing; the run is handed to the
+    agent node when the router agrees and cancelled otherwise.
+    """
+    speculation = None
+    last_active_agent = find_last_active_agent(state["messages"])
+    if settings.SPECULATIVE_EXECUTION.lower() == "true" and last_active_agent in AGENT_NODES:
+        speculation = Speculation.start(last_active_agent, AGENT_NODES[last_active_agent], state, config)
+    try:
+        result = await router_node(state)
+    except BaseException:
+        if speculation:
+            speculation.cancel()
+        raise
+    if speculation and speculation.routed(result["intent"]):
+        return {**result, "speculation": speculation}
+    return {**result, "speculation": None}
+
+def adopting_speculation(agent_node):
+    """Wraps an agent node to hand it the speculation the router kept, if any."""
+    async def node(state: AgentState, config: RunnableConfig):
+        speculation = state.get("speculation")
+        if speculation is None:
+            return await agent_node(state, config)
+        config = {**config, "configurable": {**(config.get("configurable") or {}), SPECULATION_KEY: speculation}}
+        try:
+            return await agent_node(state, config)
+        finally:
+            speculation.cancel()
+    return node
+
 # Define the graph
 workflow = StateGraph(AgentState)
 
 # Add nodes
-workflow.add_node("router", router_node)
-workflow.add_node("mindmap_agent", mindmap_agent)
-workflow.add_node("flow_agent", flow_agent)
-workflow.add_node("mermaid_agent", mermaid_agent)
-workflow.add_node("charts_agent", charts_agent)
-workflow.add_node("drawio_agent", drawio_agent)
-workflow.add_node("infographic_agent", infographic_agent)
-workflow.add_node("general_agent", general_agent)
+workflow.add_node("router", speculative_router_node)
+workflow.add_node("mindmap_agent", adopting_speculation(mindmap_agent))
+workflow.add_node("flow_agent", adopting_speculation(flow_agent))
+workflow.add_node("mermaid_agent", adopting_speculation(mermaid_agent))
+workflow.add_node("charts_agent", adopting_speculation(charts_agent))
+workflow.add_node("drawio_agent", adopting_speculation(drawio_agent))
+workflow.add_node("infographic_agent", adopting_speculation(infographic_agent))
+workflow.add_node("general_agent", adopting_speculation(general_agent))
 
 # Entry point
 workflow.set_entry_point("router")
@@ -1,6 +1,12 @@
 from langchain_core.messages import SystemMessage, HumanMessage
+from langchain_core.runnables import RunnableConfig
 from app.state.state import AgentState
-from app.core.llm import get_configured_llm, get_thinking_instructions
+from app.core.llm import LLMPriority, build_system_prompt, get_configured_llm, llm_scheduler
+from app.agents.artifacts import current_artifact, source_artifact_section
+from app.agents.editing import apply_edit, current_code_section
+from app.agents.events import AGENT_END, NO_STREAM_CONFIG, emit_agent_event, stream_agent_response
+from app.services.generation import LLM_STAGE_KEY
+from app.services.response_cache import response_cache
 from app.data.template_syntax import (
     TEMPLATES,
     ALL_TEMPLATES,
@@ -11,6 +17,9 @@ from app.data.template_syntax import (
 )
 
 # Step 1: Template selection prompt
+# Bump when the selector prompt changes meaning, to invalidate cached selections
+TEMPLATE_SELECTOR_PROMPT_VERSION = "1"
+
 TEMPLATE_SELECTOR_PROMPT = """You are a professional infographic design consultant. Your task is to select the BEST template for the user's needs.
 
 ### Available Templates by Category
@@ -53,25 +62,12 @@ Analyze the user's request and select the single most appropriate template.
 """
 
 # Step 2: Code generation prompt (template-specific)
-CODE_GENERATOR_PROMPT = """You are a World-Class Graphic Designer. Generate AntV Infographic DSL syntax for the template: {template_name}
-
-### TEMPLATE CATEGORY: {category}
-
-### DATA STRUCTURE FOR THIS TEMPLATE
-This template uses the `{data_field}` field for data items.
-
-### TEMPLATE-SPECIFIC RULES
-{syntax_rules}
-
-### SYNTAX EXAMPLE FOR THIS TEMPLATE
-```
-{syntax_example}
-```
+# Template-independent part of the code generator prompt: identical for every
+# request, so it leads the system prompt and stays cacheable by the provider
+CODE_GENERATOR_PROMPT = """You are a World-Class Graphic Designer. Generate AntV Infographic DSL syntax for the template given under SELECTED TEMPLATE.
 
 {common_syntax_rules}
 
-{additional_syntax}
-
 ### DESIGN PHILOSOPHY
 - **Narrative Flow**: Tell a story, not just present data
 - **Visual Metaphor**: Select meaningful icons
@@ -94,6 +90,24 @@ The AntV Infographic DSL code here (raw DSL, no markdown fences)
 Output ONLY these two tags, nothing else.
 """
 
+TEMPLATE_SECTION_PROMPT = """
+
+### SELECTED TEMPLATE: {template_name}
+
+### TEMPLATE CATEGORY: {category}
+
+### DATA STRUCTURE FOR THIS TEMPLATE
+This template uses the `{data_field}` field for data items.
+
+### TEMPLATE-SPECIFIC RULES
+{syntax_rules}
+
+### SYNTAX EXAMPLE FOR THIS TEMPLATE
+```
+{syntax_example}
+```
+{additional_syntax}"""
+
 
 def build_template_selector_prompt() -> str:
     """Build the template selector prompt with all available templates."""
@@ -107,8 +121,13 @@ def build_template_selector_prompt() -> str:
     )
 
 
-def build_code_generator_prompt(template_name: str) -> str:
-    """Build the code generator prompt for a specific template."""
+def build_code_generator_prompt() -> str:
+    """Build the template-independent code generator prompt."""
+    return CODE_GENERATOR_PROMPT.format(common_syntax_rules=get_common_syntax_rules())
+
+
+def build_template_section(template_name: str) -> str:
+    """Build the code generator prompt section for a specific template."""
     category = get_template_category(template_name)
     data_field = get_data_field_for_template(template_name)
     rules = get_syntax_rules_for_template(template_name)
@@ -129,34 +148,16 @@ def build_code_generator_prompt(template_name: str) -> str:
         elif "compare-quadrant" in template_name and "compare-quadrant" in special_syntax:
             additional_syntax = f"### QUADRANT EXAMPLE\n```\n{special_syntax['compare-quadrant']}\n```"
 
-    return CODE_GENERATOR_PROMPT.format(
+    return TEMPLATE_SECTION_PROMPT.format(
         template_name=template_name,
         category=category.upper(),
         data_field=data_field,
         syntax_rules=syntax_rules,
         syntax_example=syntax_example,
-        common_syntax_rules=get_common_syntax_rules(),
-        additional_syntax=additional_syntax,
+        additional_syntax=f"\n{additional_syntax}" if additional_syntax else "",
     )
 
 
-def extract_current_code_from_messages(messages) -> str:
-    """Extract the latest infographic code from message history."""
-    for msg in reversed(messages):
-        if msg.type == "tool" and msg.content:
-            stripped = msg.content.strip()
-            if stripped.startswith('infographic '):
-                return stripped
-        if msg.type == "ai" and hasattr(msg, 'additional_kwargs'):
-            steps = msg.additional_kwargs.get('steps', [])
-            for step in reversed(steps):
-                if step.get('type') == 'tool_end' and step.get('content'):
-                    content = step['content'].strip()
-                    if content.startswith('infographic '):
-                        return content
-    return ""
-
-
 def extract_template_from_code(code: str) -> str:
     """Extract template name from existing infographic code."""
     if code.startswith('infographic '):
@@ -172,8 +173,18 @@ async def select_template(llm, user_request: str) -> str:
     selector_prompt = SystemMessage(content=build_template_selector_prompt())
     selection_message = HumanMessage(content=f"Select the best template for: {user_request}")
 
-    response = await llm.ainvoke([selector_prompt, selection_message])
-    template_name = response.content.strip()
+    selection_messages = [selector_prompt, selection_message]
+    cache_key = response_cache.key(
+        "select_template", TEMPLATE_SELECTOR_PROMPT_VERSION, response_cache.model_of(llm), selection_messages
+    )
+    template_name = await response_cache.get("select_template", cache_key)
+    if template_name is None:
+        async with llm_scheduler.slot(LLMPriority.INTERACTIVE):
+            response = await llm.ainvoke(
+                selection_messages, config={**NO_STREAM_CONFIG, "metadata": {LLM_STAGE_KEY: "select_template"}}
+            )
+        template_name = response.content.strip()
+        await response_cache.set("select_template", cache_key, template_name)
 
     # Validate template name
     if template_name in ALL_TEMPLATES:
@@ -188,11 +199,11 @@ async def select_template(llm, user_request: str) -> str:
     return "list-row-horizontal-icon-arrow"
 
 
-async def infographic_agent_node(state: AgentState):
+async def infographic_agent_node(state: AgentState, config: RunnableConfig):
     messages = state['messages']
 
-    # Extract current code from history
-    current_code = extract_current_code_from_messages(messages)
+    # The agent's current code on this branch
+    current_code = current_artifact(state, "infographic")
 
     # Safety: Ensure no empty text content blocks reach the LLM
     for msg in messages:
@@ -218,21 +229,22 @@ async def infographic_agent_node(state: AgentState):
         # Step 1: Select the best template
         template_name = await select_template(llm, user_request)
 
-    # Step 2: Generate code using template-specific prompt
-    code_prompt = build_code_generator_prompt(template_name)
-    system_content = code_prompt + get_thinking_instructions()
-
+    # Step 2: Generate code. The template-independent prompt leads, so every
+    # request shares a cacheable prefix; the template and current code follow
+    code_section = ""
     if current_code:
-        system_content += f"\n\n### CURRENT INFOGRAPHIC CODE\n```\n{current_code}\n```\nApply changes to this code based on the user's request."
+        code_section = current_code_section("infographic", current_code, "CURRENT INFOGRAPHIC CODE", "")
 
-    system_prompt = SystemMessage(content=system_content)
+    system_prompt = SystemMessage(content=build_system_prompt(
+        build_code_generator_prompt(), build_template_section(template_name), code_section,
+        source_artifact_section(state, "infographic"),
+    ))
 
     # Stream the response - the graph event handler will parse the JSON
-    full_response = None
-    async for chunk in llm.astream([system_prompt] + messages):
-        if full_response is None:
-            full_response = chunk
-        else:
-            full_response += chunk
+    prompt = [system_prompt] + messages
+    full_response = await stream_agent_response(llm, prompt, config, "infographic_agent")
+    # Edit mode: the model answered with a patch to the current code
+    full_response = await apply_edit("infographic", current_code, llm, prompt, full_response, config, "infographic_agent")
 
+    emit_agent_event(AGENT_END, "infographic_agent")
     return {"messages": [full_response]}
@@ -0,0 +1,183 @@
+import json
+import math
+import os
+import re
+import zlib
+from app.core.config import settings
+from app.core.logger import logger
+
+# Intents as returned by the router (see route_decision)
+INTENTS = ("mindmap", "flowchart", "mermaid", "charts", "drawio", "infographic", "general")
+
+# Keyword rules mirroring the router's agent descriptions. ASCII keywords match
+# on word boundaries ("chart" must not fire inside "flowchart"); CJK keywords
+# match anywhere.
+KEYWORD_RULES = {
+    "mindmap": ("mindmap", "mind map", "brainstorm", "brainstorming", "outline", "concept map",
+                "思维导图", "脑图", "大纲", "头脑风暴"),
+    "flowchart": ("flowchart", "flow chart", "workflow", "process flow", "decision tree",
+                  "流程图", "工作流"),
+    "mermaid": ("mermaid", "sequence diagram", "class diagram", "state diagram", "gantt", "er diagram", "erd",
+                "entity relationship", "user journey", "git graph",
+                "时序图", "序列图", "类图", "状态图", "甘特图", "实体关系"),
+    "charts": ("chart", "bar chart", "line chart", "pie chart", "histogram", "scatter", "echarts", "sales",
+               "revenue", "statistics", "trend", "柱状图", "折线图", "饼图", "图表", "销售", "统计", "趋势"),
+    "drawio": ("draw.io", "drawio", "architecture", "infrastructure", "aws", "azure", "gcp", "kubernetes",
+               "microservices", "network topology", "deployment diagram", "架构图", "架构", "部署图", "拓扑"),
+    "infographic": ("infographic", "poster", "visual summary", "data poster", "timeline", "信息图", "海报"),
+    "general": ("hello", "hi", "hey", "thanks", "thank you", "who are you", "what can you do",
+                "你好", "谢谢", "你是谁"),
+}
+
+# Logit added per distinct keyword hit: one keyword alone stays below the default
+# threshold (~0.67), two distinct keywords of an intent clear it (~0.96)
+KEYWORD_WEIGHT = 2.5
+DEFAULT_DIMS = 1 << 18
+
+_ASCII_KEYWORD = re.compile(r'^[\x00-\x7f]+$')
+_WORD = re.compile(r'[a-z0-9]+')
+_CJK = re.compile(r'[぀-ヿ一-鿿]+')
+
+
+def _compile_rules() -> dict[str, re.Pattern]:
+    rules = {}
+    for intent, keywords in KEYWORD_RULES.items():
+        ascii_words = [re.escape(k) for k in keywords if _ASCII_KEYWORD.match(k)]
+        other = [re.escape(k) for k in keywords if not _ASCII_KEYWORD.match(k)]
+        parts = []
+        if ascii_words:
+            parts.append(r'\b(?:' + '|'.join(sorted(ascii_words, key=len, reverse=True)) + r')\b')
+        if other:
+            parts.append('(?:' + '|'.join(sorted(other, key=len, reverse=True)) + ')')
+        rules[intent] = re.compile('|'.join(parts))
+    return rules
+
+
+_RULES = _compile_rules()
+
+
+def message_text(content) -> str:
+    """Text of a (possibly multimodal) message content."""
+    if isinstance(content, list):
+        return " ".join(item.get("text", "") for item in content if isinstance(item, dict) and item.get("type") == "text")
+    return str(content)
+
+
+def hashed_features(text: str, dims: int) -> list[int]:
+    """Hashed word uni/bigrams and CJK character uni/bigrams of `text`."""
+    text = text.lower()
+    features = []
+    words = _WORD.findall(text)
+    for i, word in enumerate(words):
+        features.append(zlib.crc32(b"w:" + word.encode()) % dims)
+        if i:
+            features.append(zlib.crc32(f"b:{words[i - 1]} {word}".encode()) % dims)
+    for run in _CJK.findall(text):
+        for i, char in enumerate(run):
+            features.append(zlib.crc32(f"c:{char}".encode()) % dims)
+            if i:
+                features.append(zlib.crc32(f"c:{run[i - 1]}{char}".encode()) % dims)
+    return features
+
+
+class IntentClassifier:
+    """In-process intent classifier for the router's fast path.
+
+    Scores every intent with keyword rules plus a linear model over hashed
+    n-gram features, and returns the softmax probability of the best intent
+    as its confidence. The model is trained offline from logged
+    (prompt, intent) router decisions (scripts/train_intent_classifier.py);
+    without a model file only the keyword rules are used.
+    """
+
+    def __init__(self, weights: dict[int, list[float]] | None = None, bias: list[float] | None = None,
+                 dims: int = DEFAULT_DIMS):
+        self.weights = weights or {}
+        self.bias = bias or [0.0] * len(INTENTS)
+        self.dims = dims
+
+    @classmethod
+    def load(cls, path: str) -> "IntentClassifier":
+        if not path or not os.path.exists(path):
+            return cls()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if tuple(data["intents"]) != INTENTS:
+                raise ValueError(f"model intents {data['intents']} do not match {INTENTS}")
+            weights = {int(bucket): w for bucket, w in data["weights"].items()}
+            return cls(weights, data["bias"], data["dims"])
+        except Exception as e:
+            logger.warning(f"Ignoring intent model {path}: {e}")
+            return cls()
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "intents": list(INTENTS),
+                "dims": self.dims,
+                "bias": [round(b, 5) for b in self.bias],
+                "weights": {str(bucket): [round(x, 5) for x in w] for bucket, w in self.weights.items()},
+            }, f, separators=(",", ":"))
+
+    def scores(self, text: str) -> list[float]:
+        scores = list(self.bias)
+        lowered = text.lower()
+        for i, intent in enumerate(INTENTS):
+            hits = len(set(_RULES[intent].findall(lowered)))
+            if hits:
+                scores[i] += KEYWORD_WEIGHT * hits
+        if self.weights:
+            for bucket in hashed_features(text, self.dims):
+                w = self.weights.get(bucket)
+                if w:
+                    for i in range(len(INTENTS)):
+                        scores[i] += w[i]
+        return scores
+
+    def predict(self, text: str) -> tuple[str, float]:
+        """(best intent, its softmax probability)."""
+        probabilities = _softmax(self.scores(text))
+        best = max(range(len(INTENTS)), key=probabilities.__getitem__)
+        return INTENTS[best], probabilities[best]
+
+    @classmethod
+    def train(cls, pairs: list[tuple[str, str]], epochs: int = 10, learning_rate: float = 0.3,
+              l2: float = 1e-4, dims: int = DEFAULT_DIMS) -> "IntentClassifier":
+        """Fits the linear model (multinomial logistic regression, SGD) on top of the keyword rules."""
+        model = cls(dims=dims)
+        examples = [(text, hashed_features(text, dims), INTENTS.index(intent)) for text, intent in pairs if intent in INTENTS]
+        for _ in range(epochs):
+            for text, features, label in examples:
+                probabilities = _softmax(model.scores(text))
+                gradient = [p - (1.0 if i == label else 0.0) for i, p in enumerate(probabilities)]
+                for i, g in enumerate(gradient):
+                    model.bias[i] -= learning_rate * g
+                for bucket in features:
+                    w = model.weights.setdefault(bucket, [0.0] * len(INTENTS))
+                    for i, g in enumerate(gradient):
+                        w[i] -= learning_rate * (g + l2 * w[i])
+        return model
+
+
+def _softmax(scores: list[float]) -> list[float]:
+    top = max(scores)
+    exps = [math.exp(s - top) for s in scores]
+    total = sum(exps)
+    return [e / total for e in exps]
+
+
+def log_router_decision(prompt: str, intent: str, latency_ms: float):
+    """Appends an LLM router decision to INTENT_LOG_PATH (training data for the classifier)."""
+    if not settings.INTENT_LOG_PATH:
+        return
+    try:
+        with open(settings.INTENT_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"prompt": prompt, "intent": intent, "latency_ms": round(latency_ms, 1)}, ensure_ascii=False) + "\n")
+    except OSError as e:
+        logger.warning(f"Failed to log router decision: {e}")
+
+
+intent_classifier = IntentClassifier.load(
+    settings.INTENT_MODEL_PATH or os.path.join(os.path.dirname(__file__), "..", "data", "intent_model.json")
+)
@@ -0,0 +1,187 @@
+import asyncio
+import contextvars
+import time
+from typing import Any, AsyncIterator
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk, BaseMessage, message_chunk_to_message
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables.config import var_child_runnable_config
+from langgraph.constants import TAG_NOSTREAM
+from app.core.logger import logger
+from app.core.metrics import metrics
+from app.core.streaming import RESPONSE_COLLECTOR_KEY, ResponseCollector
+from app.services.generation import LLM_STAGE_KEY, UNMETERED_TAG, generation_callbacks
+
+# Run config keys: the speculative run itself, and the agent node adopting its output
+SPECULATIVE_RUN_KEY = "speculative_run"
+SPECULATION_KEY = "speculation"
+
+
+class Speculation:
+    """The likely agent's generation, started while the router is still deciding.
+
+    The agent node runs in a background task with a config that reaches
+    neither the client stream nor the graph's custom events; its LLM output
+    is buffered here (see `record`). If the router picks the same agent,
+    the real agent node replays the buffer and then follows the live
+    stream (`replay`) instead of calling the LLM again; otherwise the task
+    is cancelled and the turn takes the normal path.
+    """
+
+    def __init__(self, agent: str):
+        self.agent = agent
+        self.started_at = time.monotonic()
+        self.routed_at: float | None = None
+        self.first_token_at: float | None = None
+        self.messages: list[BaseMessage] | None = None
+        self.chunks: list[AIMessageChunk] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self._prompt_ready = asyncio.Event()
+        self._changed = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        # The loop the run and its buffer belong to
+        self.loop: asyncio.AbstractEventLoop | None = None
+
+    @classmethod
+    def start(cls, agent: str, node, state: dict, config: RunnableConfig) -> "Speculation":
+        speculation = cls(agent)
+        speculation.loop = asyncio.get_running_loop()
+        # The graph's own runtime entries (stream writer, checkpointing) stay behind
+        configurable = {
+            **{k: v for k, v in (config.get("configurable") or {}).items() if not k.startswith("__")},
+            SPECULATIVE_RUN_KEY: speculation,
+            RESPONSE_COLLECTOR_KEY: ResponseCollector(),
+        }
+        # Without the graph's stream handler and writer, the speculative run's
+        # tokens and agent events never reach the client
+        speculative_config = {
+            "tags": [TAG_NOSTREAM],
+            "callbacks": generation_callbacks(),
+            "metadata": {LLM_STAGE_KEY: f"{agent} (speculative)"},
+            "configurable": configurable,
+        }
+        context = contextvars.copy_context()
+        context.run(var_child_runnable_config.set, speculative_config)
+        speculation._task = asyncio.create_task(
+            speculation._run(node, {**state, "intent": agent}, speculative_config), context=context
+        )
+        return speculation
+
+    async def _run(self, node, state: dict, config: RunnableConfig):
+        try:
+            await node(state, config)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Speculative {self.agent} run failed: {e}")
+            self.error = e
+        finally:
+            self.done = True
+            self._prompt_ready.set()
+            self._changed.set()
+
+    async def record(self, llm, messages: list[BaseMessage]) -> AIMessageChunk | None:
+        """Streams the speculative LLM call into the buffer (called by stream_agent_response)."""
+        self.messages = messages
+        self._prompt_ready.set()
+        collector = ResponseCollector()
+        async for chunk in llm.astream(messages):
+            if self.first_token_at is None:
+                self.first_token_at = time.monotonic()
+            self.chunks.append(chunk)
+            collector.add(chunk)
+            self._changed.set()
+        return collector.message()
+
+    async def adopt(self, messages: list[BaseMessage]) -> bool:
+        """Whether the real agent node can take over this run for `messages`."""
+        await self._prompt_ready.wait()
+        # System prompts are rebuilt from the same state and only differ in
+        # their time context; the conversation must be identical
+        if self.messages is not None and _conversation(self.messages) == _conversation(messages):
+            metrics.counter("speculation_total", agent=self.agent, outcome="hit").inc()
+            return True
+        # The prompt changed in between (or the run failed before reaching the LLM)
+        metrics.counter("speculation_total", agent=self.agent, outcome="stale").inc()
+        self.cancel()
+        return False
+
+    def routed(self, intent: str) -> bool:
+        """Records the router's decision; cancels the run when it picked another agent."""
+        self.routed_at = time.monotonic()
+        if intent == self.agent:
+            return True
+        metrics.counter("speculation_total", agent=self.agent, outcome="miss").inc()
+        self.cancel()
+        return False
+
+    async def replay(self) -> AsyncIterator[AIMessageChunk]:
+        """The buffered chunks, then the live ones until the speculative call ends."""
+        index = 0
+        try:
+            while True:
+                self._changed.clear()
+                if index < len(self.chunks):
+                    if index == 0:
+                        self._report_ttft_saved()
+                    yield self.chunks[index]
+                    index += 1
+                    continue
+                if self.done:
+                    if self.error:
+                        raise self.error
+                    return
+                await self._changed.wait()
+        finally:
+            # Closed early (reasoning budget, cancellation): stop the provider stream
+            self.cancel()
+
+    def _report_ttft_saved(self):
+        # Without speculation the first token would arrive a full TTFT after
+        # routing; with it, at the later of routing and the speculative first token
+        reference = self.routed_at if self.routed_at is not None else time.monotonic()
+        saved = min(reference, self.first_token_at) - self.started_at
+        metrics.histogram("speculation_ttft_saved_ms", agent=self.agent).observe(max(0.0, saved) * 1000)
+
+    def cancel(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+
+def _conversation(messages: list[BaseMessage]) -> list:
+    return [(m.type, m.content) for m in messages if m.type != "system"]
+
+
+class ReplayChatModel(BaseChatModel):
+    """Chat model that streams a speculation's output.
+
+    Used by the adopting agent node in place of the real model, so the
+    replayed tokens flow through the regular callbacks and reach the client
+    on the graph's "messages" stream like any other agent output.
+    Non-streaming calls return the whole replayed output as one message.
+    """
+
+    speculation: Any
+    # The speculative call was already metered when it ran
+    tags: list[str] | None = [UNMETERED_TAG]
+
+    @property
+    def _llm_type(self) -> str:
+        return "speculative-replay"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        # Sync calls run in a worker thread; the speculation belongs to the event loop
+        return asyncio.run_coroutine_threadsafe(self._agenerate(messages, stop), self.speculation.loop).result()
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        collector = ResponseCollector()
+        async for chunk in self.speculation.replay():
+            collector.add(chunk)
+        message = collector.message() or AIMessageChunk(content="")
+        return ChatResult(generations=[ChatGeneration(message=message_chunk_to_message(message))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        async for chunk in self.speculation.replay():
+            yield ChatGenerationChunk(message=chunk)
@@ -1,13 +1,22 @@
-from fastapi import APIRouter, Depends
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
-from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.messages import HumanMessage
 from app.agents.graph import graph
+from app.agents.events import AGENT_SELECTED, AGENT_END, ARTIFACT_PATCHED, PATCH_FAILED, REASONING_CUTOFF
 from app.core.database import get_session
 from sqlmodel.ext.asyncio.session import AsyncSession
 from app.services.chat import ChatService
+from app.core.drawio import DrawioXmlSanitizer, sanitize_drawio_xml
+from app.core.streaming import RESPONSE_COLLECTOR_KEY, ResponseCollector, StreamingTagParser, ThinkTagSplitter, extract_tag_fields
+from app.core.sse import SSEEvent
+from app.services.history import history_budgeter
+from app.services.images import image_store
+from app.services.generation import IdempotencyConflict, current_generation, generation_registry, generation_callbacks
+from app.core.metrics import metrics
+from app.core.config import settings
+from app.core.llm import get_llm
 import json
-import re
 from typing import AsyncGenerator
 from app.core.logger import logger
 from datetime import datetime
@@ -28,207 +37,54 @@ class ChatRequest(BaseModel):
     model_id: str | None = None
     api_key: str | None = None
     base_url: str | None = None
+    # Per-request override of settings.SSE_COALESCE_MS (0 streams every token as its own frame)
+    coalesce_ms: int | None = None
 
 
-class StreamingTagParser:
-    """Parse streaming output with <design_concept> and <code> XML-style tags.
-
-    State transitions: INIT -> DESIGN_CONCEPT -> CODE -> DONE
-    """
-
-    # States
-    STATE_INIT = 0
-    STATE_DESIGN_CONCEPT = 1
-    STATE_CODE = 2
-    STATE_DONE = 3
-
-    def __init__(self):
-        self.buffer = ""
-        self.state = self.STATE_INIT
-        self.design_concept = ""
-        self.code = ""
-        self.last_dc_len = 0
-        self.last_code_len = 0
-
-    def feed(self, chunk: str) -> list:
-        """Feed a chunk and return events based on current state."""
-        self.buffer += chunk
-        events = []
-
-        # Check for tag positions
-        dc_start_tag = '<design_concept>'
-        dc_end_tag = '</design_concept>'
-        code_start_tag = '<code>'
-        code_end_tag = '</code>'
-
-        dc_start_pos = self.buffer.find(dc_start_tag)
-        dc_end_pos = self.buffer.find(dc_end_tag)
-        code_start_pos = self.buffer.find(code_start_tag)
-        code_end_pos = self.buffer.find(code_end_tag)
-
-        # State: INIT -> waiting for design_concept tag
-        if self.state == self.STATE_INIT:
-            if dc_start_pos != -1:
-                self.state = self.STATE_DESIGN_CONCEPT
-                events.append(('design_concept_start', '', True))
-
-        # State: DESIGN_CONCEPT -> streaming design_concept content
-        if self.state == self.STATE_DESIGN_CONCEPT:
-            if dc_start_pos != -1:
-                content_start = dc_start_pos + len(dc_start_tag)
-                if dc_end_pos != -1:
-                    # design_concept is complete
-                    dc_content = self.buffer[content_start:dc_end_pos].strip()
-                    if len(dc_content) > self.last_dc_len:
-                        new_content = dc_content[self.last_dc_len:]
-                        self.last_dc_len = len(dc_content)
-                        self.design_concept = dc_content
-                        events.append(('design_concept', new_content, False))
-                    events.append(('design_concept_end', '', False))
-                    self.state = self.STATE_CODE
-                    if code_start_pos != -1:
-                        events.append(('code_start', '', True))
-                else:
-                    # Still streaming design_concept
-                    dc_content = self.buffer[content_start:].strip()
-                    if len(dc_content) > self.last_dc_len:
-                        new_content = dc_content[self.last_dc_len:]
-                        self.last_dc_len = len(dc_content)
-                        self.design_concept = dc_content
-                        events.append(('design_concept', new_content, True))
-
-        # State: CODE -> streaming code content
-        if self.state == self.STATE_CODE:
-            if code_start_pos != -1:
-                content_start = code_start_pos + len(code_start_tag)
-                if code_end_pos != -1:
-                    # code is complete
-                    code_content = self.buffer[content_start:code_end_pos].strip()
-                    if len(code_content) > self.last_code_len:
-                        new_content = code_content[self.last_code_len:]
-                        self.last_code_len = len(code_content)
-                        self.code = code_content
-                        events.append(('code', new_content, False))
-                    events.append(('code_end', '', False))
-                    self.state = self.STATE_DONE
-                else:
-                    # Still streaming code
-                    code_content = self.buffer[content_start:].strip()
-                    if len(code_content) > self.last_code_len:
-                        new_content = code_content[self.last_code_len:]
-                        self.last_code_len = len(code_content)
-                        self.code = code_content
-                        events.append(('code', new_content, True))
-
-        return events
-
-    def finalize(self) -> list:
-        """Finalize parsing and emit any remaining events."""
-        events = []
-
-        dc_start_tag = '<design_concept>'
-        dc_end_tag = '</design_concept>'
-        code_start_tag = '<code>'
-        code_end_tag = '</code>'
-
-        # If still in design_concept state, close it
-        if self.state == self.STATE_DESIGN_CONCEPT:
-            dc_start_pos = self.buffer.find(dc_start_tag)
-            dc_end_pos = self.buffer.find(dc_end_tag)
-            if dc_start_pos != -1:
-                content_start = dc_start_pos + len(dc_start_tag)
-                content_end = dc_end_pos if dc_end_pos != -1 else len(self.buffer)
-                dc_content = self.buffer[content_start:content_end].strip()
-                if len(dc_content) > self.last_dc_len:
-                    new_content = dc_content[self.last_dc_len:]
-                    self.design_concept = dc_content
-                    events.append(('design_concept', new_content, False))
-            events.append(('design_concept_end', '', False))
-            self.state = self.STATE_CODE
-            if code_start_tag in self.buffer:
-                events.append(('code_start', '', False))
-
-        # If in code state, finalize code
-        if self.state == self.STATE_CODE:
-            code_start_pos = self.buffer.find(code_start_tag)
-            code_end_pos = self.buffer.find(code_end_tag)
-            if code_start_pos != -1:
-                content_start = code_start_pos + len(code_start_tag)
-                content_end = code_end_pos if code_end_pos != -1 else len(self.buffer)
-                code_content = self.buffer[content_start:content_end].strip()
-                if len(code_content) > self.last_code_len:
-                    new_content = code_content[self.last_code_len:]
-                    self.code = code_content
-                    events.append(('code', new_content, False))
-            events.append(('code_end', '', False))
-            self.state = self.STATE_DONE
-
-        return events
-
-
-# Keep old name as alias for compatibility
+# Keep old names as aliases for compatibility
 StreamingJsonParser = StreamingTagParser
-
-
-def extract_tag_fields(content: str) -> tuple[str, str]:
-    """Extract design_concept and code from XML-style tagged response."""
-    design_concept = ""
-    code = ""
-
-    # Remove thinking tags if present
-    content = re.sub(r'<think>[\s\S]*?</think>', '', content, flags=re.DOTALL)
-
-    # Extract design_concept
-    dc_match = re.search(r'<design_concept>\s*([\s\S]*?)\s*</design_concept>', content)
-    if dc_match:
-        design_concept = dc_match.group(1).strip()
-
-    # Extract code
-    code_match = re.search(r'<code>\s*([\s\S]*?)\s*</code>', content)
-    if code_match:
-        code = code_match.group(1).strip()
-
-    return design_concept, code
-
-
-# Keep old name as alias for compatibility
 extract_json_fields = extract_tag_fields
 
 
-def sanitize_drawio_xml(xml_content: str) -> str:
-    """Remove invalid <Array> elements from Draw.io XML that cause parsing errors."""
-    if not xml_content or '<mxfile' not in xml_content:
-        return xml_content
+def thinking_event(kind: str, text: str, splitter: ThinkTagSplitter, session_id: int, truncated: bool = False) -> SSEEvent:
+    """Maps a ThinkTagSplitter event to the SSE event streamed to the client."""
+    if kind == 'thinking':
+        return "thinking", {'content': text, 'session_id': session_id}
+    if kind == 'thinking_start':
+        return "thinking_start", {'session_id': session_id}
+    return "thinking_end", {'reasoning_tokens': splitter.reasoning_tokens, 'truncated': truncated, 'session_id': session_id}
 
-    # Remove <Array .../> elements (self-closing) - handles multiline
-    xml_content = re.sub(r'<Array[^/>]*?/>', '', xml_content, flags=re.DOTALL)
-    # Remove <Array ...>...</Array> elements (with content)
-    xml_content = re.sub(r'<Array[^>]*>[\s\S]*?</Array>', '', xml_content)
-    # Remove standalone <Array points="..."/> patterns with various whitespace
-    xml_content = re.sub(r'\s*<Array\s+points="[^"]*"\s*/>\s*', '', xml_content)
-    # Clean up any resulting empty lines inside mxGeometry
-    xml_content = re.sub(r'(<mxGeometry[^>]*>)\s+(</(mxGeometry|mxCell)>)', r'\1\2', xml_content)
-    # Clean up multiple newlines
-    xml_content = re.sub(r'\n\s*\n\s*\n', '\n\n', xml_content)
 
-    return xml_content
+def usage_step(usage: dict) -> dict:
+    """Token usage of the generation, persisted with the assistant message's steps."""
+    return {
+        "type": "usage",
+        "name": "usage",
+        "content": json.dumps(usage),
+        "status": "done",
+        "timestamp": int(datetime.utcnow().timestamp() * 1000)
+    }
 
 
-async def event_generator(request: ChatRequest, db: AsyncSession) -> AsyncGenerator[str, None]:
+async def event_generator(request: ChatRequest, db: AsyncSession) -> AsyncGenerator[SSEEvent, None]:
     chat_service = ChatService(db)
+    # The generation running this pipeline, which meters its LLM calls
+    generation = current_generation.get()
 
     # 1. Manage Session
     session_id = request.session_id
     if not session_id:
         chat_session = await chat_service.create_session(title=request.prompt[:30])
         session_id = chat_session.id
-        yield f"event: session_created\ndata: {json.dumps({'session_id': session_id})}\n\n"
+        yield "session_created", {'session_id': session_id}
 
     # 2. Load History for context reconstruction
     all_history = await chat_service.get_history(session_id)
     history_map = {msg.id: msg for msg in all_history}
 
     # 3. Manage User Message
+    # Uploaded images are stored once and referenced by URL (retries already send URLs)
+    images = [await image_store.store(image) for image in request.images]
     last_user_msg_id = None
     user_msg = None
     if request.is_retry and request.parent_id:
@@ -238,7 +94,7 @@ async def event_generator(request: ChatRequest, db: AsyncSession) -> AsyncGenera
         # Save new User Message
         user_msg = await chat_service.add_message(
             session_id, "user", request.prompt,
-            images=request.images,
+            images=images,
             files=request.files,
             parent_id=request.parent_id
         )
@@ -250,7 +106,7 @@ async def event_generator(request: ChatRequest, db: AsyncSession) -> AsyncGenera
     elif last_user_msg_id in history_map:
         turn_index = history_map[last_user_msg_id].turn_index
 
-    yield f"event: message_created\ndata: {json.dumps({'id': last_user_msg_id, 'role': 'user', 'turn_index': turn_index})}\n\n"
+    yield "message_created", {'id': last_user_msg_id, 'role': 'user', 'turn_index': turn_index}
 
     # 4. Handle Document Parsing & Extraction
     doc_context = ""
@@ -261,7 +117,7 @@ async def event_generator(request: ChatRequest, db: AsyncSession) -> AsyncGenera
         existing_msg = history_map[last_user_msg_id]
         if existing_msg.file_context:
             doc_context = existing_msg.file_context
-            yield f"event: status\ndata: {json.dumps({'content': 'Reusing previous document analysis...'})}\n\n"
+            yield "status", {'content': 'Reusing previous document analysis...'}
             logger.info(f"♻️ Reusing existing file context for message {last_user_msg_id}")
 
     if not doc_context and request.files:
@@ -276,15 +132,15 @@ async def event_generator(request: ChatRequest, db: AsyncSession) -> AsyncGenera
         all_parsed_text = ""
         for file_info in request.files:
             filename = file_info.get("name", "document")
-            yield f"event: status\ndata: {json.dumps({'content': f'Parsing {filename}...'})}\n\n"
+            yield "status", {'content': f'Parsing {filename}...'}
             parsed_text = await parsing_service.parse_file(filename, file_info.get("data", ""))
             all_parsed_text += f"\n\n--- Document: {filename} ---\n{parsed_text}"
 
         if all_parsed_text.strip():
-            yield f"event: status\ndata: {json.dumps({'content': 'Extracting core data from documents...'})}\n\n"
+            yield "status", {'content': 'Extracting core data from documents...'}
 
             # Use dedicated events for document analysis to separate from tool flow
-            yield f"event: doc_analysis_start\ndata: {json.dumps({'session_id': session_id})}\n\n"
+            yield "doc_analysis_start", {'session_id': session_id}
 
             analysis_buffers = {}
 
@@ -303,7 +159,7 @@ async def event_generator(request: ChatRequest, db: AsyncSession) -> AsyncGenera
 
                 if status == "running":
                     analysis_buffers[chunk_idx] += content
-                    yield f"event: doc_analysis_chunk\ndata: {json.dumps({'content': content, 'index': chunk_idx, 'status': 'running', 'session_id': session_id})}\n\n"
+                    yield "doc_analysis_chunk", {'content': content, 'index': chunk_idx, 'status': 'running', 'session_id': session_id}
 
                 elif status in ["done", "error"]:
                     # Final content for this block
@@ -338,11 +194,11 @@ async def event_generator(request: ChatRequest, db: AsyncSession) -> AsyncGenera
                         })
 
                     # Send final empty chunk to signal done state to frontend
-                    yield f"event: doc_analysis_chunk\ndata: {json.dumps({'content': '', 'index': chunk_idx, 'status': 'done', 'session_id': session_id})}\n\n"
+                    yield "doc_analysis_chunk", {'content': '', 'index': chunk_idx, 'status': 'done', 'session_id': session_id}
 
-            yield f"event: doc_analysis_end\ndata: {json.dumps({'content': doc_context, 'session_id': session_id})}\n\n"
+            yield "doc_analysis_end", {'content': doc_context, 'session_id': session_id}
 
-            yield f"event: status\ndata: {json.dumps({'content': 'Document processing complete.'})}\n\n"
+            yield "status", {'content': 'Document processing complete.'}
 
             # Persist newly generated context to the user message
             if doc_context:
@@ -372,63 +228,33 @@ async def event_generator(request: ChatRequest, db: AsyncSession) -> AsyncGenera
 
     logger.info(f"⏱️ History assembly took {(time.time() - start_time) * 1000:.2f}ms, {len(branch_messages)} messages")
 
-    formatted_history = []
-    for msg in branch_messages:
-        if msg.role == "user":
-            if msg.images:
-                human_content = [{"type": "text", "text": msg.content}]
-                for img_url in msg.images:
-                    human_content.append({"type": "image_url", "image_url": {"url": img_url}})
-                formatted_history.append(HumanMessage(content=human_content))
-            else:
-                formatted_history.append(HumanMessage(content=msg.content))
-        elif msg.role == "assistant":
-            # Augment assistant message with tool inputs/outputs for better context
-            content = msg.content or ""
-            if msg.steps:
-                execution_details = []
-                last_tool_desc = ""
-
-                # Format steps following user suggestion
-                for s in msg.steps:
-                    if s["type"] == "agent_select":
-                        details_line = f"agentName: {s['name']}"
-                        execution_details.append(details_line)
-                    elif s["type"] == "tool_start":
-                        last_tool_desc = f"toolName: {s['name']}, toolArgs: {s.get('content', '')}"
-                    elif s["type"] == "tool_end" and last_tool_desc:
-                        output = s.get('content', '')
-                        # Combine start and end into a single execution line
-                        execution_details.append(f"{last_tool_desc}, toolsOutput: {output}")
-                        last_tool_desc = ""
-                    elif s["type"] == "tool_end":
-                         # Fallback if no tool_start found
-                         output = s.get('content', '')
-                         execution_details.append(f"toolName: {s['name']}, toolsOutput: {output}")
-
-                if last_tool_desc:
-                    execution_details.append(last_tool_desc)
-
-                if execution_details:
-                    trace_block = "### Execution Trace:\n" + "\n".join(execution_details)
-                    if content:
-                        content = f"{content}\n\n{trace_block}"
-                    else:
-                        content = trace_block
-
-            formatted_history.append(AIMessage(content=content))
+    # Each agent's current code on this branch, given to the agents in their prompt (one indexed query)
+    artifacts = await chat_service.get_branch_artifacts(session_id, branch_messages)
+    artifact_agent = max(artifacts.values(), key=lambda a: a.turn_index).agent if artifacts else None
+
+    # Superseded code is dropped and old turns are folded to fit the history budget
+    budgeter = history_budgeter(
+        db, get_llm(model_name=request.model_id, api_key=request.api_key, base_url=request.base_url),
+        artifact_in_prompt=bool(artifacts)
+    )
+    formatted_history, history_stats = await budgeter.build(session_id, branch_messages, request.prompt, images)
+    logger.info(
+        f"📚 History: {history_stats['tokens']} of {history_stats['full_tokens']} tokens, "
+        f"{history_stats['folded_messages']}/{history_stats['messages']} messages folded into the summary, "
+        f"{history_stats['attached_images']}/{history_stats['images']} earlier images re-sent"
+    )
 
     # Current Message Construction (same as before)
     current_prompt = request.prompt
     if doc_context:
         current_prompt = f"Document Context:\n{doc_context}\n\nUser Question:\n{current_prompt}"
 
-    if request.images:
+    if images:
         content = [{"type": "text", "text": current_prompt}]
-        for image_data in request.images:
+        for image in images:
             content.append({
                 "type": "image_url",
-                "image_url": {"url": image_data}
+                "image_url": {"url": await image_store.for_llm(image)}
             })
         message = HumanMessage(content=content)
     else:
@@ -439,6 +265,8 @@ async def event_generator(request: ChatRequest, db: AsyncSession) -> AsyncGenera
 
     inputs = {
         "messages": full_messages,
+        "artifacts": {agent: artifact.code for agent, artifact in artifacts.items()},
+        "artifact_agent": artifact_agent,
         "model_config": {
             "model_id": request.model_id,
             "api_key": request.api_key,
@@ -446,13 +274,20 @@ async def event_generator(request: ChatRequest, db: AsyncSession) -> AsyncGenera
         } if (request.model_id or request.api_key or request.base_url) else None
     }
 
-    full_response_content = ""
+    # Filled by the agent node (see ResponseCollector): the only full copy of the response
+    response = ResponseCollector()
     selected_agent = None
 
+    # Reasoning (<think>) is streamed as `thinking` events; only the answer reaches the tag parser
+    think_splitter = ThinkTagSplitter()
     # JSON streaming parser for new agent format
     json_parser = StreamingJsonParser()
     design_concept_started = False
     code_started = False
+    # Cleans Draw.io XML as it streams, so the client never renders invalid elements
+    code_sanitizer = None
+    # Code of an applied edit-mode patch, delivered outside the tag parser
+    patched_code = None
 
     logger.info(f"🚀 Starting LLM stream with {len(full_messages)} messages, is_retry={request.is_retry}")
 
@@ -461,106 +296,153 @@ async def event_generator(request: ChatRequest, db: AsyncSession) -> AsyncGenera
     try:
         try:
             # Stateless execution: No thread_id, so it runs fresh with provided history
-            async for event in graph.astream_events(inputs, version="v1"):
-                event_type = event["event"]
-                data = event["data"]
-                metadata = event.get("metadata", {})
-                node_name = metadata.get("langgraph_node", "")
-
-                # Filter internal Router LLM stream
-                if node_name == "router":
-                    # Detect Router Output to notify frontend
-                    if event_type == "on_chain_end":
-                        # The router returns {"intent": "..."}
-                        output = data.get("output")
-                        if output and "intent" in output:
-                            intent = output["intent"]
-                            selected_agent = intent
-                            yield f"event: agent_selected\ndata: {json.dumps({'agent': intent, 'session_id': session_id})}\n\n"
-
-                            # Also add a pseudo-step for history
+            # Lean streaming: chat-model token deltas plus the agent lifecycle events
+            # the graph nodes push themselves (see app/agents/events.py)
+            async for mode, data in graph.astream(
+                inputs,
+                config={"callbacks": generation_callbacks(), "configurable": {RESPONSE_COLLECTOR_KEY: response}},
+                stream_mode=["messages", "custom"]
+            ):
+                content = ""
+                if mode == "custom":
+                    event_type = data.get("type")
+                    if event_type == AGENT_SELECTED:
+                        intent = data["agent"]
+                        selected_agent = intent
+                        if intent == "drawio":
+                            code_sanitizer = DrawioXmlSanitizer()
+                        yield "agent_selected", {'agent': intent, 'session_id': session_id}
+
+                        # Also add a pseudo-step for history
+                        accumulated_steps.append({
+                            "type": "agent_select",
+                            "name": intent,
+                            "status": "done",
+                            "timestamp": int(datetime.utcnow().timestamp() * 1000)
+                        })
+                    elif event_type == AGENT_END:
+                        accumulated_steps.append({
+                            "type": "agent_end",
+                            "name": data["agent"],
+                            "status": "done",
+                            "timestamp": int(datetime.utcnow().timestamp() * 1000)
+                        })
+                        yield "agent_end", {'agent': data["agent"], 'session_id': session_id}
+                    elif event_type == REASONING_CUTOFF:
+                        # The agent cut off the think block and re-prompts for the answer
+                        for kind, text in think_splitter.cut():
+                            yield thinking_event(kind, text, think_splitter, session_id, truncated=True)
+                    elif event_type == ARTIFACT_PATCHED:
+                        # The agent applied its patch to the current code: deliver the result as the
+                        # generated code, whatever state the tag parser is in (the patch is not a <code> block)
+                        patched_code = sanitize_drawio_xml(data['code']) if code_sanitizer else data['code']
+                        if not code_started:
+                            code_started = True
                             accumulated_steps.append({
-                                "type": "agent_select",
-                                "name": intent,
+                                "type": "tool_start",
+                                "name": f"create_{selected_agent}",
+                                "content": "{}",
                                 "status": "done",
                                 "timestamp": int(datetime.utcnow().timestamp() * 1000)
                             })
-                    continue  # Skip all other events from "router" node
-
-                # Detect Agent End
-                if node_name.endswith("_agent") and event_type == "on_chain_end":
-                    accumulated_steps.append({
-                        "type": "agent_end",
-                        "name": node_name,
-                        "status": "done",
-                        "timestamp": int(datetime.utcnow().timestamp() * 1000)
-                    })
-                    yield f"event: agent_end\ndata: {json.dumps({'agent': node_name, 'session_id': session_id})}\n\n"
-
-                if event_type == "on_chat_model_stream":
-                    chunk = data.get("chunk")
-                    if chunk:
-                        content = chunk.content
-                        if content:
-                            full_response_content += content
-
-                            # For non-general agents, parse the JSON stream
-                            if selected_agent and selected_agent != "general":
-                                # Parse the streaming JSON
-                                events = json_parser.feed(content)
-                                for evt_type, evt_content, is_streaming in events:
-                                    if evt_type == 'design_concept_start':
-                                        if not design_concept_started:
-                                            design_concept_started = True
-                                            # Add design_concept step to accumulated_steps
-                                            accumulated_steps.append({
-                                                "type": "design_concept",
-                                                "name": "Design Concept",
-                                                "content": "",
-                                                "status": "running",
-                                                "timestamp": int(datetime.utcnow().timestamp() * 1000)
-                                            })
-                                            yield f"event: design_concept_start\ndata: {json.dumps({'session_id': session_id})}\n\n"
-                                    elif evt_type == 'design_concept':
-                                        if evt_content:
-                                            yield f"event: design_concept\ndata: {json.dumps({'content': evt_content, 'session_id': session_id})}\n\n"
-                                    elif evt_type == 'design_concept_end':
-                                        # Update design_concept step with final content
-                                        for step in accumulated_steps:
-                                            if step.get("type") == "design_concept" and step.get("status") == "running":
-                                                step["content"] = json_parser.design_concept
-                                                step["status"] = "done"
-                                                break
-                                        yield f"event: design_concept_end\ndata: {json.dumps({'session_id': session_id})}\n\n"
-                                    elif evt_type == 'code_start':
-                                        if not code_started:
-                                            code_started = True
-                                            # Signal start of code (equivalent to tool_start)
-                                            accumulated_steps.append({
-                                                "type": "tool_start",
-                                                "name": f"create_{selected_agent}",
-                                                "content": "{}",
-                                                "status": "done",
-                                                "timestamp": int(datetime.utcnow().timestamp() * 1000)
-                                            })
-                                            yield f"event: tool_start\ndata: {json.dumps({'tool': f'create_{selected_agent}', 'input': {}, 'session_id': session_id})}\n\n"
-                                    elif evt_type == 'code':
-                                        if evt_content:
-                                            yield f"event: tool_code\ndata: {json.dumps({'content': evt_content, 'session_id': session_id})}\n\n"
-                                    elif evt_type == 'code_end':
-                                        # Finalize tool_end with the complete code
-                                        final_code = json_parser.code
-                                        accumulated_steps.append({
-                                            "type": "tool_end",
-                                            "name": f"create_{selected_agent}",
-                                            "content": final_code,
-                                            "status": "done",
-                                            "timestamp": int(datetime.utcnow().timestamp() * 1000)
-                                        })
-                                        yield f"event: tool_end\ndata: {json.dumps({'output': final_code, 'session_id': session_id})}\n\n"
+                            yield "tool_start", {'tool': f'create_{selected_agent}', 'input': {}, 'session_id': session_id}
+                        yield "tool_code", {'content': patched_code, 'session_id': session_id}
+                        accumulated_steps.append({
+                            "type": "tool_end",
+                            "name": f"create_{selected_agent}",
+                            "content": patched_code,
+                            "status": "done",
+                            "timestamp": int(datetime.utcnow().timestamp() * 1000)
+                        })
+                        yield "tool_end", {'output': patched_code, 'session_id': session_id}
+                    elif event_type == PATCH_FAILED:
+                        yield "status", {'content': 'The edit could not be applied, regenerating the full code...', 'session_id': session_id}
+
+                elif mode == "messages":
+                    # (message chunk, metadata); internal router/template calls are tagged nostream
+                    chunk, _metadata = data
+                    if chunk and chunk.content:
+                        for kind, text in think_splitter.feed(chunk.content):
+                            if kind == 'text':
+                                content = text
                             else:
-                                # For general agent, just stream as thought
-                                yield f"event: thought\ndata: {json.dumps({'content': content, 'session_id': session_id})}\n\n"
+                                yield thinking_event(kind, text, think_splitter, session_id)
+
+                if content:
+                    # For non-general agents, parse the JSON stream
+                    if selected_agent and selected_agent != "general":
+                        # Parse the streaming JSON
+                        events = json_parser.feed(content)
+                        for evt_type, evt_content, is_streaming in events:
+                            if evt_type == 'design_concept_start':
+                                if not design_concept_started:
+                                    design_concept_started = True
+                                    # Add design_concept step to accumulated_steps
+                                    accumulated_steps.append({
+                                        "type": "design_concept",
+                                        "name": "Design Concept",
+                                        "content": "",
+                                        "status": "running",
+                                        "timestamp": int(datetime.utcnow().timestamp() * 1000)
+                                    })
+                                    yield "design_concept_start", {'session_id': session_id}
+                            elif evt_type == 'design_concept':
+                                if evt_content:
+                                    yield "design_concept", {'content': evt_content, 'session_id': session_id}
+                            elif evt_type == 'design_concept_end':
+                                # Update design_concept step with final content
+                                for step in accumulated_steps:
+                                    if step.get("type") == "design_concept" and step.get("status") == "running":
+                                        step["content"] = json_parser.design_concept
+                                        step["status"] = "done"
+                                        break
+                                yield "design_concept_end", {'session_id': session_id}
+                            elif evt_type == 'code_start':
+                                if not code_started:
+                                    code_started = True
+                                    # Signal start of code (equivalent to tool_start)
+                                    accumulated_steps.append({
+                                        "type": "tool_start",
+                                        "name": f"create_{selected_agent}",
+                                        "content": "{}",
+                                        "status": "done",
+                                        "timestamp": int(datetime.utcnow().timestamp() * 1000)
+                                    })
+                                    yield "tool_start", {'tool': f'create_{selected_agent}', 'input': {}, 'session_id': session_id}
+                            elif evt_type == 'code':
+                                if code_sanitizer:
+                                    evt_content = code_sanitizer.feed(evt_content)
+                                if evt_content:
+                                    yield "tool_code", {'content': evt_content, 'session_id': session_id}
+                            elif evt_type == 'code_end' and patched_code is None:
+                                # Finalize tool_end with the complete code (an applied patch already did)
+                                final_code = json_parser.code
+                                if code_sanitizer:
+                                    tail = code_sanitizer.finalize()
+                                    if tail:
+                                        yield "tool_code", {'content': tail, 'session_id': session_id}
+                                    # Sanitized as it streamed: the deltas add up to the final code
+                                    final_code = code_sanitizer.text
+                                accumulated_steps.append({
+                                    "type": "tool_end",
+                                    "name": f"create_{selected_agent}",
+                                    "content": final_code,
+                                    "status": "done",
+                                    "timestamp": int(datetime.utcnow().timestamp() * 1000)
+                                })
+                                yield "tool_end", {'output': final_code, 'session_id': session_id}
+                    else:
+                        # For general agent, just stream as thought
+                        yield "thought", {'content': content, 'session_id': session_id}
+
+            # Flush what the think splitter held back (whitespace or a partial tag)
+            for kind, text in think_splitter.finalize():
+                if kind != 'text':
+                    yield thinking_event(kind, text, think_splitter, session_id)
+                elif selected_agent in (None, "general"):
+                    yield "thought", {'content': text, 'session_id': session_id}
+            if think_splitter.reasoning_tokens:
+                metrics.histogram("reasoning_tokens", agent=selected_agent).observe(think_splitter.reasoning_tokens)
 
             # Finalize any remaining JSON content
             if selected_agent and selected_agent != "general":
@@ -577,9 +459,9 @@ async def event_generator(request: ChatRequest, db: AsyncSession) -> AsyncGenera
                                 "status": "running",
                                 "timestamp": int(datetime.utcnow().timestamp() * 1000)
                             })
-                            yield f"event: design_concept_start\ndata: {json.dumps({'session_id': session_id})}\n\n"
+                            yield "design_concept_start", {'session_id': session_id}
                     elif evt_type == 'design_concept' and evt_content:
-                        yield f"event: design_concept\ndata: {json.dumps({'content': evt_content, 'session_id': session_id})}\n\n"
+                        yield "design_concept", {'content': evt_content, 'session_id': session_id}
                     elif evt_type == 'design_concept_end':
                         # Update design_concept step with final content
                         for step in accumulated_steps:
@@ -587,7 +469,7 @@ async def event_generator(request: ChatRequest, db: AsyncSession) -> AsyncGenera
                                 step["content"] = json_parser.design_concept
                                 step["status"] = "done"
                                 break
-                        yield f"event: design_concept_end\ndata: {json.dumps({'session_id': session_id})}\n\n"
+                        yield "design_concept_end", {'session_id': session_id}
                     elif evt_type == 'code_start':
                         if not code_started:
                             code_started = True
@@ -598,14 +480,19 @@ async def event_generator(request: ChatRequest, db: AsyncSession) -> AsyncGenera
                                 "status": "done",
                                 "timestamp": int(datetime.utcnow().timestamp() * 1000)
                             })
-                            yield f"event: tool_start\ndata: {json.dumps({'tool': f'create_{selected_agent}', 'input': {}, 'session_id': session_id})}\n\n"
-                    elif evt_type == 'code' and evt_content:
-                        yield f"event: tool_code\ndata: {json.dumps({'content': evt_content, 'session_id': session_id})}\n\n"
-                    elif evt_type == 'code_end':
+                            yield "tool_start", {'tool': f'create_{selected_agent}', 'input': {}, 'session_id': session_id}
+                    elif evt_type == 'code':
+                        if code_sanitizer:
+                            evt_content = code_sanitizer.feed(evt_content)
+                        if evt_content:
+                            yield "tool_code", {'content': evt_content, 'session_id': session_id}
+                    elif evt_type == 'code_end' and patched_code is None:
                         final_code = json_parser.code
-                        # Sanitize Draw.io XML to remove invalid <Array> elements
-                        if selected_agent == 'drawio':
-                            final_code = sanitize_drawio_xml(final_code)
+                        if code_sanitizer:
+                            tail = code_sanitizer.finalize()
+                            if tail:
+                                yield "tool_code", {'content': tail, 'session_id': session_id}
+                            final_code = code_sanitizer.text
                         accumulated_steps.append({
                             "type": "tool_end",
                             "name": f"create_{selected_agent}",
@@ -613,11 +500,11 @@ async def event_generator(request: ChatRequest, db: AsyncSession) -> AsyncGenera
                             "status": "done",
                             "timestamp": int(datetime.utcnow().timestamp() * 1000)
                         })
-                        yield f"event: tool_end\ndata: {json.dumps({'output': final_code, 'session_id': session_id})}\n\n"
+                        yield "tool_end", {'output': final_code, 'session_id': session_id}
 
                 # Fallback: If parser didn't extract properly, try full extraction
-                if not json_parser.code and full_response_content:
-                    design_concept, code = extract_json_fields(full_response_content)
+                if not json_parser.code and patched_code is None and response:
+                    design_concept, code = extract_json_fields(response.text)
                     if code:
                         if not code_started:
                             accumulated_steps.append({
@@ -627,8 +514,7 @@ async def event_generator(request: ChatRequest, db: AsyncSession) -> AsyncGenera
                                 "status": "done",
                                 "timestamp": int(datetime.utcnow().timestamp() * 1000)
                             })
-                        # Sanitize Draw.io XML to remove invalid <Array> elements
-                        if selected_agent == 'drawio':
+                        if code_sanitizer:
                             code = sanitize_drawio_xml(code)
                         accumulated_steps.append({
                             "type": "tool_end",
@@ -637,33 +523,42 @@ async def event_generator(request: ChatRequest, db: AsyncSession) -> AsyncGenera
                             "status": "done",
                             "timestamp": int(datetime.utcnow().timestamp() * 1000)
                         })
-                        yield f"event: tool_end\ndata: {json.dumps({'output': code, 'session_id': session_id})}\n\n"
+                        yield "tool_end", {'output': code, 'session_id': session_id}
+
+            # Token usage per stage of this generation (router, extraction, agents, ...)
+            usage = generation.usage.summary() if generation and generation.usage.calls else None
+            if usage:
+                yield "usage", {**usage, 'session_id': session_id}
 
             # 4. Save Assistant Message (Normal completion)
-            if full_response_content or accumulated_steps:
-                # For general agent, save full_response_content; for other agents, content is in steps
-                content_to_save = full_response_content if selected_agent == "general" else ""
+            if response or accumulated_steps:
+                # For general agent, save the response text; for other agents, content is in steps
+                content_to_save = response.text if selected_agent == "general" else ""
                 assistant_msg = await chat_service.add_message(
                     session_id, "assistant",
                     content_to_save,
-                    steps=accumulated_steps,
+                    steps=accumulated_steps + ([usage_step(usage)] if usage else []),
                     agent=selected_agent,
                     parent_id=last_user_msg_id
                 )
                 assistant_msg_saved = True
-                yield f"event: message_created\ndata: {json.dumps({'id': assistant_msg.id, 'role': 'assistant', 'turn_index': assistant_msg.turn_index, 'session_id': session_id})}\n\n"
+                yield "message_created", {'id': assistant_msg.id, 'role': 'assistant', 'turn_index': assistant_msg.turn_index, 'session_id': session_id}
 
         finally:
             import asyncio
             # Robust Persistence: Ensure partial data is saved if connection was aborted
-            if not assistant_msg_saved and (full_response_content or accumulated_steps):
+            if not assistant_msg_saved and (response or accumulated_steps):
                 error_marker = "\n\n[Generation stopped by user/connection lost]"
                 try:
                     # Use asyncio.shield to prevent the save operation from being cancelled
+                    # Only the usage that was recorded before the generation stopped
+                    partial_steps = accumulated_steps + (
+                        [usage_step(generation.usage.summary())] if generation and generation.usage.calls else []
+                    )
                     await asyncio.shield(chat_service.add_message(
                         session_id, "assistant",
                         error_marker,
-                        steps=accumulated_steps,
+                        steps=partial_steps,
                         agent=selected_agent,
                         parent_id=last_user_msg_id
                     ))
@@ -676,12 +571,110 @@ async def event_generator(request: ChatRequest, db: AsyncSession) -> AsyncGenera
         error_msg = str(e)
         logger.error(f"Error in chat stream: {error_msg}")
         logger.error(traceback.format_exc())
-        yield f"event: error\ndata: {json.dumps({'message': error_msg})}\n\n"
+        yield "error", {'message': error_msg}
 
 @router.post("/chat/completions")
-async def chat_completions(request: ChatRequest, db: AsyncSession = Depends(get_session)):
-
-    return StreamingResponse(event_generator(request, db), media_type="text/event-stream")
+async def chat_completions(
+    request: ChatRequest,
+    idempotency_key: str | None = Header(default=None, alias="Idempotency-Key")
+):
+    """Start a generation and stream its events.
+
+    Requests repeating an Idempotency-Key (same session and parent message)
+    attach to the generation the first one started and replay its stream,
+    instead of saving the user message and calling the LLM again.
+    """
+    flush_ms = request.coalesce_ms if request.coalesce_ms is not None else settings.SSE_COALESCE_MS
+    # LLM calls of the generation share the session's fair share of the scheduler
+    llm_session = str(request.session_id) if request.session_id else None
+    headers = {}
+    if idempotency_key:
+        scope = (request.session_id, request.parent_id, request.is_retry)
+        try:
+            generation, replayed = generation_registry.start_once(
+                idempotency_key, scope, lambda db: event_generator(request, db), flush_ms, llm_session
+            )
+        except IdempotencyConflict as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        if replayed:
+            headers["Idempotent-Replayed"] = "true"
+    else:
+        generation = generation_registry.start(lambda db: event_generator(request, db), flush_ms, llm_session)
+    headers["X-Generation-Id"] = generation.id
+    return StreamingResponse(
+        generation.subscribe(),
+        media_type="text/event-stream",
+        headers=headers
+    )
+
+@router.get("/chat/{generation_id}")
+async def get_generation(generation_id: str, db: AsyncSession = Depends(get_session)):
+    """Status of a generation, plus the persisted assistant message once it has finished."""
+    generation = generation_registry.get(generation_id)
+    if not generation:
+        raise HTTPException(status_code=404, detail="Generation not found or expired")
+
+    result = generation.to_dict()
+    result["message"] = None
+    if generation.done:
+        chat_service = ChatService(db)
+        if generation.assistant_message_id:
+            result["message"] = await chat_service.get_message(generation.assistant_message_id)
+        elif generation.user_message_id:
+            # Partial results are saved without a message_created event
+            result["message"] = await chat_service.get_latest_reply(generation.user_message_id)
+    else:
+        result["stream_url"] = f"/api/chat/{generation_id}/stream"
+    return result
+
+@router.post("/chat/{generation_id}/cancel")
+async def cancel_generation(generation_id: str):
+    """Stop a running generation and abort its upstream LLM streams."""
+    generation = generation_registry.get(generation_id)
+    if not generation:
+        raise HTTPException(status_code=404, detail="Generation not found or expired")
+
+    latency_ms = await generation_registry.cancel(generation)
+    result = generation.to_dict()
+    result["cancel_latency_ms"] = round(latency_ms, 1) if latency_ms is not None else None
+    return result
+
+@router.get("/metrics")
+async def get_metrics():
+    return metrics.snapshot()
+
+@router.get("/chat/{generation_id}/stream")
+async def resume_chat_stream(
+    generation_id: str,
+    last_event_id: int | None = None,
+    last_event_id_header: str | None = Header(default=None, alias="Last-Event-ID")
+):
+    """Replay frames missed since Last-Event-ID and attach to the live generation."""
+    generation = generation_registry.get(generation_id)
+    if not generation:
+        raise HTTPException(status_code=404, detail="Generation not found or expired")
+
+    cursor = last_event_id
+    if cursor is None and last_event_id_header and last_event_id_header.strip().isdigit():
+        cursor = int(last_event_id_header.strip())
+
+    return StreamingResponse(
+        generation.subscribe(cursor or 0),
+        media_type="text/event-stream",
+        headers={"X-Generation-Id": generation.id}
+    )
+
+@router.get("/images/{digest}")
+async def get_image(digest: str):
+    """An uploaded image, by content hash (the URL stored in chat messages)."""
+    blob = await image_store.original(digest)
+    if not blob:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return Response(
+        content=blob.data,
+        media_type=blob.mime,
+        headers={"Cache-Control": "public, max-age=31536000, immutable"}
+    )
 
 @router.get("/sessions")
 async def list_sessions(db: AsyncSession = Depends(get_session)):
@@ -21,6 +21,45 @@ class Settings:
 
     MAX_TOKENS: int = int(os.getenv("MAX_TOKENS", 1024*16))
 
+    # LLM client cache (see app/core/llm.py)
+    LLM_CLIENT_CACHE_SIZE: int = int(os.getenv("LLM_CLIENT_CACHE_SIZE", 32))
+    LLM_CLIENT_IDLE_SECONDS: int = int(os.getenv("LLM_CLIENT_IDLE_SECONDS", 300))
+    LLM_MAX_HOST_POOLS: int = int(os.getenv("LLM_MAX_HOST_POOLS", 8)) # least recently used host is retired beyond
+    LLM_HOST_MAX_CONNECTIONS: int = int(os.getenv("LLM_HOST_MAX_CONNECTIONS", 64))
+    LLM_KEEPALIVE_EXPIRY_SECONDS: float = float(os.getenv("LLM_KEEPALIVE_EXPIRY_SECONDS", 60))
+    LLM_HTTP2: str = os.getenv("LLM_HTTP2", "auto") # auto (when the h2 package is installed), false
+    LLM_CONNECT_TIMEOUT: float = float(os.getenv("LLM_CONNECT_TIMEOUT", 10))
+    LLM_READ_TIMEOUT: float = float(os.getenv("LLM_READ_TIMEOUT", 120)) # max gap between streamed chunks
+    LLM_WRITE_TIMEOUT: float = float(os.getenv("LLM_WRITE_TIMEOUT", 30))
+    LLM_POOL_TIMEOUT: float = float(os.getenv("LLM_POOL_TIMEOUT", 30)) # max wait for a free connection
+    # Adaptive rate limiting per provider host and API key (see app/core/ratelimit.py)
+    LLM_RATE_LIMIT: str = os.getenv("LLM_RATE_LIMIT", "true")
+    LLM_RATE_LIMIT_RPM: float = float(os.getenv("LLM_RATE_LIMIT_RPM", 0)) # 0: learned from 429s
+    LLM_RATE_LIMIT_TPM: float = float(os.getenv("LLM_RATE_LIMIT_TPM", 0)) # prompt tokens; 0: learned from 429s
+    EXTRACTION_MAX_CONCURRENCY: int = int(os.getenv("EXTRACTION_MAX_CONCURRENCY", 8)) # caps ChatRequest.concurrency
+    # Server-wide cap on concurrent LLM calls, shared by priority and session (see LLMScheduler)
+    LLM_MAX_IN_FLIGHT: int = int(os.getenv("LLM_MAX_IN_FLIGHT", 32))
+    # Token accounting: ask for usage on streamed responses, and prices per model (see LLMUsageTracker)
+    LLM_STREAM_USAGE: str = os.getenv("LLM_STREAM_USAGE", "true")
+    LLM_PRICES: str = os.getenv("LLM_PRICES", "") # JSON: {"model": {"input": .., "output": .., "cached_input": ..}} per 1M tokens
+    # Conversation history sent with each turn (see app/services/history.py)
+    HISTORY_TOKEN_BUDGET: int = int(os.getenv("HISTORY_TOKEN_BUDGET", 12000)) # 0: no folding
+    HISTORY_SUMMARY: str = os.getenv("HISTORY_SUMMARY", "true") # LLM rolling summary of folded turns
+    HISTORY_IMAGE_TURNS: int = int(os.getenv("HISTORY_IMAGE_TURNS", 2)) # 0: keep every image
+    # Images sent to the LLM (see app/services/images.py)
+    IMAGE_MAX_EDGE: int = int(os.getenv("IMAGE_MAX_EDGE", 1568))
+    IMAGE_JPEG_QUALITY: int = int(os.getenv("IMAGE_JPEG_QUALITY", 85))
+    IMAGE_CACHE_SIZE: int = int(os.getenv("IMAGE_CACHE_SIZE", 256)) # resized variants kept in memory
+
+    # Provider pool with failover and hedging (see app/core/providers.py)
+    LLM_PROVIDERS: str = os.getenv("LLM_PROVIDERS", "") # JSON list of {name, base_url, api_key, model}
+    LLM_PROVIDER_MAX_RETRIES: int = int(os.getenv("LLM_PROVIDER_MAX_RETRIES", 0)) # per provider, before failing over
+    LLM_PROVIDER_COOLDOWN_SECONDS: float = float(os.getenv("LLM_PROVIDER_COOLDOWN_SECONDS", 30))
+    LLM_PROVIDER_SLOW_TTFT_SECONDS: float = float(os.getenv("LLM_PROVIDER_SLOW_TTFT_SECONDS", 10))
+    LLM_HEDGE: str = os.getenv("LLM_HEDGE", "false")
+    LLM_HEDGE_MIN_DELAY_MS: int = int(os.getenv("LLM_HEDGE_MIN_DELAY_MS", 500))
+    LLM_HEDGE_MAX_DELAY_MS: int = int(os.getenv("LLM_HEDGE_MAX_DELAY_MS", 5000))
+
     # DeepSeek
     DEEPSEEK_API_KEY: str = os.getenv("DEEPSEEK_API_KEY", "")
     DEEPSEEK_BASE_URL: str = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
@@ -30,5 +69,32 @@ class Settings:
     
     # Thinking Control
     THINKING_VERBOSITY: str = os.getenv("THINKING_VERBOSITY", "normal") # normal, concise, verbose
+    # Reasoning tokens (<think> block) after which the answer is re-prompted; 0 disables
+    REASONING_TOKEN_BUDGET: int = int(os.getenv("REASONING_TOKEN_BUDGET", 0))
+
+    # Edit mode: follow-up changes to an artifact are requested as a patch (see app/agents/editing.py)
+    PATCH_EDITS: str = os.getenv("PATCH_EDITS", "true")
+    PATCH_EDIT_MIN_CHARS: int = int(os.getenv("PATCH_EDIT_MIN_CHARS", 1000)) # smaller artifacts are regenerated
+
+    # Response cache for routing / template selection (memory LRU + optional shared Postgres tier)
+    RESPONSE_CACHE_SIZE: int = int(os.getenv("RESPONSE_CACHE_SIZE", 1024))
+    RESPONSE_CACHE_TTL_SECONDS: int = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 86400))
+    RESPONSE_CACHE_POSTGRES: str = os.getenv("RESPONSE_CACHE_POSTGRES", "false")
+
+    # Router fast path: local intent classifier (keyword rules + hashed n-gram model)
+    INTENT_CLASSIFIER_THRESHOLD: float = float(os.getenv("INTENT_CLASSIFIER_THRESHOLD", 0.85)) # > 1 disables
+    INTENT_MODEL_PATH: str = os.getenv("INTENT_MODEL_PATH", "") # default: app/data/intent_model.json
+    INTENT_LOG_PATH: str = os.getenv("INTENT_LOG_PATH", "") # JSONL log of LLM router decisions
+    # Start the last active agent while routing follow-ups (costs tokens on misses)
+    SPECULATIVE_EXECUTION: str = os.getenv("SPECULATIVE_EXECUTION", "false")
+
+    # SSE Streaming
+    SSE_COALESCE_MS: int = int(os.getenv("SSE_COALESCE_MS", 30)) # 0 disables delta coalescing
+    SSE_COALESCE_BYTES: int = int(os.getenv("SSE_COALESCE_BYTES", 4096))
+    SSE_JSON_BACKEND: str = os.getenv("SSE_JSON_BACKEND", "auto") # auto (orjson if installed), json
+    SSE_RESUME_BUFFER_FRAMES: int = int(os.getenv("SSE_RESUME_BUFFER_FRAMES", 4096))
+    GENERATION_RETENTION_SECONDS: int = int(os.getenv("GENERATION_RETENTION_SECONDS", 600))
+    IDEMPOTENCY_TTL_SECONDS: int = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", 600))
+    GENERATION_CANCEL_TIMEOUT_SECONDS: int = int(os.getenv("GENERATION_CANCEL_TIMEOUT_SECONDS", 10))
 
 settings = Settings()
@@ -0,0 +1,257 @@
+import re
+
+# Attributes of a tag up to its '>' or '/>' (quoted values may contain either)
+_ATTRS = r'''(?:[^>"'/]++|/(?!>)|"[^"]*+"|'[^']*+')*+'''
+# A complete <Array> element without nested arrays
+_ARRAY_ELEMENT = re.compile(rf'<Array\b{_ATTRS}(?:/>|>(?:[^<]++|<(?!/?Array\b))*+</Array\b{_ATTRS}/?>)')
+# A complete <mxGeometry> element with only whitespace inside
+_EMPTY_GEOMETRY = re.compile(rf'(<mxGeometry\b{_ATTRS})>\s*+</mxGeometry\b{_ATTRS}/?>')
+# What the pre-pass cannot resolve: remaining <Array> tags, an incomplete <mxGeometry>
+# tag, and one that may still turn out to be empty
+_UNRESOLVED = re.compile(
+    rf'</?Array\b|<mxGeometry\b{_ATTRS}(?:$|["\']|>(?=\s*+(?:$|<(?:/?Array\b|/mxGeometry\b)|</?\w*$)))'
+)
+_SANITIZED_TAG = re.compile(r'</?(?:Array|mxGeometry)\b')
+_ARRAY_TAG = re.compile(r'</?Array\b')
+_SANITIZED_PREFIXES = ('<Array', '</Array', '<mxGeometry', '</mxGeometry')
+# The rest of a complete tag
+_TAG_REST = re.compile(rf'{_ATTRS}/?>')
+# Characters that can end a tag or open/close a quoted attribute value
+_TAG_DELIMITERS = re.compile(r'[>"\']')
+
+
+def _collapse_geometry(match: re.Match) -> str:
+    return match.group(1).rstrip() + ' />'
+
+
+class DrawioXmlSanitizer:
+    """Incrementally removes XML that Draw.io cannot parse from a streamed diagram.
+
+    - `<Array>` elements (self-closing or with content, nested or not) are
+      dropped together with the whitespace leading into them; LLMs emit them
+      as edge waypoints and they break the diagram.
+    - `<mxGeometry ...>` elements left with only whitespace inside are
+      collapsed to a self-closing tag.
+
+    Chunks are buffered until one closes a tag, but never more than a few
+    of them, so the client keeps rendering the diagram as it streams.
+    Complete elements in the buffered text are then sanitized by regexes,
+    and only what they cannot resolve (nested or unclosed `<Array>`s, tags
+    cut off by the chunk boundary, an open `<mxGeometry>` that may still turn
+    out to be empty) goes through a tag-by-tag state machine, so the text is
+    never looked at character by character from Python. Held-back state is
+    bounded, so pathological input (unclosed tags, endless whitespace) stays
+    linear. Output does not depend on how the input is split into chunks;
+    `text` is everything emitted so far, the whole sanitized document after
+    `finalize`.
+    """
+
+    # An incomplete tag longer than this is passed through as text
+    MAX_TAG_CHARS = 64 * 1024
+    # Whitespace held back in front of a possible <Array> is released beyond this
+    MAX_HELD_WHITESPACE = 4096
+    # Chunks are sanitized once one closes a tag and at least this many are buffered...
+    MIN_BUFFERED_CHUNKS = 4
+    # ... and at the latest once this many are (a few tokens, so rendering keeps up with the stream)
+    MAX_BUFFERED_CHUNKS = 8
+
+    def __init__(self):
+        self._buffer: list[str] = []
+        self._pending = ""
+        # Resume point of the '>' search in `_pending`, and the open quote there
+        self._scan_pos = 0
+        self._quote: str | None = None
+        self._held_ws = ""
+        self._geometry: str | None = None
+        self._array_depth = 0
+        self._emitted: list[str] = []
+
+    @property
+    def text(self) -> str:
+        return "".join(self._emitted)
+
+    def feed(self, chunk: str) -> str:
+        """Consumes a chunk of XML and returns the sanitized text that is final."""
+        buffer = self._buffer
+        buffer.append(chunk)
+        if len(buffer) < self.MIN_BUFFERED_CHUNKS or ('>' not in chunk and len(buffer) < self.MAX_BUFFERED_CHUNKS):
+            return ""
+        out: list[str] = []
+        self._flush(out)
+        self._emitted.extend(out)
+        return "".join(out)
+
+    def finalize(self) -> str:
+        """Flushes held-back text at the end of the stream."""
+        out: list[str] = []
+        self._flush(out)
+        if self._pending and not self._array_depth:
+            self._release(out)
+            out.append(self._pending)
+        self._pending = ""
+        self._scan_pos = 0
+        self._quote = None
+        self._release(out)
+        self._array_depth = 0
+        self._emitted.extend(out)
+        return "".join(out)
+
+    def _flush(self, out: list[str]):
+        held = ""
+        if not self._array_depth:
+            # Held-back markup is sanitized again together with the new text
+            held = (self._geometry or "") + self._held_ws
+            self._geometry = None
+            self._held_ws = ""
+        text = held + self._pending + "".join(self._buffer)
+        self._buffer.clear()
+        self._pending = ""
+        resume = -1
+        if self._scan_pos:
+            resume = len(held)
+            self._scan_pos += resume
+        elif not self._array_depth:
+            text = self._resolve(text)
+
+        pos = 0
+        n = len(text)
+        while pos < n:
+            if self._array_depth:
+                match = _ARRAY_TAG.search(text, pos)
+            elif self._geometry is not None:
+                match = _SANITIZED_TAG.search(text, pos)
+            else:
+                match = _UNRESOLVED.search(text, pos)
+            if self._scan_pos and (match is None or match.start() != resume):
+                # The held-back tag turned out not to be a sanitized one
+                self._scan_pos = 0
+                self._quote = None
+            if match is None:
+                lt = text.rfind('<', max(pos, n - 11))
+                if lt != -1 and any(prefix.startswith(text[lt:]) for prefix in _SANITIZED_PREFIXES):
+                    # Could still become a sanitized tag
+                    self._pending = text[lt:]
+                    n = lt
+                self._emit_text(text[pos:n], out)
+                break
+            lt = match.start()
+            if lt > pos:
+                self._emit_text(text[pos:lt], out)
+            rest = None if self._scan_pos else _TAG_REST.match(text, lt + 1)
+            end = rest.end() - 1 if rest else self._tag_end(text, lt)
+            if end == -1:
+                if n - lt > self.MAX_TAG_CHARS:
+                    self._scan_pos = 0
+                    self._quote = None
+                    self._emit_text(text[lt:], out)
+                else:
+                    # Keep the partial tag; `_scan_pos` becomes relative to it
+                    self._pending = text[lt:]
+                    self._scan_pos -= lt
+                break
+            closing = text.startswith('</', lt)
+            name = 'Array' if text.startswith('Array', lt + 1 + closing) else 'mxGeometry'
+            self._handle_tag(name, closing, text[lt:end + 1], out)
+            pos = end + 1
+
+    @staticmethod
+    def _resolve(text: str) -> str:
+        """Drops complete <Array> elements and collapses empty <mxGeometry> elements."""
+        if '<Array' in text:
+            pieces = []
+            pos = 0
+            for match in _ARRAY_ELEMENT.finditer(text):
+                pieces.append(text[pos:match.start()].rstrip())
+                pos = match.end()
+            if pieces:
+                pieces.append(text[pos:])
+                text = "".join(pieces)
+        if '</mxGeometry' in text:
+            text = _EMPTY_GEOMETRY.sub(_collapse_geometry, text)
+        return text
+
+    def _tag_end(self, text: str, start: int) -> int:
+        """Index of the '>' closing the tag at `start`, or -1 if it is incomplete.
+
+        Resumes from where the previous call on the same tag stopped.
+        """
+        pos = max(start + 1, self._scan_pos)
+        quote = self._quote
+        while True:
+            if quote:
+                close = text.find(quote, pos)
+                if close == -1:
+                    break
+                quote = None
+                pos = close + 1
+                continue
+            match = _TAG_DELIMITERS.search(text, pos)
+            if match is None:
+                break
+            if match.group() == '>':
+                self._scan_pos = 0
+                self._quote = None
+                return match.start()
+            quote = match.group()
+            pos = match.end()
+        self._scan_pos = len(text)
+        self._quote = quote
+        return -1
+
+    def _emit_text(self, text: str, out: list[str]):
+        if self._array_depth:
+            return
+        stripped = text.rstrip()
+        if stripped:
+            self._release(out)
+            out.append(stripped)
+        whitespace = text[len(stripped):]
+        if whitespace:
+            self._held_ws += whitespace
+            if len(self._held_ws) > self.MAX_HELD_WHITESPACE:
+                self._release(out)
+
+    def _handle_tag(self, name: str, closing: bool, tag: str, out: list[str]):
+        self_closing = tag.endswith('/>')
+
+        if name == 'Array':
+            if self._array_depth:
+                if closing:
+                    self._array_depth -= 1
+                elif not self_closing:
+                    self._array_depth += 1
+            else:
+                # Drop the whitespace leading into the element (and stray closing tags)
+                self._held_ws = ""
+                if not closing and not self_closing:
+                    self._array_depth = 1
+            return
+        if self._array_depth:
+            return
+
+        if closing and self._geometry is not None:
+            out.append(self._geometry[:-1].rstrip() + ' />')
+            self._geometry = None
+            self._held_ws = ""
+            return
+        self._release(out)
+        if not closing and not self_closing:
+            self._geometry = tag
+        else:
+            out.append(tag)
+
+    def _release(self, out: list[str]):
+        if self._geometry is not None:
+            out.append(self._geometry)
+            self._geometry = None
+        if self._held_ws:
+            out.append(self._held_ws)
+            self._held_ws = ""
+
+
+def sanitize_drawio_xml(xml_content: str) -> str:
+    """Remove invalid <Array> elements and empty geometry from Draw.io XML."""
+    if not xml_content:
+        return xml_content
+    sanitizer = DrawioXmlSanitizer()
+    return sanitizer.feed(xml_content) + sanitizer.finalize()
@@ -1,5 +1,463 @@
+import asyncio
+import calendar
+import hashlib
+import time
+import weakref
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from enum import IntEnum
+from typing import Any, Callable
+from urllib.parse import urlsplit
+import httpx
 from langchain_openai import ChatOpenAI
 from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.providers import PooledChatModel, provider_pool
+from app.core.ratelimit import estimate_tokens, rate_limiters, retry_after_seconds
+
+try:
+    import h2  # noqa: F401 - lets httpx negotiate HTTP/2
+except ImportError:  # optional
+    h2 = None
+
+DEFAULT_OPENAI_BASE_URL = "https://api.openai.com/v1"
+
+# Per-stage limits instead of one blanket timeout: `read` bounds the gap between
+# streamed chunks, `pool` the wait for a free connection in a saturated pool
+LLM_TIMEOUT = httpx.Timeout(
+    connect=settings.LLM_CONNECT_TIMEOUT,
+    read=settings.LLM_READ_TIMEOUT,
+    write=settings.LLM_WRITE_TIMEOUT,
+    pool=settings.LLM_POOL_TIMEOUT,
+)
+
+
+class _TrackedStream(httpx.AsyncByteStream):
+    """Response body wrapper that reports when the response has been closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_close: Callable[[], None]):
+        self._stream = stream
+        self._on_close = on_close
+
+    async def __aiter__(self):
+        async for part in self._stream:
+            yield part
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._on_close:
+                on_close, self._on_close = self._on_close, None
+                on_close()
+
+
+class _RequestTrace:
+    """httpcore trace hook that times the connection stages of one request.
+
+    Pool wait ends at the first connection-level event: the pool has handed
+    the request a connection (new or reused) by then.
+    """
+
+    def __init__(self, host: str, inner: Callable | None):
+        self.host = host
+        self.inner = inner
+        self.started = time.perf_counter()
+        self.assigned = False
+        self.connect_started: float | None = None
+
+    async def __call__(self, event_name: str, info: dict[str, Any]):
+        now = time.perf_counter()
+        if not self.assigned:
+            self.assigned = True
+            metrics.histogram("llm_pool_wait_ms", host=self.host).observe((now - self.started) * 1000)
+        if event_name == "connection.connect_tcp.started":
+            self.connect_started = now
+        elif self.connect_started is not None and event_name in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+            # Recorded again after TLS, so the last sample covers TCP + TLS
+            if event_name == "connection.start_tls.complete" or not self.host.startswith("https:"):
+                metrics.histogram("llm_connect_ms", host=self.host).observe((now - self.connect_started) * 1000)
+        elif event_name.endswith("receive_response_headers.complete"):
+            metrics.histogram("llm_response_headers_ms", host=self.host).observe((now - self.started) * 1000)
+        if self.inner is not None:
+            result = self.inner(event_name, info)
+            if asyncio.iscoroutine(result):
+                await result
+
+
+class TrackedTransport(httpx.AsyncBaseTransport):
+    """HTTP transport that instruments a host's connection pool.
+
+    Counts requests whose response is still open (a streaming response holds
+    its connection until it is closed) to report pool saturation, and times
+    each request's pool wait, connection setup and time to response headers,
+    which separates local queueing from provider latency. Requests first
+    pass the adaptive rate limiter of their provider and API key, which
+    learns from the 429s coming back (see app/core/ratelimit.py).
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, host: str = "", max_connections: int = 0):
+        self._transport = transport
+        self.host = host
+        self.max_connections = max_connections
+        self.active = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        limiter = None
+        if self.host and settings.LLM_RATE_LIMIT.lower() == "true":
+            # Queue here, before taking a connection, while the provider's budget is exhausted
+            limiter = rate_limiters.for_request(self.host, request)
+            await limiter.acquire(estimate_tokens(request))
+        if self.max_connections and self.active >= self.max_connections:
+            metrics.counter("llm_pool_saturated_total", host=self.host).inc()
+        self.active += 1
+        self._report()
+        request.extensions["trace"] = _RequestTrace(self.host, request.extensions.get("trace"))
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            self._release()
+            raise
+        response.stream = _TrackedStream(response.stream, self._release)
+        if limiter is not None:
+            if response.status_code == 429:
+                limiter.throttled(retry_after_seconds(response))
+            elif response.status_code < 400:
+                limiter.succeeded()
+        return response
+
+    def _release(self):
+        self.active -= 1
+        self._report()
+
+    def _report(self):
+        if self.host:
+            metrics.gauge("llm_pool_active", host=self.host).set(self.active)
+            if self.max_connections:
+                metrics.gauge("llm_pool_saturation", host=self.host).set(round(self.active / self.max_connections, 3))
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+@dataclass
+class _HostPool:
+    host: str
+    http_client: httpx.AsyncClient
+    transport: TrackedTransport
+    # Keys of the cached chat model clients using this pool
+    client_keys: set = field(default_factory=set)
+    # Chat model clients built on this pool that are still alive: cached, or
+    # held by a caller past their eviction
+    holders: int = 0
+
+
+@dataclass
+class _CachedClient:
+    llm: ChatOpenAI
+    host: str
+    last_used: float
+
+
+class LLMClientCache:
+    """Process-wide cache of chat model clients on shared per-host connection pools.
+
+    Clients are keyed by (base_url, model, hashed api key, temperature,
+    max_tokens, max_retries), so the router, the agent and document
+    extraction of a turn (and every later turn) reuse one client instead of
+    rebuilding it. All
+    clients talking to the same upstream host share one tuned HTTP client:
+    explicit connection limits, keep-alive expiry and HTTP/2 when the `h2`
+    package is installed (negotiated via ALPN, HTTP/1.1 otherwise).
+
+    At most `max_clients` clients are kept (least recently used are evicted)
+    and clients unused for `idle_seconds` are dropped. A host's pool is
+    retired when no cached client uses it any more, and closed once no chat
+    model built on it is alive (a graph run may still hold an evicted one
+    for its next call) and none of its responses is still streaming; a new
+    client for the host picks the retired pool up again. At most
+    `max_hosts` host pools are in use, the least recently used host is
+    retired beyond that.
+    """
+
+    def __init__(self, max_clients: int, idle_seconds: float, max_hosts: int, connections_per_host: int,
+                 keepalive_expiry: float, http2: bool):
+        self.max_clients = max(1, max_clients)
+        self.idle_seconds = idle_seconds
+        self.max_hosts = max(1, max_hosts)
+        self.connections_per_host = max(1, connections_per_host)
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = http2
+        self._clients: OrderedDict[tuple, _CachedClient] = OrderedDict()
+        self._hosts: OrderedDict[str, _HostPool] = OrderedDict()
+        # Dropped pools that still have open responses
+        self._retired: list[_HostPool] = []
+        self._closing: set[asyncio.Task] = set()
+
+    @staticmethod
+    def key(base_url: str | None, model: str, api_key: str | None, temperature: float, max_tokens: int,
+            max_retries: int = 2) -> tuple:
+        key_hash = hashlib.sha256(api_key.encode()).hexdigest()[:16] if api_key else None
+        return (base_url, model, key_hash, temperature, max_tokens, max_retries)
+
+    @staticmethod
+    def host_of(base_url: str | None) -> str:
+        parts = urlsplit(base_url or DEFAULT_OPENAI_BASE_URL)
+        return f"{parts.scheme}://{parts.netloc}".lower()
+
+    def get(self, key: tuple, base_url: str | None, factory: Callable[[httpx.AsyncClient], ChatOpenAI]) -> ChatOpenAI:
+        """The cached client for `key`, built with `factory(http_client)` on a miss."""
+        now = time.monotonic()
+        self._sweep(now)
+        entry = self._clients.get(key)
+        if entry is not None:
+            self._clients.move_to_end(key)
+            self._hosts.move_to_end(entry.host)
+            entry.last_used = now
+            metrics.counter("llm_client_cache_hits_total").inc()
+            return entry.llm
+
+        metrics.counter("llm_client_cache_misses_total").inc()
+        pool = self._pool_for(self.host_of(base_url))
+        entry = _CachedClient(factory(pool.http_client), pool.host, now)
+        pool.holders += 1
+        weakref.finalize(entry.llm, self._released, pool)
+        self._clients[key] = entry
+        pool.client_keys.add(key)
+        while len(self._clients) > self.max_clients:
+            evicted_key = next(iter(self._clients))
+            metrics.counter("llm_client_cache_evictions_total", reason="lru").inc()
+            self._drop_client(evicted_key)
+        self._report()
+        return entry.llm
+
+    def _pool_for(self, host: str) -> _HostPool:
+        pool = self._hosts.get(host)
+        if pool is not None:
+            self._hosts.move_to_end(host)
+            return pool
+        while len(self._hosts) >= self.max_hosts:
+            oldest = next(iter(self._hosts.values()))
+            metrics.counter("llm_client_cache_evictions_total", reason="host_cap").inc(len(oldest.client_keys))
+            for client_key in list(oldest.client_keys):
+                self._drop_client(client_key)
+        for index, retired in enumerate(self._retired):
+            if retired.host == host:
+                # Still open for a chat model in use: reuse its connections
+                self._hosts[host] = self._retired.pop(index)
+                return retired
+        transport = TrackedTransport(
+            httpx.AsyncHTTPTransport(
+                http2=self.http2,
+                limits=httpx.Limits(
+                    max_connections=self.connections_per_host,
+                    max_keepalive_connections=self.connections_per_host,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+            ),
+            host=host,
+            max_connections=self.connections_per_host,
+        )
+        pool = _HostPool(host, httpx.AsyncClient(transport=transport, timeout=LLM_TIMEOUT), transport)
+        self._hosts[host] = pool
+        return pool
+
+    def _drop_client(self, key: tuple):
+        # Not keeping the entry lets an unreferenced chat model go (and its pool close) right away
+        host = self._clients.pop(key).host
+        pool = self._hosts.get(host)
+        if pool is None:
+            return
+        pool.client_keys.discard(key)
+        if not pool.client_keys:
+            del self._hosts[host]
+            if not self._close_if_idle(pool):
+                self._retired.append(pool)
+
+    @staticmethod
+    def _released(pool: _HostPool):
+        # Runs when a chat model is garbage collected; the pool is closed by the next sweep
+        pool.holders -= 1
+
+    def _sweep(self, now: float):
+        while self._clients:
+            key, entry = next(iter(self._clients.items()))
+            if now - entry.last_used < self.idle_seconds:
+                break
+            metrics.counter("llm_client_cache_evictions_total", reason="idle").inc()
+            self._drop_client(key)
+        if self._retired:
+            self._retired = [pool for pool in self._retired if not self._close_if_idle(pool)]
+        self._report()
+
+    def _close_if_idle(self, pool: _HostPool) -> bool:
+        if pool.transport.active or pool.holders:
+            return False
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Connections are only opened inside the event loop: nothing to close
+            return True
+        task = loop.create_task(pool.http_client.aclose())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+        return True
+
+    def _report(self):
+        metrics.gauge("llm_clients_cached").set(len(self._clients))
+        metrics.gauge("llm_host_pools").set(len(self._hosts))
+        metrics.gauge("llm_host_pools_retired").set(len(self._retired))
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self._clients),
+            "hosts": {
+                pool.host: {
+                    "clients": len(pool.client_keys), "live_clients": pool.holders,
+                    "open_responses": pool.transport.active,
+                }
+                for pool in self._hosts.values()
+            },
+            "retired_pools": len(self._retired),
+        }
+
+    async def aclose(self):
+        """Closes every pool (on shutdown)."""
+        pools = [*self._hosts.values(), *self._retired]
+        self._clients.clear()
+        self._hosts.clear()
+        self._retired.clear()
+        await asyncio.gather(*(pool.http_client.aclose() for pool in pools), return_exceptions=True)
+
+
+class LLMPriority(IntEnum):
+    """Scheduling classes of LLM calls, most urgent first."""
+    INTERACTIVE = 0  # routing and diagram generation a user is waiting for
+    EXTRACTION = 1   # per-chunk document extraction
+    SYNTHESIS = 2    # merging extracted chunks into one document
+
+
+# Session on whose behalf LLM calls are made (set by the chat pipeline, inherited by child tasks)
+current_llm_session: ContextVar[str | None] = ContextVar("current_llm_session", default=None)
+
+
+class LLMScheduler:
+    """Server-wide admission control for LLM calls.
+
+    At most `max_in_flight` calls run at a time across all requests. When
+    the cap is reached callers wait: the most urgent priority class is
+    served first, and within a class the waiting session with the fewest
+    calls in flight goes next (ties in arrival order), so one large
+    document upload cannot starve the other sessions.
+    """
+
+    def __init__(self, max_in_flight: int):
+        self.max_in_flight = max(1, max_in_flight)
+        self.in_flight = 0
+        self._by_session: Counter[str] = Counter()
+        # priority -> session -> waiting callers, sessions in arrival order
+        self._waiting: dict[LLMPriority, OrderedDict[str, deque[asyncio.Future]]] = {p: OrderedDict() for p in LLMPriority}
+
+    @asynccontextmanager
+    async def slot(self, priority: LLMPriority = LLMPriority.INTERACTIVE, session: str | None = None):
+        """Holds one of the in-flight slots for the duration of the block."""
+        session = session or current_llm_session.get() or "anonymous"
+        started = time.perf_counter()
+        if self.in_flight < self.max_in_flight and not self._queued(priority):
+            self._admit(session)
+        else:
+            await self._wait(priority, session)
+        metrics.histogram("llm_scheduler_wait_ms", priority=priority.name.lower()).observe((time.perf_counter() - started) * 1000)
+        try:
+            yield
+        finally:
+            self._release(session)
+
+    def _queued(self, priority: LLMPriority) -> bool:
+        """Whether callers of this or a more urgent class are already waiting."""
+        return any(self._waiting[p] for p in LLMPriority if p <= priority)
+
+    async def _wait(self, priority: LLMPriority, session: str):
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiting[priority].setdefault(session, deque()).append(waiter)
+        self._report()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted a slot just before being cancelled: pass it on
+                self._release(session)
+            else:
+                self._forget(priority, session, waiter)
+            raise
+
+    def _admit(self, session: str):
+        self.in_flight += 1
+        self._by_session[session] += 1
+        self._report()
+
+    def _release(self, session: str):
+        self.in_flight -= 1
+        self._by_session[session] -= 1
+        if self._by_session[session] <= 0:
+            del self._by_session[session]
+        self._dispatch()
+        self._report()
+
+    def _dispatch(self):
+        while self.in_flight < self.max_in_flight:
+            for priority in LLMPriority:
+                sessions = self._waiting[priority]
+                if sessions:
+                    break
+            else:
+                return
+            session = min(sessions, key=lambda s: self._by_session[s])
+            waiter = sessions[session].popleft()
+            if sessions[session]:
+                sessions.move_to_end(session)
+            else:
+                del sessions[session]
+            self._admit(session)
+            waiter.set_result(None)
+
+    def _forget(self, priority: LLMPriority, session: str, waiter: asyncio.Future):
+        waiters = self._waiting[priority].get(session)
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del self._waiting[priority][session]
+        self._report()
+
+    def _report(self):
+        metrics.gauge("llm_scheduler_in_flight").set(self.in_flight)
+        for priority, sessions in self._waiting.items():
+            metrics.gauge("llm_scheduler_queued", priority=priority.name.lower()).set(sum(len(w) for w in sessions.values()))
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "sessions": dict(self._by_session),
+            "queued": {p.name.lower(): sum(len(w) for w in s.values()) for p, s in self._waiting.items()},
+        }
+
+
+llm_scheduler = LLMScheduler(settings.LLM_MAX_IN_FLIGHT)
+
+
+llm_clients = LLMClientCache(
+    max_clients=settings.LLM_CLIENT_CACHE_SIZE,
+    idle_seconds=settings.LLM_CLIENT_IDLE_SECONDS,
+    max_hosts=settings.LLM_MAX_HOST_POOLS,
+    connections_per_host=settings.LLM_HOST_MAX_CONNECTIONS,
+    keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY_SECONDS,
+    http2=h2 is not None and settings.LLM_HTTP2.lower() != "false",
+)
+
 
 def get_llm(model_name: str | None = None, temperature: float = 0.3, api_key: str | None = None, base_url: str | None = None):
     """
@@ -41,41 +499,64 @@ def get_llm(model_name: str | None = None, temperature: float = 0.3, api_key: st
         key_hint = f"{final_api_key[:6]}...{final_api_key[-4:]}" if (final_api_key and len(final_api_key) > 10) else "REDACTED"
         
 
-        return ChatOpenAI(
-            api_key=final_api_key,
-            base_url=final_base_url,
-            model=final_model or "claude-sonnet-3.7",
-            temperature=temperature,
-            streaming=True,
-            request_timeout=120,
-            max_tokens=max_tokens
-        )
+        return _cached_chat_openai(final_api_key, final_base_url, final_model or "claude-sonnet-3.7", temperature, max_tokens)
     
 
+    # A configured provider pool takes over the server-side default
+    if provider_pool.providers:
+        return _pooled_chat_model(temperature, max_tokens)
+
     # Priority: DeepSeek if key is present
     if settings.DEEPSEEK_API_KEY:
         # Override standard OpenAI model names to DeepSeek default
         model = settings.MODEL_ID or "deepseek-chat"
         
+        return _cached_chat_openai(settings.DEEPSEEK_API_KEY, settings.DEEPSEEK_BASE_URL, model, temperature, max_tokens)
+    
+    # Fallback to OpenAI
+    return _cached_chat_openai(
+        settings.OPENAI_API_KEY,
+        settings.OPENAI_BASE_URL,
+        model_name or settings.MODEL_ID or "claude-sonnet-3.7",
+        temperature,
+        max_tokens
+    )
+
+
+def _cached_chat_openai(api_key: str, base_url: str | None, model: str, temperature: float, max_tokens: int,
+                        max_retries: int = 2) -> ChatOpenAI:
+    def build(http_client: httpx.AsyncClient) -> ChatOpenAI:
         return ChatOpenAI(
-            api_key=settings.DEEPSEEK_API_KEY,
-            base_url=settings.DEEPSEEK_BASE_URL,
+            api_key=api_key,
+            base_url=base_url,
             model=model,
             temperature=temperature,
             streaming=True,
-            request_timeout=120,
-            max_tokens=max_tokens
+            request_timeout=LLM_TIMEOUT,
+            max_tokens=max_tokens,
+            max_retries=max_retries,
+            stream_usage=settings.LLM_STREAM_USAGE.lower() == "true",
+            http_async_client=http_client
         )
-    
-    # Fallback to OpenAI
-    return ChatOpenAI(
-        api_key=settings.OPENAI_API_KEY,
-        base_url=settings.OPENAI_BASE_URL,
-        model=model_name or settings.MODEL_ID or "claude-sonnet-3.7",
-        temperature=temperature,
-        streaming=True,
-        request_timeout=120,
-        max_tokens=max_tokens
+
+    key = LLMClientCache.key(base_url, model, api_key, temperature, max_tokens, max_retries)
+    return llm_clients.get(key, base_url, build)
+
+
+def _pooled_chat_model(temperature: float, max_tokens: int) -> PooledChatModel:
+    # Pool members fail over instead of retrying the same provider
+    clients = {
+        provider.name: _cached_chat_openai(
+            provider.api_key, provider.base_url, provider.model, temperature, max_tokens,
+            max_retries=settings.LLM_PROVIDER_MAX_RETRIES
+        )
+        for provider in provider_pool.providers
+    }
+    return PooledChatModel(
+        pool=provider_pool,
+        clients=clients,
+        hedge=settings.LLM_HEDGE.lower() == "true",
+        model_name="+".join(f"{p.name}:{p.model}" for p in provider_pool.providers),
     )
 
 
@@ -96,32 +577,41 @@ def get_configured_llm(state: "AgentState", temperature: float = 0.3):
     return get_llm(temperature=temperature)
 
 
+# Header of the time section, the first part of a system prompt that is not static
+TIME_CONTEXT_HEADER = "### CURRENT TIME CONTEXT"
+
+
 def get_time_instructions() -> str:
     """
     Returns the current time context.
+
+    Day granularity: the section only changes once a day, so the prompts
+    that include it stay cacheable by the provider (see build_system_prompt).
     """
-    from datetime import datetime, timezone
-    import calendar
-    
     now = datetime.now(timezone.utc)
     day_name = calendar.day_name[now.weekday()]
-    formatted_time = now.strftime("%Y-%m-%d %H:%M:%S UTC")
-    
-    return f"\n\n### CURRENT TIME CONTEXT\n- Current Date and Time: {formatted_time}\n- Day of Week: {day_name}"
+    formatted_date = now.strftime("%Y-%m-%d")
+
+    return f"\n\n{TIME_CONTEXT_HEADER}\n- Current Date (UTC): {formatted_date}\n- Day of Week: {day_name}"
 
 def get_thinking_instructions() -> str:
     """
-    Returns system prompt instructions based on thinking verbosity setting,
-    plus the current time context.
+    Returns system prompt instructions based on thinking verbosity setting.
     """
     verbosity = settings.THINKING_VERBOSITY.lower()
-    
-    time_context = get_time_instructions()
-    thinking_part = ""
-    
+
     if verbosity == "concise":
-        thinking_part = "\n\n### THINKING PROCESS\n- Please be extremely concise in your internal thinking (<think> tags).\n- Focus ONLY on critical reasoning steps.\n- Avoid restating the obvious or verbose planning."
+        return "\n\n### THINKING PROCESS\n- Please be extremely concise in your internal thinking (<think> tags).\n- Focus ONLY on critical reasoning steps.\n- Avoid restating the obvious or verbose planning."
     elif verbosity == "verbose":
-        thinking_part = "\n\n### THINKING PROCESS\n- Please explore all possibilities in your internal thinking.\n- Verify assumptions and plan in detail."
-    
-    return thinking_part + time_context
+        return "\n\n### THINKING PROCESS\n- Please explore all possibilities in your internal thinking.\n- Verify assumptions and plan in detail."
+    return ""
+
+def build_system_prompt(static_prompt: str, *dynamic_sections: str, thinking: bool = True) -> str:
+    """
+    Lays out a system prompt for provider prompt caching (DeepSeek/OpenAI
+    prefix caching): the byte-stable parts first (the agent's prompt and
+    thinking instructions), then the time context, then the request-specific
+    sections (current code, history summaries) in the order given.
+    """
+    prefix = static_prompt + (get_thinking_instructions() if thinking else "")
+    return prefix + get_time_instructions() + "".join(dynamic_sections)
@@ -0,0 +1,113 @@
+import threading
+from collections import deque
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def snapshot(self) -> float:
+        return self.value
+
+
+class Gauge:
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def snapshot(self) -> float:
+        return self.value
+
+
+class Histogram:
+    """Running count/sum/min/max plus percentiles over the most recent samples."""
+
+    WINDOW = 1024
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min: float | None = None
+        self.max: float | None = None
+        self._recent: deque[float] = deque(maxlen=self.WINDOW)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self._recent.append(value)
+
+    def percentile(self, q: float) -> float | None:
+        if not self._recent:
+            return None
+        ordered = sorted(self._recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 3),
+            "avg": round(self.sum / self.count, 3) if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+        }
+
+
+class MetricsRegistry:
+    """In-process metrics, keyed by name and optional labels (exposed at /api/metrics)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: dict[str, dict[str, Counter | Gauge | Histogram]] = {
+            "counters": {},
+            "gauges": {},
+            "histograms": {},
+        }
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> str:
+        if not labels:
+            return name
+        label_text = ",".join(f"{k}={v}" for k, v in sorted(labels.items()))
+        return f"{name}{{{label_text}}}"
+
+    def _get(self, kind: str, factory, name: str, labels: dict):
+        key = self._key(name, labels)
+        metric = self._metrics[kind].get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics[kind].setdefault(key, factory())
+        return metric
+
+    def counter(self, name: str, **labels) -> Counter:
+        return self._get("counters", Counter, name, labels)
+
+    def gauge(self, name: str, **labels) -> Gauge:
+        return self._get("gauges", Gauge, name, labels)
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        return self._get("histograms", Histogram, name, labels)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                kind: {key: metric.snapshot() for key, metric in sorted(metrics.items())}
+                for kind, metrics in self._metrics.items()
+            }
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,293 @@
+import copy
+import json
+import re
+import xml.etree.ElementTree as ET
+
+# Patch formats: RFC 6902 JSON Patch, id-addressed Draw.io cell operations, line edits
+JSON_PATCH = "json_patch"
+DRAWIO_CELLS = "drawio_cells"
+LINE_EDITS = "line_edits"
+
+_FENCE = re.compile(r"^```\w*\s*|\s*```$")
+
+
+class PatchError(ValueError):
+    """The patch is malformed or does not apply to the code."""
+
+
+def parse_patch(text: str) -> list[dict]:
+    """The operations of a patch: a JSON array, optionally fenced as a code block."""
+    try:
+        ops = json.loads(_FENCE.sub("", text.strip()))
+    except json.JSONDecodeError as e:
+        raise PatchError(f"patch is not valid JSON: {e}") from e
+    if isinstance(ops, dict):
+        ops = [ops]
+    if not isinstance(ops, list) or not all(isinstance(op, dict) for op in ops):
+        raise PatchError("patch must be a JSON array of operations")
+    return ops
+
+
+def apply_patch(patch_format: str, code: str, ops: list[dict]) -> str:
+    """Applies `ops` to `code`; raises PatchError if any operation fails (nothing is applied)."""
+    if not ops:
+        raise PatchError("patch has no operations")
+    if patch_format == JSON_PATCH:
+        return apply_json_patch(code, ops)
+    if patch_format == DRAWIO_CELLS:
+        return apply_drawio_ops(code, ops)
+    if patch_format == LINE_EDITS:
+        return apply_line_edits(code, ops)
+    raise PatchError(f"unknown patch format {patch_format!r}")
+
+
+# --- JSON Patch (flowchart, charts) ---
+
+def _pointer(path) -> list[str]:
+    if not isinstance(path, str):
+        raise PatchError(f"JSON pointer must be a string, got {path!r}")
+    if path == "":
+        return []
+    if not path.startswith("/"):
+        raise PatchError(f"invalid JSON pointer {path!r}")
+    return [token.replace("~1", "/").replace("~0", "~") for token in path[1:].split("/")]
+
+
+def _index(container: list, token: str, allow_end: bool = False) -> int:
+    if allow_end and token == "-":
+        return len(container)
+    if not token.isdigit():
+        raise PatchError(f"invalid array index {token!r}")
+    index = int(token)
+    if index > len(container) or (index == len(container) and not allow_end):
+        raise PatchError(f"array index {index} out of range")
+    return index
+
+
+def _resolve(doc, tokens: list[str]):
+    for token in tokens:
+        if isinstance(doc, list):
+            doc = doc[_index(doc, token)]
+        elif isinstance(doc, dict):
+            if token not in doc:
+                raise PatchError(f"path member {token!r} not found")
+            doc = doc[token]
+        else:
+            raise PatchError(f"cannot descend into {type(doc).__name__} at {token!r}")
+    return doc
+
+
+def _add(doc, tokens: list[str], value):
+    if not tokens:
+        return value
+    parent = _resolve(doc, tokens[:-1])
+    if isinstance(parent, list):
+        parent.insert(_index(parent, tokens[-1], allow_end=True), value)
+    elif isinstance(parent, dict):
+        parent[tokens[-1]] = value
+    else:
+        raise PatchError(f"cannot add to {type(parent).__name__}")
+    return doc
+
+
+def _remove(doc, tokens: list[str]):
+    if not tokens:
+        raise PatchError("cannot remove the whole document")
+    parent = _resolve(doc, tokens[:-1])
+    if isinstance(parent, list):
+        return parent.pop(_index(parent, tokens[-1]))
+    if isinstance(parent, dict) and tokens[-1] in parent:
+        return parent.pop(tokens[-1])
+    raise PatchError(f"path member {tokens[-1]!r} not found")
+
+
+def apply_json_patch(code: str, ops: list[dict]) -> str:
+    """Applies RFC 6902 operations (add, remove, replace, move, copy, test) to a JSON document."""
+    try:
+        doc = json.loads(code)
+    except json.JSONDecodeError as e:
+        raise PatchError(f"current code is not valid JSON: {e}") from e
+    for op in ops:
+        name = op.get("op")
+        if "path" not in op:
+            raise PatchError(f"operation {name!r} has no path")
+        tokens = _pointer(op["path"])
+        if name == "add":
+            doc = _add(doc, tokens, op.get("value"))
+        elif name == "remove":
+            _remove(doc, tokens)
+        elif name == "replace":
+            _resolve(doc, tokens)
+            if tokens:
+                _remove(doc, tokens)
+            doc = _add(doc, tokens, op.get("value"))
+        elif name in ("move", "copy"):
+            source = _pointer(op.get("from", ""))
+            value = _remove(doc, source) if name == "move" else copy.deepcopy(_resolve(doc, source))
+            doc = _add(doc, tokens, value)
+        elif name == "test":
+            if _resolve(doc, tokens) != op.get("value"):
+                raise PatchError(f"test failed at {op['path']!r}")
+        else:
+            raise PatchError(f"unknown JSON Patch operation {name!r}")
+    return json.dumps(doc, indent=2, ensure_ascii=False)
+
+
+# --- Draw.io cell operations ---
+
+def _cells_root(tree: ET.Element) -> ET.Element:
+    model = tree if tree.tag == "mxGraphModel" else tree.find(".//mxGraphModel")
+    root = model.find("root") if model is not None else None
+    if root is None:
+        # Compressed <diagram> content cannot be edited cell by cell
+        raise PatchError("no uncompressed <mxGraphModel><root> in the diagram")
+    return root
+
+
+def _parse_cells(xml) -> list[ET.Element]:
+    if not isinstance(xml, str):
+        raise PatchError("cell XML must be a string")
+    try:
+        return list(ET.fromstring(f"<root>{xml}</root>"))
+    except ET.ParseError as e:
+        raise PatchError(f"invalid cell XML: {e}") from e
+
+
+def _cell(root: ET.Element, cell_id: str) -> ET.Element:
+    for element in root:
+        if element.get("id") == cell_id:
+            return element
+    raise PatchError(f"cell {cell_id!r} not found")
+
+
+def _mx_cell(element: ET.Element) -> ET.Element:
+    """The mxCell of a root child (cells with metadata are wrapped in <UserObject>/<object>)."""
+    if element.tag == "mxCell":
+        return element
+    mx = element.find("mxCell")
+    return mx if mx is not None else element
+
+
+def _delete_cell(root: ET.Element, cell_id: str):
+    """Removes a cell with its children and the edges connected to any of them."""
+    removed = {cell_id}
+    _cell(root, cell_id)
+    changed = True
+    while changed:
+        changed = False
+        for element in list(root):
+            mx = _mx_cell(element)
+            if element.get("id") in removed:
+                root.remove(element)
+                changed = True
+            elif {mx.get("parent"), mx.get("source"), mx.get("target")} & removed:
+                removed.add(element.get("id"))
+                root.remove(element)
+                changed = True
+
+
+def apply_drawio_ops(code: str, ops: list[dict]) -> str:
+    """Applies cell operations to Draw.io XML.
+
+    - `{"op": "add", "xml": "<mxCell .../>"}`: appends new cells.
+    - `{"op": "update", "id": ..., "attributes": {...}, "geometry": {...}}`:
+      sets (or with null, removes) attributes of the cell and its mxGeometry.
+    - `{"op": "replace", "id": ..., "xml": "<mxCell .../>"}`: swaps a cell.
+    - `{"op": "delete", "id": ...}`: removes a cell, its children and its edges.
+    """
+    try:
+        tree = ET.fromstring(code)
+    except ET.ParseError as e:
+        raise PatchError(f"current diagram is not valid XML: {e}") from e
+    root = _cells_root(tree)
+    for op in ops:
+        name = op.get("op")
+        if name == "add":
+            existing = {element.get("id") for element in root}
+            for cell in _parse_cells(op.get("xml", "")):
+                if cell.get("id") in existing:
+                    raise PatchError(f"cell {cell.get('id')!r} already exists")
+                existing.add(cell.get("id"))
+                root.append(cell)
+        elif name == "update":
+            element = _cell(root, str(op.get("id")))
+            for field in ("attributes", "geometry"):
+                if not isinstance(op.get(field) or {}, dict):
+                    raise PatchError(f"{field!r} of an update must be an object")
+            for target, values in ((element, op.get("attributes") or {}), (None, op.get("geometry") or {})):
+                if target is None and values:
+                    mx = _mx_cell(element)
+                    target = mx.find("mxGeometry")
+                    if target is None:
+                        target = ET.SubElement(mx, "mxGeometry", {"as": "geometry"})
+                for key, value in values.items():
+                    if value is None:
+                        target.attrib.pop(key, None)
+                    else:
+                        target.set(key, str(value))
+        elif name == "replace":
+            element = _cell(root, str(op.get("id")))
+            cells = _parse_cells(op.get("xml", ""))
+            if len(cells) != 1:
+                raise PatchError("replace takes exactly one cell")
+            index = list(root).index(element)
+            root.remove(element)
+            root.insert(index, cells[0])
+        elif name == "delete":
+            _delete_cell(root, str(op.get("id")))
+        else:
+            raise PatchError(f"unknown cell operation {name!r}")
+    return ET.tostring(tree, encoding="unicode")
+
+
+# --- Line edits (Mermaid, mind map Markdown, infographic DSL) ---
+
+def number_lines(code: str) -> str:
+    """The code with 1-based line numbers, as line edits address it."""
+    lines = code.split("\n")
+    width = len(str(len(lines)))
+    return "\n".join(f"{i:>{width}}| {line}" for i, line in enumerate(lines, 1))
+
+
+def apply_line_edits(code: str, ops: list[dict]) -> str:
+    """Applies line edits addressed by the 1-based line numbers of the current code.
+
+    - `{"op": "replace", "start": a, "end": b, "lines": [...]}`
+    - `{"op": "insert", "after": n, "lines": [...]}` (n = 0 inserts at the top)
+    - `{"op": "delete", "start": a, "end": b}`
+
+    Ranges are inclusive and must not overlap; `end` defaults to `start`.
+    """
+    lines = code.split("\n")
+    edits = []
+    for op in ops:
+        name = op.get("op")
+        new_lines = op.get("lines", [])
+        if isinstance(new_lines, str):
+            new_lines = new_lines.split("\n")
+        elif not isinstance(new_lines, list):
+            raise PatchError(f"lines of {name!r} must be a list or a string")
+        try:
+            if name == "insert":
+                start = int(op["after"]) + 1
+                end = start - 1
+            elif name in ("replace", "delete"):
+                start = int(op["start"])
+                end = int(op.get("end", start))
+                if name == "delete":
+                    new_lines = []
+            else:
+                raise PatchError(f"unknown line operation {name!r}")
+        except (KeyError, TypeError, ValueError) as e:
+            raise PatchError(f"invalid {name!r} operation: {op}") from e
+        if not 1 <= start <= len(lines) + 1 or end < start - 1 or end > len(lines):
+            raise PatchError(f"lines {start}-{end} out of range (1-{len(lines)})")
+        edits.append((start, end, [str(line) for line in new_lines]))
+
+    edits.sort(key=lambda edit: (edit[0], edit[1]))
+    for (start, end, _), (next_start, next_end, _) in zip(edits, edits[1:]):
+        if next_start <= end or (next_start == start and next_end == end):
+            raise PatchError(f"overlapping edits at line {next_start}")
+    for start, end, new_lines in reversed(edits):
+        lines[start - 1:end] = new_lines
+    return "\n".join(lines)
@@ -0,0 +1,255 @@
+import asyncio
+import json
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator
+import httpx
+import openai
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.metrics import metrics
+
+# Consecutive failures after which a provider is skipped for LLM_PROVIDER_COOLDOWN_SECONDS
+CIRCUIT_FAILURES = 3
+# Weight of the latest outcome in the error rate (exponentially weighted)
+ERROR_RATE_ALPHA = 0.2
+# TTFT samples kept per provider, and needed before the p95 is trusted
+TTFT_WINDOW = 100
+TTFT_MIN_SAMPLES = 10
+
+# Inner calls run without the caller's callbacks: only the pooled model's own run
+# reports tokens, so graph streaming sees each token once
+_QUIET_CONFIG = {"callbacks": []}
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Errors another provider may not have: connectivity, timeouts, 408/409/429 and 5xx."""
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return isinstance(error, (openai.APIConnectionError, httpx.TransportError, asyncio.TimeoutError))
+
+
+class ProviderHealth:
+    """Recent error rate and time-to-first-token of one provider."""
+
+    def __init__(self):
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.ttft: deque[float] = deque(maxlen=TTFT_WINDOW)
+
+    def success(self, ttft: float | None = None):
+        self.error_rate *= 1 - ERROR_RATE_ALPHA
+        self.consecutive_failures = 0
+        if ttft is not None:
+            self.ttft.append(ttft)
+
+    def failure(self):
+        self.error_rate = self.error_rate * (1 - ERROR_RATE_ALPHA) + ERROR_RATE_ALPHA
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= CIRCUIT_FAILURES:
+            self.open_until = time.monotonic() + settings.LLM_PROVIDER_COOLDOWN_SECONDS
+
+    def ttft_p95(self) -> float | None:
+        if len(self.ttft) < TTFT_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.ttft)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    @property
+    def degraded(self) -> bool:
+        p95 = self.ttft_p95()
+        return (
+            self.open_until > time.monotonic()
+            or self.error_rate >= 0.5
+            or (p95 is not None and p95 > settings.LLM_PROVIDER_SLOW_TTFT_SECONDS)
+        )
+
+    @property
+    def score(self) -> float:
+        """0 (circuit open) to 1 (no recent errors)."""
+        return 0.0 if self.open_until > time.monotonic() else round(1 - self.error_rate, 3)
+
+
+@dataclass
+class Provider:
+    name: str
+    base_url: str | None
+    api_key: str
+    model: str
+    health: ProviderHealth = field(default_factory=ProviderHealth)
+
+
+class ProviderPool:
+    """The server's LLM providers, in fallback order.
+
+    Configured with LLM_PROVIDERS, a JSON list of
+    {"name", "base_url", "api_key", "model"} objects. Healthy providers are
+    tried in the configured order; degraded ones (circuit open after
+    repeated failures, high recent error rate or slow p95 time to first
+    token) are moved behind them.
+    """
+
+    def __init__(self, providers: list[Provider]):
+        self.providers = providers
+
+    @classmethod
+    def from_settings(cls) -> "ProviderPool":
+        if not settings.LLM_PROVIDERS:
+            return cls([])
+        try:
+            entries = json.loads(settings.LLM_PROVIDERS)
+            providers = [
+                Provider(
+                    name=entry.get("name") or entry.get("base_url") or f"provider-{i}",
+                    base_url=entry.get("base_url"),
+                    api_key=entry["api_key"],
+                    model=entry.get("model") or settings.MODEL_ID,
+                )
+                for i, entry in enumerate(entries)
+            ]
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.error(f"Invalid LLM_PROVIDERS, ignoring it: {e}")
+            return cls([])
+        return cls(providers)
+
+    def ordered(self) -> list[Provider]:
+        healthy = [p for p in self.providers if not p.health.degraded]
+        degraded = sorted((p for p in self.providers if p.health.degraded), key=lambda p: p.health.error_rate)
+        return healthy + degraded
+
+    def report(self, provider: Provider):
+        metrics.gauge("llm_provider_health", provider=provider.name).set(provider.health.score)
+
+
+provider_pool = ProviderPool.from_settings()
+
+
+class PooledChatModel(BaseChatModel):
+    """Chat model that spreads calls over a provider pool.
+
+    Calls fail over to the next provider on retryable errors raised before
+    the first token (a stream cannot switch providers once tokens have been
+    delivered). With hedging, a stream whose provider has not produced a
+    token within its p95 time to first token (bounded by
+    LLM_HEDGE_MIN_DELAY_MS and LLM_HEDGE_MAX_DELAY_MS) gets a second
+    request to the next provider; the first to stream wins and the other
+    is cancelled.
+    """
+
+    pool: Any
+    # One chat model per pool provider, in pool order
+    clients: dict[str, Any]
+    hedge: bool = False
+    model_name: str = ""
+
+    @property
+    def _llm_type(self) -> str:
+        return "provider-pool"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        raise NotImplementedError("PooledChatModel only supports async calls")
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        providers = self.pool.ordered()
+        for i, provider in enumerate(providers):
+            started = time.monotonic()
+            try:
+                message = await self.clients[provider.name].ainvoke(messages, config=_QUIET_CONFIG, stop=stop, **kwargs)
+            except Exception as e:
+                self._failed(provider, e)
+                if not is_retryable(e) or i == len(providers) - 1:
+                    raise
+                metrics.counter("llm_provider_failovers_total", provider=provider.name).inc()
+                continue
+            self._succeeded(provider, time.monotonic() - started)
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        stream, first = await self._open_stream(messages, stop, kwargs)
+        if first is None:
+            return
+        try:
+            yield ChatGenerationChunk(message=first)
+            async for chunk in stream:
+                yield ChatGenerationChunk(message=chunk)
+        finally:
+            await stream.aclose()
+
+    async def _open_stream(self, messages, stop, kwargs) -> tuple[AsyncIterator[AIMessageChunk], AIMessageChunk | None]:
+        """Starts streams until one yields its first chunk; returns that stream and chunk."""
+        remaining = self.pool.ordered()
+        attempts: dict[asyncio.Task, tuple[Provider, Any, float]] = {}
+        hedged = False
+
+        def launch():
+            provider = remaining.pop(0)
+            stream = self.clients[provider.name].astream(messages, config=_QUIET_CONFIG, stop=stop, **kwargs)
+            attempts[asyncio.ensure_future(stream.__anext__())] = (provider, stream, time.monotonic())
+
+        launch()
+        try:
+            while attempts:
+                deadline = None
+                if self.hedge and not hedged and remaining:
+                    deadline = self._hedge_delay(next(iter(attempts.values()))[0])
+                done, _ = await asyncio.wait(attempts, timeout=deadline, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # No token within the deadline: race the next provider
+                    hedged = True
+                    metrics.counter("llm_hedges_total", provider=remaining[0].name).inc()
+                    logger.info(f"🏁 No first token within {deadline:.2f}s, hedging with {remaining[0].name}")
+                    launch()
+                    continue
+                for task in done:
+                    provider, stream, started = attempts.pop(task)
+                    try:
+                        first = task.result()
+                    except StopAsyncIteration:
+                        first = None
+                    except Exception as e:
+                        self._failed(provider, e)
+                        await stream.aclose()
+                        if not is_retryable(e) or not (remaining or attempts):
+                            raise
+                        if not attempts:
+                            metrics.counter("llm_provider_failovers_total", provider=provider.name).inc()
+                            launch()
+                        continue
+                    self._succeeded(provider, time.monotonic() - started)
+                    if hedged:
+                        metrics.counter("llm_hedge_wins_total", provider=provider.name).inc()
+                    return stream, first
+        finally:
+            # Losing (or abandoned) attempts: stop their provider streams
+            for task, (_, stream, _) in attempts.items():
+                task.cancel()
+            for task, (_, stream, _) in attempts.items():
+                try:
+                    await task
+                except BaseException:
+                    pass
+                await stream.aclose()
+        return None, None
+
+    def _hedge_delay(self, provider: Provider) -> float:
+        p95 = provider.health.ttft_p95()
+        if p95 is None:
+            return settings.LLM_HEDGE_MAX_DELAY_MS / 1000
+        return min(max(p95, settings.LLM_HEDGE_MIN_DELAY_MS / 1000), settings.LLM_HEDGE_MAX_DELAY_MS / 1000)
+
+    def _succeeded(self, provider: Provider, ttft: float):
+        provider.health.success(ttft)
+        metrics.counter("llm_provider_requests_total", provider=provider.name, outcome="ok").inc()
+        metrics.histogram("llm_provider_ttft_ms", provider=provider.name).observe(ttft * 1000)
+        self.pool.report(provider)
+
+    def _failed(self, provider: Provider, error: BaseException):
+        provider.health.failure()
+        metrics.counter("llm_provider_requests_total", provider=provider.name, outcome="error").inc()
+        logger.warning(f"LLM provider {provider.name} failed: {error}")
+        self.pool.report(provider)
@@ -0,0 +1,199 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict, deque
+from email.utils import parsedate_to_datetime
+import httpx
+from app.core.config import settings
+from app.core.metrics import metrics
+
+# Burst allowance of a bucket, in seconds of its rate
+BURST_SECONDS = 2.0
+# AIMD: rate multiplier on a 429, additive recovery per successful request, floor
+DECREASE_FACTOR = 0.5
+INCREASE_STEP = 0.05
+MIN_SCALE = 0.05
+# 429s within this many seconds of a decrease belong to the same burst
+DECREASE_COOLDOWN = 1.0
+# Window used to learn the sustainable rate when no budget is configured
+OBSERVATION_SECONDS = 60.0
+# Token estimate for an image part (the base64 payload says little about its cost)
+IMAGE_TOKENS = 1000
+
+
+class TokenBucket:
+    """Reservation-based token bucket.
+
+    `reserve` always succeeds and returns how long the caller must wait: the
+    balance may go negative, so concurrent callers queue in arrival order
+    instead of failing.
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate * BURST_SECONDS
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float, now: float) -> float:
+        capacity = self.rate * BURST_SECONDS
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class AdaptiveRateLimiter:
+    """Request and token budgets of one (provider, API key), adjusted with AIMD.
+
+    Budgets start at LLM_RATE_LIMIT_RPM / LLM_RATE_LIMIT_TPM. A 429 halves
+    them (multiplicative decrease) and holds every caller until the
+    provider's Retry-After has passed; each successful request then gives
+    back a small fraction of the configured rate (additive increase). A
+    budget that is not configured is learned on the first 429: half the
+    rate observed over the last minute; until then only Retry-After gates
+    on it.
+    """
+
+    def __init__(self, name: str, rpm: float, tpm: float):
+        self.name = name
+        self.base_rpm = rpm
+        self.base_tpm = tpm
+        self.scale = 1.0
+        self.requests = TokenBucket(rpm / 60) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm / 60) if tpm > 0 else None
+        self.blocked_until = 0.0
+        self.decreased_at = float("-inf")
+        self.queued = 0
+        self._recent: deque[tuple[float, float]] = deque()
+
+    async def acquire(self, tokens: float):
+        """Waits for a request slot and `tokens` of token budget."""
+        now = time.monotonic()
+        wait = max(0.0, self.blocked_until - now)
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1, now))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.reserve(tokens, now))
+        self._observe(now, tokens)
+        if wait > 0:
+            self.queued += 1
+            metrics.gauge("llm_rate_limit_queued", limiter=self.name).set(self.queued)
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self.queued -= 1
+                metrics.gauge("llm_rate_limit_queued", limiter=self.name).set(self.queued)
+        metrics.histogram("llm_rate_limit_wait_ms", limiter=self.name).observe(wait * 1000)
+
+    def throttled(self, retry_after: float | None):
+        """A 429: halve the budgets and hold callers until `retry_after` seconds from now."""
+        now = time.monotonic()
+        metrics.counter("llm_rate_limited_total", limiter=self.name).inc()
+        if retry_after is not None:
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+        if now - self.decreased_at < DECREASE_COOLDOWN:
+            return
+        self.decreased_at = now
+        if self.requests is None or self.tokens is None:
+            # Learn the budgets that are not configured from the traffic that hit the limit;
+            # configured ones keep their base and are only scaled down below
+            requests, tokens = self._observed(now)
+            if self.requests is None:
+                self.base_rpm = max(1.0, requests)
+                self.requests = TokenBucket(self.base_rpm / 60)
+            if self.tokens is None and tokens:
+                self.base_tpm = max(1.0, tokens)
+                self.tokens = TokenBucket(self.base_tpm / 60)
+        self._rescale(max(MIN_SCALE, self.scale * DECREASE_FACTOR))
+
+    def succeeded(self):
+        if self.scale < 1.0:
+            self._rescale(min(1.0, self.scale + INCREASE_STEP))
+
+    def _rescale(self, scale: float):
+        self.scale = scale
+        if self.requests is not None:
+            self.requests.rate = self.base_rpm / 60 * scale
+        if self.tokens is not None:
+            self.tokens.rate = self.base_tpm / 60 * scale
+        metrics.gauge("llm_rate_limit_scale", limiter=self.name).set(round(scale, 3))
+
+    def _observe(self, now: float, tokens: float):
+        self._recent.append((now, tokens))
+        while self._recent and self._recent[0][0] < now - OBSERVATION_SECONDS:
+            self._recent.popleft()
+
+    def _observed(self, now: float) -> tuple[float, float]:
+        """Requests and tokens per minute over the observation window."""
+        window = min(OBSERVATION_SECONDS, max(1.0, now - self._recent[0][0])) if self._recent else OBSERVATION_SECONDS
+        scale = 60 / window
+        return len(self._recent) * scale, sum(t for _, t in self._recent) * scale
+
+
+class RateLimiterRegistry:
+    """One AdaptiveRateLimiter per (provider host, API key), least recently used evicted."""
+
+    def __init__(self, max_limiters: int = 256):
+        self.max_limiters = max_limiters
+        self._limiters: OrderedDict[tuple, AdaptiveRateLimiter] = OrderedDict()
+
+    def for_request(self, host: str, request: httpx.Request) -> AdaptiveRateLimiter:
+        authorization = request.headers.get("authorization", "")
+        key_hash = hashlib.sha256(authorization.encode()).hexdigest()[:8] if authorization else "anonymous"
+        key = (host, key_hash)
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            limiter = AdaptiveRateLimiter(f"{host}#{key_hash}", settings.LLM_RATE_LIMIT_RPM, settings.LLM_RATE_LIMIT_TPM)
+            self._limiters[key] = limiter
+            while len(self._limiters) > self.max_limiters:
+                self._limiters.popitem(last=False)
+        self._limiters.move_to_end(key)
+        return limiter
+
+
+def estimate_tokens(request: httpx.Request) -> float:
+    """Rough prompt size of a chat completion request (4 characters per token)."""
+    try:
+        body = json.loads(request.content)
+    except (ValueError, httpx.RequestNotRead):
+        return 0.0
+    if not isinstance(body, dict):
+        return 0.0
+    chars = 0
+    images = 0
+    for message in body.get("messages") or []:
+        content = message.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    chars += len(part.get("text", ""))
+                else:
+                    images += 1
+    return chars / 4 + images * IMAGE_TOKENS
+
+
+def retry_after_seconds(response: httpx.Response) -> float | None:
+    """The provider's requested back-off: retry-after-ms, or Retry-After as seconds or an HTTP date."""
+    value = response.headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+rate_limiters = RateLimiterRegistry()
@@ -0,0 +1,212 @@
+import asyncio
+import json
+import time
+from typing import Any, AsyncGenerator, AsyncIterator
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+# (event name, payload) pairs produced by the chat pipeline
+SSEEvent = tuple[str, dict[str, Any]]
+
+
+def _escape_line_separators(data: bytes) -> bytes:
+    # U+2028/U+2029 are valid raw JSON but end a line for JS regexes on the client
+    if b"\xe2\x80" in data:
+        data = data.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+    return data
+
+
+_json_encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+_json_encode_str = json.encoder.encode_basestring
+
+
+def _json_dumps(obj: Any) -> bytes:
+    return _escape_line_separators(_json_encode(obj).encode("utf-8"))
+
+
+def _json_dumps_str(value: str) -> bytes:
+    return _escape_line_separators(_json_encode_str(value).encode("utf-8"))
+
+
+def _orjson_dumps(obj: Any) -> bytes:
+    return _escape_line_separators(orjson.dumps(obj))
+
+
+class SSEEncoder:
+    """Encodes (event, payload) pairs into Server-Sent Events frames as bytes.
+
+    One encoder is used per stream. Streaming deltas look like
+    `{"content": <delta>, "session_id": 1, ...}` where everything except the
+    delta is constant for the stream, so the frame head and the encoded
+    envelope fields are cached and only the delta string is escaped per
+    frame. Other payloads are serialized as a whole.
+    """
+
+    # Bound on cached envelopes per stream; payloads only vary in a few fields
+    MAX_CACHED_ENVELOPES = 256
+
+    def __init__(self, backend: str = "auto"):
+        if backend == "json" or orjson is None:
+            self._dumps, self._dumps_str = _json_dumps, _json_dumps_str
+        else:
+            self._dumps = self._dumps_str = _orjson_dumps
+        # (event, envelope items) -> (frame head up to the content value, frame tail)
+        self._delta_frames: dict[tuple, tuple[bytes, bytes]] = {}
+        self._heads: dict[str, bytes] = {}
+
+    def _build_delta_frame(self, key: tuple) -> tuple[bytes, bytes]:
+        if len(self._delta_frames) >= self.MAX_CACHED_ENVELOPES:
+            self._delta_frames.clear()
+        event, envelope = key
+        head = f"event: {event}\ndata: {{\"content\":".encode("utf-8")
+        # '{"a":1}' -> ',"a":1}' so it can follow the content field
+        tail = (b"," + self._dumps(dict(envelope))[1:] if envelope else b"}") + b"\n\n"
+        frame = self._delta_frames[key] = (head, tail)
+        return frame
+
+    def encode(self, event: str, payload: dict[str, Any]) -> bytes:
+        items = tuple(payload.items())
+        if items and items[0][0] == "content" and type(items[0][1]) is str:
+            key = (event, items[1:])
+            try:
+                frame = self._delta_frames.get(key) or self._build_delta_frame(key)
+            except TypeError:  # unhashable envelope values
+                frame = None
+            if frame is not None:
+                return frame[0] + self._dumps_str(items[0][1]) + frame[1]
+
+        head = self._heads.get(event)
+        if head is None:
+            head = self._heads[event] = f"event: {event}\ndata: ".encode("utf-8")
+        return head + self._dumps(payload) + b"\n\n"
+
+
+class SSECoalescer:
+    """Merges consecutive streaming deltas into fewer, larger SSE frames.
+
+    Delta events (see MERGEABLE_EVENTS) are buffered per (event, non-content
+    fields) key and released when the buffered payload reaches `max_bytes`,
+    when `flush_interval_ms` has passed since the first buffered delta, or
+    when any other event arrives. The last rule keeps state transitions
+    (e.g. `design_concept_end`, `tool_end`) strictly ordered after the
+    content that precedes them.
+    """
+
+    MERGEABLE_EVENTS = {"tool_code", "design_concept", "thought", "thinking", "doc_analysis_chunk"}
+
+    def __init__(self, flush_interval_ms: int, max_bytes: int):
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_bytes = max_bytes
+        # key -> (event, payload template, content parts)
+        self._pending: dict[tuple, tuple[str, dict[str, Any], list[str]]] = {}
+        self._pending_event: str | None = None
+        self._pending_bytes = 0
+        self._first_pending_at = 0.0
+
+    def _merge_key(self, event: str, payload: dict[str, Any]) -> tuple | None:
+        if event not in self.MERGEABLE_EVENTS:
+            return None
+        content = payload.get("content")
+        if not isinstance(content, str) or not content:
+            return None
+        if event == "doc_analysis_chunk" and payload.get("status") != "running":
+            return None
+        return (event,) + tuple(sorted((k, v) for k, v in payload.items() if k != "content"))
+
+    def push(self, event: str, payload: dict[str, Any]) -> list[SSEEvent]:
+        """Adds an event and returns the frames that are ready to be sent."""
+        key = self._merge_key(event, payload)
+        if key is None:
+            return self.flush() + [(event, payload)]
+
+        ready = []
+        # Switching between delta types is a state transition: flush first
+        if self._pending_event is not None and self._pending_event != event:
+            ready = self.flush()
+
+        content = payload["content"]
+        if key in self._pending:
+            self._pending[key][2].append(content)
+        else:
+            self._pending[key] = (event, payload, [content])
+        if self._pending_event is None:
+            self._pending_event = event
+            self._first_pending_at = time.monotonic()
+        self._pending_bytes += len(content.encode("utf-8"))
+
+        if self._pending_bytes >= self.max_bytes or self.time_until_flush() == 0:
+            ready += self.flush()
+        return ready
+
+    def flush(self) -> list[SSEEvent]:
+        """Releases all buffered deltas in arrival order."""
+        if not self._pending:
+            return []
+        ready = [
+            (event, {**payload, "content": "".join(parts)})
+            for event, payload, parts in self._pending.values()
+        ]
+        self._pending = {}
+        self._pending_event = None
+        self._pending_bytes = 0
+        return ready
+
+    def time_until_flush(self) -> float | None:
+        """Seconds until the buffered deltas are due, or None if nothing is buffered."""
+        if self._pending_event is None:
+            return None
+        return max(0.0, self._first_pending_at + self.flush_interval - time.monotonic())
+
+
+async def coalesce_events(
+    source: AsyncIterator[SSEEvent],
+    flush_interval_ms: int,
+    max_bytes: int,
+) -> AsyncGenerator[SSEEvent, None]:
+    """Coalescing stage between the chat pipeline and the SSE writer.
+
+    Buffered deltas are flushed on a timer as well, so a stalled upstream
+    never holds back content that has already been generated. A non-positive
+    `flush_interval_ms` disables coalescing entirely.
+    """
+    if flush_interval_ms <= 0:
+        async for item in source:
+            yield item
+        return
+
+    coalescer = SSECoalescer(flush_interval_ms, max_bytes)
+    next_item: asyncio.Future | None = None
+    try:
+        while True:
+            if next_item is None:
+                next_item = asyncio.ensure_future(source.__anext__())
+            done, _ = await asyncio.wait({next_item}, timeout=coalescer.time_until_flush())
+            if not done:
+                for item in coalescer.flush():
+                    yield item
+                continue
+
+            finished, next_item = next_item, None
+            try:
+                event, payload = finished.result()
+            except StopAsyncIteration:
+                break
+            for item in coalescer.push(event, payload):
+                yield item
+
+        for item in coalescer.flush():
+            yield item
+    finally:
+        # Let the upstream generator run its own cleanup (e.g. partial saves)
+        if next_item is not None and not next_item.done():
+            next_item.cancel()
+            try:
+                await next_item
+            except (asyncio.CancelledError, StopAsyncIteration, Exception):
+                pass
+        aclose = getattr(source, "aclose", None)
+        if aclose is not None:
+            await aclose()
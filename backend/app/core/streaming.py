@@ -0,0 +1,370 @@
+import re
+from langchain_core.messages import AIMessageChunk
+from langchain_core.messages.ai import add_ai_message_chunks
+from langchain_core.runnables import RunnableConfig
+
+# Run config key under which the route hands its ResponseCollector to the agent nodes
+RESPONSE_COLLECTOR_KEY = "response_collector"
+
+
+def _partial_tag_len(text: str, tag: str) -> int:
+    """Length of the longest suffix of `text` that is a proper prefix of `tag`.
+
+    All tags we look for contain a single '<', so a partial tag can only start
+    at the last '<' within the final len(tag) - 1 characters.
+    """
+    start = text.rfind('<', max(0, len(text) - len(tag) + 1))
+    if start == -1:
+        return 0
+    if tag.startswith(text[start:]):
+        return len(text) - start
+    return 0
+
+
+class StreamingTagParser:
+    """Parse streaming output with <design_concept> and <code> XML-style tags.
+
+    State transitions: INIT -> DESIGN_CONCEPT -> CODE -> DONE
+
+    The parser is cursor based: every chunk is scanned once, and only a short
+    tail that could be the beginning of a tag split across chunk boundaries is
+    carried over to the next call. Section content is emitted with the same
+    trimming as `str.strip()` on the full section: leading whitespace is
+    dropped and trailing whitespace is held back until more text follows it.
+    """
+
+    # States
+    STATE_INIT = 0
+    STATE_DESIGN_CONCEPT = 1
+    STATE_CODE = 2
+    STATE_DONE = 3
+
+    DC_START_TAG = '<design_concept>'
+    DC_END_TAG = '</design_concept>'
+    CODE_START_TAG = '<code>'
+    CODE_END_TAG = '</code>'
+
+    def __init__(self):
+        self.state = self.STATE_INIT
+        # Unscanned text that may hold the beginning of a tag
+        self._tail = ""
+        # True once <code> has been seen while in STATE_CODE
+        self._in_code = False
+        self._dc_parts: list[str] = []
+        self._code_parts: list[str] = []
+        # Per-section whitespace trimming state
+        self._section_started = False
+        self._held_ws = ""
+
+    @property
+    def design_concept(self) -> str:
+        return self._joined(self._dc_parts)
+
+    @property
+    def code(self) -> str:
+        return self._joined(self._code_parts)
+
+    @staticmethod
+    def _joined(parts: list[str]) -> str:
+        if len(parts) > 1:
+            parts[:] = ["".join(parts)]
+        return parts[0] if parts else ""
+
+    def _append(self, parts: list[str], text: str) -> str:
+        """Append section text, returning the part that can be emitted now."""
+        if not text:
+            return ""
+        if not self._section_started:
+            text = text.lstrip()
+            if not text:
+                return ""
+            self._section_started = True
+        stripped = text.rstrip()
+        if not stripped:
+            self._held_ws += text
+            return ""
+        out = self._held_ws + stripped
+        self._held_ws = text[len(stripped):]
+        parts.append(out)
+        return out
+
+    def _end_section(self):
+        self._section_started = False
+        self._held_ws = ""
+
+    def _scan(self, text: str, events: list, final: bool = False):
+        """Advance the state machine over `text`, appending events."""
+        delta = []
+
+        def flush_delta(evt_type: str, is_streaming: bool):
+            content = "".join(delta)
+            delta.clear()
+            if content:
+                events.append((evt_type, content, is_streaming))
+
+        while True:
+            if self.state == self.STATE_INIT:
+                pos = text.find(self.DC_START_TAG)
+                if pos == -1:
+                    keep = 0 if final else _partial_tag_len(text, self.DC_START_TAG)
+                    self._tail = text[len(text) - keep:] if keep else ""
+                    return
+                self.state = self.STATE_DESIGN_CONCEPT
+                events.append(('design_concept_start', '', not final))
+                text = text[pos + len(self.DC_START_TAG):]
+
+            elif self.state == self.STATE_DESIGN_CONCEPT:
+                pos = text.find(self.DC_END_TAG)
+                if pos == -1:
+                    keep = 0 if final else _partial_tag_len(text, self.DC_END_TAG)
+                    delta.append(self._append(self._dc_parts, text[:len(text) - keep]))
+                    self._tail = text[len(text) - keep:] if keep else ""
+                    flush_delta('design_concept', not final)
+                    return
+                delta.append(self._append(self._dc_parts, text[:pos]))
+                flush_delta('design_concept', False)
+                events.append(('design_concept_end', '', False))
+                self._end_section()
+                self.state = self.STATE_CODE
+                text = text[pos + len(self.DC_END_TAG):]
+
+            elif self.state == self.STATE_CODE and not self._in_code:
+                pos = text.find(self.CODE_START_TAG)
+                if pos == -1:
+                    keep = 0 if final else _partial_tag_len(text, self.CODE_START_TAG)
+                    self._tail = text[len(text) - keep:] if keep else ""
+                    return
+                self._in_code = True
+                events.append(('code_start', '', not final))
+                text = text[pos + len(self.CODE_START_TAG):]
+
+            elif self.state == self.STATE_CODE:
+                pos = text.find(self.CODE_END_TAG)
+                if pos == -1:
+                    keep = 0 if final else _partial_tag_len(text, self.CODE_END_TAG)
+                    delta.append(self._append(self._code_parts, text[:len(text) - keep]))
+                    self._tail = text[len(text) - keep:] if keep else ""
+                    flush_delta('code', not final)
+                    return
+                delta.append(self._append(self._code_parts, text[:pos]))
+                flush_delta('code', False)
+                events.append(('code_end', '', False))
+                self._end_section()
+                self.state = self.STATE_DONE
+                self._tail = ""
+                return
+
+            else:
+                return
+
+    def feed(self, chunk: str) -> list:
+        """Feed a chunk and return events based on current state."""
+        events = []
+        if self.state == self.STATE_DONE or not chunk:
+            return events
+        text = self._tail + chunk if self._tail else chunk
+        self._tail = ""
+        self._scan(text, events)
+        return events
+
+    def finalize(self) -> list:
+        """Finalize parsing and emit any remaining events."""
+        events = []
+        tail, self._tail = self._tail, ""
+
+        # If still in design_concept state, close it
+        if self.state == self.STATE_DESIGN_CONCEPT:
+            self._scan(tail, events, final=True)
+            tail = ""
+            events.append(('design_concept_end', '', False))
+            self._end_section()
+            self.state = self.STATE_CODE
+            # The model may have skipped </design_concept>; recover the code block
+            dc = self.design_concept
+            pos = dc.find(self.CODE_START_TAG)
+            if pos != -1:
+                self._dc_parts[:] = [dc[:pos].strip()]
+                self._in_code = True
+                events.append(('code_start', '', False))
+                tail = dc[pos + len(self.CODE_START_TAG):]
+
+        # If in code state, finalize code; without a <code> tag (e.g. an edit-mode
+        # <patch> reply) there is no code section to end
+        if self.state == self.STATE_CODE:
+            if self._in_code:
+                self._scan(tail, events, final=True)
+                if self.state == self.STATE_CODE:
+                    events.append(('code_end', '', False))
+                    self._end_section()
+            self.state = self.STATE_DONE
+
+        return events
+
+
+class ThinkTagSplitter:
+    """Separates a leading <think>...</think> reasoning block from the answer in a stream.
+
+    Reasoning models open their response with a think block; it is only
+    recognized there (after optional whitespace), so a literal "<think>" later
+    in an answer is left alone. Events: ('thinking_start', ''),
+    ('thinking', text), ('thinking_end', '') and ('text', answer text).
+    `reasoning_tokens` counts streamed deltas that carried reasoning text
+    (providers stream one token per delta).
+    """
+
+    START_TAG = '<think>'
+    END_TAG = '</think>'
+
+    STATE_START = 0
+    STATE_THINK = 1
+    STATE_ANSWER = 2
+
+    def __init__(self):
+        self.state = self.STATE_START
+        self.reasoning_tokens = 0
+        self._tail = ""
+
+    @property
+    def in_think(self) -> bool:
+        return self.state == self.STATE_THINK
+
+    def feed(self, chunk: str) -> list:
+        events = []
+        text = self._tail + chunk if self._tail else chunk
+        self._tail = ""
+
+        if self.state == self.STATE_START:
+            stripped = text.lstrip()
+            if stripped.startswith(self.START_TAG):
+                self.state = self.STATE_THINK
+                events.append(('thinking_start', ''))
+                text = stripped[len(self.START_TAG):]
+            elif self.START_TAG.startswith(stripped):
+                # Whitespace or a partial start tag: wait for more
+                self._tail = text
+                return events
+            else:
+                self.state = self.STATE_ANSWER
+
+        if self.state == self.STATE_THINK:
+            end = text.find(self.END_TAG)
+            if end == -1:
+                keep = _partial_tag_len(text, self.END_TAG)
+                if keep:
+                    self._tail = text[-keep:]
+                    text = text[:-keep]
+                if text:
+                    self.reasoning_tokens += 1
+                    events.append(('thinking', text))
+                return events
+            if end:
+                self.reasoning_tokens += 1
+                events.append(('thinking', text[:end]))
+            events.append(('thinking_end', ''))
+            self.state = self.STATE_ANSWER
+            text = text[end + len(self.END_TAG):]
+
+        if text:
+            events.append(('text', text))
+        return events
+
+    def cut(self) -> list:
+        """Ends a think block that was cut off; a new response may open another one."""
+        events = [('thinking_end', '')] if self.state == self.STATE_THINK else []
+        self.state = self.STATE_START
+        self._tail = ""
+        return events
+
+    def finalize(self) -> list:
+        text, self._tail = self._tail, ""
+        if self.state == self.STATE_THINK:
+            self.state = self.STATE_ANSWER
+            return ([('thinking', text)] if text else []) + [('thinking_end', '')]
+        self.state = self.STATE_ANSWER
+        return [('text', text)] if text else []
+
+
+def extract_tag_fields(content: str) -> tuple[str, str]:
+    """Extract design_concept and code from XML-style tagged response."""
+    design_concept = ""
+    code = ""
+
+    # Skip a leading think block (see ThinkTagSplitter) without rewriting the text
+    if re.match(r'\s*<think>', content):
+        think_end = content.find(ThinkTagSplitter.END_TAG)
+        content = content[think_end + len(ThinkTagSplitter.END_TAG):] if think_end != -1 else ""
+
+    # Extract design_concept
+    dc_match = re.search(r'<design_concept>\s*([\s\S]*?)\s*</design_concept>', content)
+    if dc_match:
+        design_concept = dc_match.group(1).strip()
+
+    # Extract code
+    code_match = re.search(r'<code>\s*([\s\S]*?)\s*</code>', content)
+    if code_match:
+        code = code_match.group(1).strip()
+
+    return design_concept, code
+
+
+class ResponseCollector:
+    """Collects a streamed chat model response without re-merging it per token.
+
+    `AIMessageChunk.__add__` rebuilds the content string and merges all
+    metadata on every addition, which is quadratic in the response length.
+    Text deltas are appended to a list instead, chunks that carry anything
+    besides text (usage, finish reason, tool call deltas) are kept aside, and
+    the final message is materialized once. The route hands its collector to
+    the agent through the run config, so each response is buffered once.
+    """
+
+    def __init__(self):
+        self._parts: list[str] = []
+        self._first: AIMessageChunk | None = None
+        self._extra: list[AIMessageChunk] = []
+        self._text: str | None = None
+
+    @classmethod
+    def from_config(cls, config: RunnableConfig | None) -> "ResponseCollector":
+        """The collector passed in the run config, or a fresh one."""
+        collector = ((config or {}).get("configurable") or {}).get(RESPONSE_COLLECTOR_KEY)
+        return collector if collector is not None else cls()
+
+    def add(self, chunk: AIMessageChunk):
+        content = chunk.content
+        if not isinstance(content, str):
+            # Content blocks are merged with the rest of the metadata
+            self._extra.append(chunk)
+            return
+        if content:
+            self._parts.append(content)
+            self._text = None
+        if self._first is None:
+            self._first = chunk
+        elif (chunk.additional_kwargs or chunk.tool_call_chunks or chunk.usage_metadata
+              or chunk.response_metadata != self._first.response_metadata):
+            self._extra.append(chunk.model_copy(update={"content": ""}))
+
+    def add_text(self, text: str):
+        """Appends text that did not come from the model (e.g. closing a cut-off block)."""
+        if text:
+            self._parts.append(text)
+            self._text = None
+
+    @property
+    def text(self) -> str:
+        """The text received so far (joined lazily and cached until the next delta)."""
+        if self._text is None:
+            self._text = "".join(self._parts)
+            self._parts = [self._text] if self._text else []
+        return self._text
+
+    def __bool__(self) -> bool:
+        return bool(self._parts)
+
+    def message(self) -> AIMessageChunk | None:
+        """Materializes the full message, keeping the id of the streamed chunks."""
+        if self._first is None:
+            return add_ai_message_chunks(*self._extra) if self._extra else None
+        message = self._first.model_copy(update={"content": self.text})
+        return add_ai_message_chunks(message, *self._extra) if self._extra else message
@@ -29,6 +29,13 @@ from app.core.database import init_db
 async def on_startup():
     await init_db()
 
+@app.on_event("shutdown")
+async def on_shutdown():
+    from app.services.generation import generation_registry
+    from app.core.llm import llm_clients
+    await generation_registry.shutdown()
+    await llm_clients.aclose()
+
 @app.get("/")
 async def root():
     return {"message": "DeepDiagram API is running"}
@@ -0,0 +1,13 @@
+from datetime import datetime
+from sqlmodel import Field, SQLModel
+from app.models.chat import utc_now
+
+class LLMResponseCacheEntry(SQLModel, table=True):
+    """Second-tier (shared between workers) entry of the LLM response cache."""
+    __tablename__ = "llm_response_cache"
+
+    key: str = Field(primary_key=True, max_length=64)
+    namespace: str = Field(index=True)
+    value: str
+    expires_at: datetime = Field(index=True)
+    created_at: datetime = Field(default_factory=utc_now)
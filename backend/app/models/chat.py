@@ -42,3 +42,36 @@ class ChatMessage(SQLModel, table=True):
         if dt.tzinfo is None:
             return dt.replace(tzinfo=timezone.utc).isoformat().replace("+00:00", "Z")
         return dt.isoformat().replace("+00:00", "Z")
+
+class HistorySummary(SQLModel, table=True):
+    """Rolling summary of a session's early turns, folded out of the prompt history.
+
+    A summary covers the branch up to and including `through_message_id`;
+    later summaries extend earlier ones, so each branch reuses the newest
+    summary that ends on one of its messages.
+    """
+    __tablename__ = "history_summary"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    session_id: int = Field(foreign_key="chatsession.id", index=True)
+    through_message_id: int = Field(foreign_key="chatmessage.id", index=True)
+    summary: str
+    created_at: datetime = Field(default_factory=utc_now)
+
+class SessionArtifact(SQLModel, table=True):
+    """Where the code an assistant message produced is, indexed for the current-artifact lookup.
+
+    One row per assistant message with a tool output, written with the
+    message. The code itself stays in the message's steps; the row points
+    at it by `step_index`. A branch's current artifact of an agent is its
+    latest row among the branch's messages (see ChatService.get_branch_artifacts).
+    """
+    __tablename__ = "session_artifact"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    session_id: int = Field(foreign_key="chatsession.id")
+    message_id: int = Field(foreign_key="chatmessage.id", unique=True)
+    agent: str
+    turn_index: int = Field(default=0)
+    step_index: int
+    created_at: datetime = Field(default_factory=utc_now)
@@ -0,0 +1,16 @@
+from typing import Optional
+from datetime import datetime
+from sqlmodel import Field, SQLModel, Column, LargeBinary
+from app.models.chat import utc_now
+
+class ImageBlob(SQLModel, table=True):
+    """An uploaded image, stored once per content hash, and its resized variants."""
+    __tablename__ = "image_blob"
+
+    hash: str = Field(primary_key=True, max_length=64)  # sha256 of the original bytes
+    variant: str = Field(primary_key=True, max_length=32)  # "original" or e.g. "1568px-q85"
+    mime: str
+    data: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    width: Optional[int] = None
+    height: Optional[int] = None
+    created_at: datetime = Field(default_factory=utc_now)
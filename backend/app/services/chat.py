@@ -1,6 +1,25 @@
-from sqlmodel import select
+from dataclasses import dataclass
+from sqlmodel import func, select
 from sqlmodel.ext.asyncio.session import AsyncSession
-from app.models.chat import ChatSession, ChatMessage
+from app.models.chat import ChatSession, ChatMessage, HistorySummary, SessionArtifact
+
+
+def artifact_step(steps: list | None) -> int | None:
+    """Index of the step holding the code an assistant message produced: its last tool output."""
+    for index in range(len(steps or []) - 1, -1, -1):
+        step = steps[index]
+        if step.get("type") == "tool_end" and step.get("content"):
+            return index
+    return None
+
+
+@dataclass
+class BranchArtifact:
+    """An agent's current code on a branch."""
+    agent: str
+    message_id: int
+    turn_index: int
+    code: str
 
 class ChatService:
     def __init__(self, session: AsyncSession):
@@ -51,6 +70,14 @@ class ChatService:
             turn_index=turn_index
         )
         self.session.add(message)
+
+        # Index the produced code for the current-artifact lookup
+        step_index = artifact_step(steps) if role == "assistant" and agent else None
+        if step_index is not None:
+            await self.session.flush()
+            self.session.add(SessionArtifact(
+                session_id=session_id, message_id=message.id, agent=agent, turn_index=turn_index, step_index=step_index
+            ))
         
         # Update session updated_at
         from datetime import datetime, timezone
@@ -78,11 +105,51 @@ class ChatService:
             await self.session.refresh(message)
         return message
 
+    async def get_message(self, message_id: int) -> ChatMessage | None:
+        statement = select(ChatMessage).where(ChatMessage.id == message_id)
+        result = await self.session.exec(statement)
+        return result.first()
+
+    async def get_latest_reply(self, parent_id: int) -> ChatMessage | None:
+        statement = select(ChatMessage).where(ChatMessage.parent_id == parent_id).order_by(ChatMessage.id.desc())
+        result = await self.session.exec(statement)
+        return result.first()
+
     async def get_history(self, session_id: int):
         statement = select(ChatMessage).where(ChatMessage.session_id == session_id).order_by(ChatMessage.created_at)
         result = await self.session.exec(statement)
         return result.all()
 
+    async def get_branch_artifacts(self, session_id: int, messages: list[ChatMessage]) -> dict[str, BranchArtifact]:
+        """The latest artifact of each agent among a branch's (loaded) messages, by agent.
+
+        The index only says which message and step hold the code; the code
+        is read from the messages' steps.
+        """
+        by_id = {message.id: message for message in messages}
+        if not by_id:
+            return {}
+        ranked = (
+            select(
+                SessionArtifact.id,
+                func.row_number().over(
+                    partition_by=SessionArtifact.agent, order_by=SessionArtifact.turn_index.desc()
+                ).label("rank"),
+            )
+            .where(SessionArtifact.session_id == session_id, SessionArtifact.message_id.in_(list(by_id)))
+            .subquery()
+        )
+        statement = select(SessionArtifact).join(ranked, SessionArtifact.id == ranked.c.id).where(ranked.c.rank == 1)
+        result = await self.session.exec(statement)
+        artifacts = {}
+        for row in result.all():
+            steps = by_id[row.message_id].steps or []
+            if row.step_index < len(steps) and steps[row.step_index].get("content"):
+                artifacts[row.agent] = BranchArtifact(
+                    row.agent, row.message_id, row.turn_index, steps[row.step_index]["content"]
+                )
+        return artifacts
+
     async def get_all_sessions(self):
         statement = select(ChatSession).order_by(ChatSession.updated_at.desc())
         result = await self.session.exec(statement)
@@ -95,6 +162,13 @@ class ChatService:
         
         from sqlmodel import delete
         
+        # Delete artifacts and history summaries (they reference messages)
+        artifact_statement = delete(SessionArtifact).where(SessionArtifact.session_id == session_id)
+        await self.session.exec(artifact_statement)
+
+        summary_statement = delete(HistorySummary).where(HistorySummary.session_id == session_id)
+        await self.session.exec(summary_statement)
+
         # Delete messages
         msg_statement = delete(ChatMessage).where(ChatMessage.session_id == session_id)
         await self.session.exec(msg_statement)
@@ -6,10 +6,12 @@ import fitz  # PyMuPDF
 import pandas as pd
 from docx import Document
 from pptx import Presentation
-from app.core.llm import get_llm
+from app.core.llm import LLMPriority, get_llm, llm_scheduler
 from langchain_core.messages import SystemMessage, HumanMessage
+from app.core.config import settings
 from app.core.logger import logger
 from app.core.llm import get_time_instructions
+from app.services.generation import LLM_STAGE_KEY, generation_callbacks
 
 class FileParsingService:
     @staticmethod
@@ -86,7 +88,8 @@ class LLMExtractionService:
             if asyncio.iscoroutine(res): await res
 
         queue = asyncio.Queue()
-        semaphore = asyncio.Semaphore(concurrency)
+        # `concurrency` comes from the client: bound it
+        semaphore = asyncio.Semaphore(max(1, min(concurrency, settings.EXTRACTION_MAX_CONCURRENCY)))
         
         # Track completed chunks to know when to stop
         # We'll put a special sentinel per chunk or just track count in the consumer?
@@ -117,11 +120,15 @@ class LLMExtractionService:
                     
                     # Stream the response for this chunk
                     full_content = ""
-                    async for delta in self.llm.astream(messages):
-                        content = delta.content
-                        if content:
-                            full_content += content
-                            await queue.put({"index": index, "content": content, "status": "running"})
+                    async with llm_scheduler.slot(LLMPriority.EXTRACTION):
+                        async for delta in self.llm.astream(messages, config={
+                            "callbacks": generation_callbacks(),
+                            "metadata": {LLM_STAGE_KEY: "extraction", "llm_chunk": index},
+                        }):
+                            content = delta.content
+                            if content:
+                                full_content += content
+                                await queue.put({"index": index, "content": content, "status": "running"})
                     
                     # Signal chunk completion
                     await queue.put({"index": index, "content": "", "status": "done", "full_content": full_content})
@@ -177,11 +184,27 @@ class LLMExtractionService:
                 HumanMessage(content=f"Partial Summaries:\n\n{combined_summaries}")
             ]
             
-            # Stream synthesis
-            async for delta in self.llm.astream(final_messages):
-                content = delta.content
-                if content:
-                    yield {"index": -1, "content": content, "status": "running"}
+            # Stream synthesis from a producer task, so the scheduler slot is not held
+            # while the consumer of this generator is suspended
+            async def synthesize():
+                try:
+                    async with llm_scheduler.slot(LLMPriority.SYNTHESIS):
+                        async for delta in self.llm.astream(final_messages, config={
+                            "callbacks": generation_callbacks(),
+                            "metadata": {LLM_STAGE_KEY: "synthesis"},
+                        }):
+                            if delta.content:
+                                await queue.put({"index": -1, "content": delta.content, "status": "running"})
+                finally:
+                    await queue.put(None)
+
+            synthesis_task = asyncio.create_task(synthesize())
+            try:
+                while (item := await queue.get()) is not None:
+                    yield item
+                await synthesis_task
+            finally:
+                synthesis_task.cancel()
             
             yield {"index": -1, "content": "", "status": "done"}
 
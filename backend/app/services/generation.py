@@ -0,0 +1,450 @@
+import asyncio
+import json
+import time
+import uuid
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, AsyncGenerator, AsyncIterator, Callable
+from uuid import UUID
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.outputs import LLMResult
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.core.config import settings
+from app.core.database import async_session
+from app.core.llm import current_llm_session
+from app.core.logger import logger
+from app.core.metrics import metrics
+from app.core.sse import SSEEvent, SSEEncoder, coalesce_events
+
+# Builds the chat pipeline for a generation, given a database session owned by the generation
+PipelineFactory = Callable[[AsyncSession], AsyncIterator[SSEEvent]]
+
+# The generation whose pipeline is running in the current task (inherited by child tasks)
+current_generation: ContextVar["Generation | None"] = ContextVar("current_generation", default=None)
+
+# Run metadata naming the stage an LLM call is accounted to (defaults to the graph node)
+LLM_STAGE_KEY = "llm_stage"
+# Run tag of chat models that re-emit another call's output and must not be metered twice
+UNMETERED_TAG = "unmetered"
+# Characters per token when a provider reports no usage
+CHARS_PER_TOKEN = 4
+
+
+class LLMStreamTracker(AsyncCallbackHandler):
+    """Tracks the tasks that are currently running chat model calls.
+
+    Cancelling the consumer of `graph.astream` does not stop graph
+    nodes that are mid-stream, so the provider keeps generating. Cancelling
+    the tracked tasks directly interrupts the stream inside the client's
+    `async with` block, which closes the HTTP response to the provider.
+    Runs inline so `asyncio.current_task()` is the task making the call.
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self._tasks: dict[UUID, asyncio.Task] = {}
+
+    async def on_chat_model_start(self, serialized: dict[str, Any], messages: list, *, run_id: UUID, **kwargs: Any):
+        task = asyncio.current_task()
+        if task is not None:
+            self._tasks[run_id] = task
+
+    async def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any):
+        self._tasks.pop(run_id, None)
+
+    async def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._tasks.pop(run_id, None)
+
+    def cancel_all(self) -> int:
+        tasks = set(self._tasks.values())
+        self._tasks.clear()
+        current = asyncio.current_task()
+        for task in tasks:
+            if task is not current and not task.done():
+                task.cancel()
+        return len(tasks)
+
+
+def _load_prices() -> dict[str, dict]:
+    if not settings.LLM_PRICES:
+        return {}
+    try:
+        prices = json.loads(settings.LLM_PRICES)
+        return {model: {k: float(v) for k, v in price.items()} for model, price in prices.items()}
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.error(f"Invalid LLM_PRICES, ignoring it: {e}")
+        return {}
+
+
+LLM_PRICES = _load_prices()
+
+
+def _text_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def _prompt_tokens(messages: list) -> int:
+    chars = 0
+    for message in messages:
+        content = message.content
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            chars += sum(len(part.get("text", "")) for part in content if isinstance(part, dict))
+    return -(-chars // CHARS_PER_TOKEN)
+
+
+class LLMUsageTracker(AsyncCallbackHandler):
+    """Token usage and cost of the LLM calls made for one generation.
+
+    Each call is accounted to a stage: the `llm_stage` run metadata when the
+    caller sets it (extraction, synthesis, template selection, speculative
+    runs), otherwise the graph node making the call. Counts come from the
+    usage the provider reports on the response (including streamed
+    responses, see LLM_STREAM_USAGE); calls without it, and calls cut short
+    before the provider's final chunk, are estimated from the text and
+    flagged as such.
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self._running: dict[UUID, dict] = {}
+        self.calls: list[dict] = []
+
+    async def on_chat_model_start(self, serialized: dict[str, Any], messages: list, *, run_id: UUID,
+                                  tags: list[str] | None = None, metadata: dict[str, Any] | None = None, **kwargs: Any):
+        if tags and UNMETERED_TAG in tags:
+            return
+        metadata = metadata or {}
+        self._running[run_id] = {
+            "stage": metadata.get(LLM_STAGE_KEY) or metadata.get("langgraph_node") or "other",
+            "chunk": metadata.get("llm_chunk"),
+            "model": (kwargs.get("invocation_params") or {}).get("model") or metadata.get("ls_model_name"),
+            "prompt_tokens": _prompt_tokens(messages[0]) if messages else 0,
+            "started": time.perf_counter(),
+        }
+
+    async def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id, response, "ok")
+
+    async def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        # Aborted streams (cancellation, reasoning cut-off) still cost their prompt and partial output
+        self._finish(run_id, kwargs.get("response"), "error" if isinstance(error, Exception) else "aborted")
+
+    def _finish(self, run_id: UUID, response: LLMResult | None, status: str):
+        run = self._running.pop(run_id, None)
+        if run is None:
+            return
+        generation = response.generations[0][0] if response and response.generations and response.generations[0] else None
+        message = getattr(generation, "message", None)
+        usage = getattr(message, "usage_metadata", None)
+        call = {
+            "stage": run["stage"],
+            "model": (message.response_metadata.get("model_name") if message else None) or run["model"],
+            "status": status,
+            "duration_ms": round((time.perf_counter() - run["started"]) * 1000),
+        }
+        if run["chunk"] is not None:
+            call["chunk"] = run["chunk"]
+        if usage:
+            call["input_tokens"] = usage.get("input_tokens", 0)
+            call["output_tokens"] = usage.get("output_tokens", 0)
+            call["cached_tokens"] = (usage.get("input_token_details") or {}).get("cache_read", 0)
+        else:
+            call["input_tokens"] = run["prompt_tokens"]
+            call["output_tokens"] = _text_tokens(generation.text) if generation else 0
+            call["cached_tokens"] = 0
+            call["estimated"] = True
+        call["cost"] = _cost(call)
+        self.calls.append(call)
+        for kind in ("input", "output", "cached"):
+            metrics.counter("llm_tokens_total", stage=call["stage"], kind=kind).inc(call[f"{kind}_tokens"])
+        if usage and call["input_tokens"]:
+            # Share of the prompt served from the provider's prefix cache
+            metrics.histogram("llm_prompt_cache_hit_ratio", stage=call["stage"]).observe(call["cached_tokens"] / call["input_tokens"])
+
+    def totals(self) -> dict:
+        return _aggregate(self.calls)
+
+    def summary(self) -> dict:
+        """Totals, per-stage totals (most expensive first) and the individual calls."""
+        stages: dict[str, list[dict]] = {}
+        for call in self.calls:
+            stages.setdefault(call["stage"], []).append(call)
+        by_stage = sorted(
+            ((stage, _aggregate(calls)) for stage, calls in stages.items()),
+            key=lambda item: item[1]["input_tokens"] + item[1]["output_tokens"], reverse=True
+        )
+        return {"total": self.totals(), "stages": dict(by_stage), "calls": self.calls}
+
+
+def _cost(call: dict) -> float | None:
+    price = LLM_PRICES.get(call["model"] or "")
+    if price is None:
+        return None
+    cached = call["cached_tokens"]
+    return round((
+        (call["input_tokens"] - cached) * price.get("input", 0)
+        + cached * price.get("cached_input", price.get("input", 0))
+        + call["output_tokens"] * price.get("output", 0)
+    ) / 1_000_000, 6)
+
+
+def _aggregate(calls: list[dict]) -> dict:
+    costs = [call["cost"] for call in calls if call["cost"] is not None]
+    # Estimated calls carry no cache information
+    reported_input = sum(call["input_tokens"] for call in calls if not call.get("estimated"))
+    cached = sum(call["cached_tokens"] for call in calls)
+    return {
+        "calls": len(calls),
+        "input_tokens": sum(call["input_tokens"] for call in calls),
+        "output_tokens": sum(call["output_tokens"] for call in calls),
+        "cached_tokens": cached,
+        "cache_hit_rate": round(cached / reported_input, 3) if reported_input else None,
+        "estimated": any(call.get("estimated") for call in calls),
+        # Unknown when no call's model has a price
+        "cost": round(sum(costs), 6) if costs else None,
+    }
+
+
+def generation_callbacks() -> list:
+    """Callbacks to attach to LLM calls made on behalf of the current generation."""
+    generation = current_generation.get()
+    return [generation.llm_tracker, generation.usage] if generation else []
+
+
+class Generation:
+    """A single in-flight chat generation and the frames it has produced.
+
+    Frames are numbered with monotonically increasing SSE ids and kept in a
+    bounded ring buffer, so a client that reconnects with `Last-Event-ID`
+    can replay what it missed and then follow the live stream.
+    """
+
+    STATUS_RUNNING = "running"
+    STATUS_COMPLETED = "completed"
+    STATUS_CANCELLED = "cancelled"
+    STATUS_FAILED = "failed"
+
+    def __init__(self, generation_id: str, buffer_size: int):
+        self.id = generation_id
+        self.frames: deque[tuple[int, bytes]] = deque(maxlen=buffer_size)
+        self.last_event_id = 0
+        self.done = False
+        self.status = self.STATUS_RUNNING
+        self.cancel_requested = False
+        self.subscribers = 0
+        self.task: asyncio.Task | None = None
+        self.llm_tracker = LLMStreamTracker()
+        self.usage = LLMUsageTracker()
+        self._new_frame = asyncio.Event()
+        # Result bookkeeping, filled in from the events the pipeline emits
+        self.session_id: int | None = None
+        self.user_message_id: int | None = None
+        self.assistant_message_id: int | None = None
+        self.agent: str | None = None
+        self.error: str | None = None
+
+    def observe(self, event: str, payload: dict):
+        """Records result metadata from a pipeline event."""
+        if payload.get("session_id"):
+            self.session_id = payload["session_id"]
+        if event == "message_created":
+            if payload.get("role") == "assistant":
+                self.assistant_message_id = payload.get("id")
+            else:
+                self.user_message_id = payload.get("id")
+        elif event == "agent_selected":
+            self.agent = payload.get("agent")
+        elif event == "error":
+            self.error = payload.get("message")
+
+    def to_dict(self) -> dict:
+        return {
+            "generation_id": self.id,
+            "status": self.status,
+            "session_id": self.session_id,
+            "user_message_id": self.user_message_id,
+            "assistant_message_id": self.assistant_message_id,
+            "agent": self.agent,
+            "error": self.error,
+            "last_event_id": self.last_event_id,
+            "usage": self.usage.totals(),
+        }
+
+    def publish(self, frame: bytes):
+        self.last_event_id += 1
+        self.frames.append((self.last_event_id, b"id: %d\n" % self.last_event_id + frame))
+        self._wake()
+
+    def finish(self, status: str):
+        self.status = status
+        self.done = True
+        self._wake()
+
+    def _wake(self):
+        waiter, self._new_frame = self._new_frame, asyncio.Event()
+        waiter.set()
+
+    def frames_after(self, event_id: int) -> list[bytes]:
+        """Buffered frames with an id greater than `event_id`, oldest first."""
+        count = min(self.last_event_id - event_id, len(self.frames))
+        return [self.frames[-i][1] for i in range(count, 0, -1)]
+
+    async def subscribe(self, last_event_id: int = 0) -> AsyncGenerator[bytes, None]:
+        """Replays frames after `last_event_id`, then follows the live stream."""
+        self.subscribers += 1
+        cursor = last_event_id
+        try:
+            if self.frames and cursor + 1 < self.frames[0][0]:
+                # Older frames were evicted from the ring buffer
+                yield SSEEncoder().encode("replay_gap", {
+                    "generation_id": self.id,
+                    "last_event_id": cursor,
+                    "first_available_id": self.frames[0][0],
+                })
+            while True:
+                waiter = self._new_frame
+                for frame in self.frames_after(cursor):
+                    yield frame
+                cursor = self.last_event_id
+                if self.done:
+                    return
+                await waiter.wait()
+        finally:
+            self.subscribers -= 1
+
+
+class IdempotencyConflict(ValueError):
+    """An Idempotency-Key reused for a request with a different scope."""
+
+
+class GenerationRegistry:
+    """Process-wide registry of generations that clients can (re)attach to.
+
+    A generation runs as its own task with its own database session, detached
+    from the HTTP connection that started it: it runs to completion and
+    persists the assistant message even if every client has gone away.
+    Finished generations stay attachable for `GENERATION_RETENTION_SECONDS`
+    so clients can replay the stream or fetch the result.
+    """
+
+    def __init__(self):
+        self._generations: dict[str, Generation] = {}
+        # Idempotency-Key -> (request scope, generation), kept for IDEMPOTENCY_TTL_SECONDS
+        self._idempotency_keys: dict[str, tuple[tuple, Generation]] = {}
+
+    def get(self, generation_id: str) -> Generation | None:
+        return self._generations.get(generation_id)
+
+    def start(self, pipeline: PipelineFactory, coalesce_ms: int, session: str | None = None) -> Generation:
+        """Starts a generation; its LLM calls are scheduled as `session`'s (a new session: its own)."""
+        generation = Generation(uuid.uuid4().hex, settings.SSE_RESUME_BUFFER_FRAMES)
+        self._generations[generation.id] = generation
+        generation.task = asyncio.create_task(self._run(generation, pipeline, coalesce_ms, session or generation.id))
+        return generation
+
+    def start_once(
+        self, key: str, scope: tuple, pipeline: PipelineFactory, coalesce_ms: int, session: str | None = None
+    ) -> tuple[Generation, bool]:
+        """Single-flight start: the generation already started with `key`, or a new one.
+
+        Returns the generation and whether it was already running (or done)
+        for an earlier request. The key is bound to the request scope
+        (session and parent message); reusing it for another scope raises
+        IdempotencyConflict.
+        """
+        entry = self._idempotency_keys.get(key)
+        if entry is not None:
+            entry_scope, generation = entry
+            if entry_scope != scope:
+                metrics.counter("idempotency_conflicts_total").inc()
+                raise IdempotencyConflict(f"Idempotency-Key {key!r} was used for a different request")
+            metrics.counter("idempotency_replays_total", status=generation.status).inc()
+            logger.info(f"🔁 Idempotency-Key {key!r}: attaching to generation {generation.id}")
+            return generation, True
+
+        generation = self.start(pipeline, coalesce_ms, session)
+        self._idempotency_keys[key] = (scope, generation)
+        asyncio.get_running_loop().call_later(settings.IDEMPOTENCY_TTL_SECONDS, self._forget_key, key, generation)
+        return generation, False
+
+    def _forget_key(self, key: str, generation: Generation):
+        entry = self._idempotency_keys.get(key)
+        if entry is not None and entry[1] is generation:
+            del self._idempotency_keys[key]
+
+    async def _run(self, generation: Generation, pipeline: PipelineFactory, coalesce_ms: int, session: str):
+        encoder = SSEEncoder(settings.SSE_JSON_BACKEND)
+        generation.publish(encoder.encode("generation_started", {"generation_id": generation.id}))
+        status = Generation.STATUS_COMPLETED
+        current_generation.set(generation)
+        # Set before the pipeline starts: its steps run in tasks that copy this context
+        current_llm_session.set(session)
+        try:
+            async with async_session() as db:
+                events = coalesce_events(pipeline(db), coalesce_ms, settings.SSE_COALESCE_BYTES)
+                async for event, payload in events:
+                    generation.observe(event, payload)
+                    generation.publish(encoder.encode(event, payload))
+            if generation.cancel_requested:
+                status = Generation.STATUS_CANCELLED
+            elif generation.error:
+                status = Generation.STATUS_FAILED
+        except asyncio.CancelledError:
+            status = Generation.STATUS_CANCELLED
+            logger.info(f"🛑 Generation {generation.id} cancelled")
+        except Exception as e:
+            if generation.cancel_requested:
+                # Aborted LLM streams surface as node errors
+                status = Generation.STATUS_CANCELLED
+            else:
+                status = Generation.STATUS_FAILED
+                generation.error = str(e)
+                logger.error(f"Generation {generation.id} failed: {e}")
+                generation.publish(encoder.encode("error", {"message": str(e)}))
+        finally:
+            if status == Generation.STATUS_CANCELLED:
+                generation.publish(encoder.encode("generation_cancelled", {"generation_id": generation.id}))
+            generation.finish(status)
+            asyncio.get_running_loop().call_later(
+                settings.GENERATION_RETENTION_SECONDS, self._generations.pop, generation.id, None
+            )
+
+    async def cancel(self, generation: Generation) -> float | None:
+        """Aborts a running generation, returning the cancellation latency in ms.
+
+        Provider streams are interrupted first so their connections are
+        released, then the pipeline task is cancelled; its partial-save path
+        persists the steps produced so far. Returns None if the generation
+        had already finished.
+        """
+        if generation.done or not generation.task:
+            return None
+        started = time.perf_counter()
+        generation.cancel_requested = True
+        aborted_streams = generation.llm_tracker.cancel_all()
+        generation.task.cancel()
+        try:
+            await asyncio.wait_for(asyncio.shield(generation.task), timeout=settings.GENERATION_CANCEL_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            logger.warning(f"Generation {generation.id} did not stop within {settings.GENERATION_CANCEL_TIMEOUT_SECONDS}s")
+        except asyncio.CancelledError:
+            if not generation.task.done():
+                raise
+        latency_ms = (time.perf_counter() - started) * 1000
+        metrics.counter("generation_cancelled_total").inc()
+        metrics.histogram("generation_cancel_latency_ms").observe(latency_ms)
+        logger.info(f"🛑 Cancelled generation {generation.id} in {latency_ms:.1f}ms ({aborted_streams} LLM streams aborted)")
+        return latency_ms
+
+    async def shutdown(self):
+        """Cancels running generations so their partial results are persisted."""
+        running = [g for g in self._generations.values() if g.task and not g.done]
+        if running:
+            await asyncio.gather(*(self.cancel(g) for g in running), return_exceptions=True)
+
+
+generation_registry = GenerationRegistry()
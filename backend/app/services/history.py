@@ -0,0 +1,316 @@
+import re
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.core.config import settings
+from app.core.llm import LLMPriority, llm_scheduler
+from app.core.logger import logger
+from app.core.metrics import metrics
+from app.core.ratelimit import IMAGE_TOKENS
+from app.models.chat import ChatMessage, HistorySummary
+from app.services.generation import LLM_STAGE_KEY, generation_callbacks
+from app.services.images import ImageStore, image_store
+
+CHARS_PER_TOKEN = 4
+# Header of the message carrying the rolling summary of folded turns
+SUMMARY_HEADER = "### Earlier conversation (summary)"
+# Characters of each folded message kept when no LLM summary is available
+DIGEST_CHARS = 200
+
+SUMMARY_PROMPT = """You maintain the running summary of a conversation with a diagramming assistant.
+Merge the previous summary and the new turns into one updated summary of at most 200 words.
+Keep what later turns may refer to: the user's goals and constraints, the diagrams produced (agent and subject),
+decisions and requested changes. Do not include diagram code. Write in the language of the conversation.
+Output only the summary."""
+
+# A prompt that refers back to an image ("in the screenshot", "上图") keeps the latest earlier one
+IMAGE_REFERENCE = re.compile(
+    r"\b(image|picture|photo|screenshot|figure|sketch)s?\b|图片|截图|照片|上图|这张图", re.IGNORECASE
+)
+
+
+def message_tokens(message: BaseMessage) -> int:
+    """Rough prompt size of a message (4 characters per token, fixed cost per image)."""
+    content = message.content
+    if isinstance(content, str):
+        return -(-len(content) // CHARS_PER_TOKEN)
+    tokens = 0
+    for part in content:
+        if part.get("type") == "text":
+            tokens += -(-len(part.get("text", "")) // CHARS_PER_TOKEN)
+        else:
+            tokens += IMAGE_TOKENS
+    return tokens
+
+
+def _text(content) -> str:
+    if isinstance(content, str):
+        return content
+    return " ".join(part.get("text", "[image]") if part.get("type") == "text" else "[image]" for part in content)
+
+
+def format_user_message(msg: ChatMessage, images: list[str] | None = None) -> HumanMessage:
+    """The user message with `images` (default: the stored ones); images left out are noted in the text."""
+    if images is None:
+        images = msg.images or []
+    text = msg.content
+    omitted = len(msg.images or []) - len(images)
+    if omitted > 0:
+        text = f"{text}\n[{omitted} image(s) omitted from history]"
+    if images:
+        human_content = [{"type": "text", "text": text}]
+        for img_url in images:
+            human_content.append({"type": "image_url", "image_url": {"url": img_url}})
+        return HumanMessage(content=human_content)
+    return HumanMessage(content=text)
+
+
+def superseded_output(output: str) -> str:
+    """One-line stand-in for a tool output that a later result replaced."""
+    return f"[earlier version, {output.count(chr(10)) + 1} lines; superseded by a later result]"
+
+
+def current_output(output: str) -> str:
+    """One-line stand-in for the current artifact, given to the agent in its system prompt."""
+    return f"[current version, {output.count(chr(10)) + 1} lines; see the current code in the instructions]"
+
+
+def format_assistant_message(msg: ChatMessage, keep_output: bool = True, stand_in=superseded_output) -> AIMessage:
+    """The assistant message augmented with its execution trace (agents, tool inputs and outputs).
+
+    Without `keep_output`, tool outputs (the generated code) are replaced by
+    the one-line `stand_in`.
+    """
+    content = msg.content or ""
+    if msg.steps:
+        execution_details = []
+        last_tool_desc = ""
+
+        for s in msg.steps:
+            if s["type"] == "agent_select":
+                execution_details.append(f"agentName: {s['name']}")
+            elif s["type"] == "tool_start":
+                last_tool_desc = f"toolName: {s['name']}, toolArgs: {s.get('content', '')}"
+            elif s["type"] == "tool_end":
+                output = s.get('content', '')
+                if not keep_output and output:
+                    output = stand_in(output)
+                if last_tool_desc:
+                    # Combine start and end into a single execution line
+                    execution_details.append(f"{last_tool_desc}, toolsOutput: {output}")
+                    last_tool_desc = ""
+                else:
+                    # Fallback if no tool_start found
+                    execution_details.append(f"toolName: {s['name']}, toolsOutput: {output}")
+
+        if last_tool_desc:
+            execution_details.append(last_tool_desc)
+
+        if execution_details:
+            trace_block = "### Execution Trace:\n" + "\n".join(execution_details)
+            content = f"{content}\n\n{trace_block}" if content else trace_block
+
+    return AIMessage(content=content)
+
+
+def latest_artifact_message(branch: list[ChatMessage]) -> ChatMessage | None:
+    """The last assistant message that produced a tool output: the current artifact."""
+    for msg in reversed(branch):
+        if msg.role == "assistant" and any(s["type"] == "tool_end" and s.get("content") for s in msg.steps or []):
+            return msg
+    return None
+
+
+class HistoryBudgeter:
+    """Fits a conversation branch into a prompt-token budget.
+
+    Only the latest artifact (the last tool output) is kept verbatim; older
+    execution traces keep their agents and tool inputs but replace their
+    output with a one-line stand-in. If the branch still exceeds
+    `budget_tokens`, the most recent turns that fit are kept (always
+    including the artifact's turn) and the older ones are folded into a
+    rolling summary, stored per session in `history_summary` and extended
+    as more turns fold out. Without an LLM, or if summarizing fails, folded
+    turns become a short digest instead. Without a database session
+    (offline evaluation) summaries are neither loaded nor stored.
+
+    With `artifact_in_prompt` (the agents get the current artifacts from
+    session_artifact, see app/agents/artifacts.py), the latest artifact is
+    replaced by a stand-in as well and its turn may fold out.
+
+    With `image_turns`, earlier images are only re-sent for the last
+    `image_turns` user turns, plus the latest one when the current prompt
+    refers to an image; images the current turn sends again are not
+    repeated. Kept images are resolved to their resized variant through
+    `images` (see app/services/images.py).
+    """
+
+    def __init__(
+        self, db: AsyncSession | None, budget_tokens: int, llm=None,
+        images: ImageStore | None = None, image_turns: int = 0, artifact_in_prompt: bool = False,
+    ):
+        self.db = db
+        self.budget_tokens = budget_tokens
+        self.llm = llm
+        self.images = images
+        self.image_turns = image_turns
+        self.artifact_in_prompt = artifact_in_prompt
+
+    async def build(
+        self, session_id: int, branch: list[ChatMessage], prompt: str = "", prompt_images: list[str] | None = None
+    ) -> tuple[list[BaseMessage], dict]:
+        """Returns the formatted history and its token accounting.
+
+        `prompt` and `prompt_images` are the current turn, which decides the
+        earlier images that are re-sent.
+        """
+        artifact = latest_artifact_message(branch)
+        attached = await self._attached_images(branch, prompt, prompt_images or [])
+        full = [self._format(msg, keep_output=True) for msg in branch]
+        keep_artifact = not self.artifact_in_prompt
+        messages = [
+            self._format(
+                msg, keep_artifact and msg is artifact, attached.get(msg.id),
+                current_output if msg is artifact else superseded_output,
+            )
+            for msg in branch
+        ]
+        tokens = [message_tokens(m) for m in messages]
+
+        required = branch.index(artifact) if artifact and keep_artifact else len(branch)
+        start = self._window_start(branch, tokens, required)
+        history = messages[start:]
+        if start > 0:
+            summary = await self._summary(session_id, branch[:start], messages[:start])
+            history = [HumanMessage(content=f"{SUMMARY_HEADER}\n{summary}")] + history
+
+        stats = {
+            "full_tokens": sum(message_tokens(m) for m in full),
+            "tokens": sum(message_tokens(m) for m in history),
+            "messages": len(branch),
+            "folded_messages": start,
+            "images": sum(len(msg.images or []) for msg in branch),
+            "attached_images": sum(len(images) for images in attached.values()),
+        }
+        metrics.histogram("history_tokens", kind="full").observe(stats["full_tokens"])
+        metrics.histogram("history_tokens", kind="compacted").observe(stats["tokens"])
+        return history, stats
+
+    @staticmethod
+    def _format(
+        msg: ChatMessage, keep_output: bool, images: list[str] | None = None, stand_in=superseded_output
+    ) -> BaseMessage:
+        if msg.role == "user":
+            return format_user_message(msg, images)
+        return format_assistant_message(msg, keep_output, stand_in)
+
+    async def _attached_images(self, branch: list[ChatMessage], prompt: str, prompt_images: list[str]) -> dict:
+        """The images re-sent with each user message (by id), resolved for the LLM."""
+        with_images = [msg for msg in branch if msg.role == "user" and msg.images]
+        if self.image_turns <= 0:
+            keep = {msg.id for msg in with_images}
+        else:
+            recent_turns = [msg for msg in branch if msg.role == "user"][-self.image_turns:]
+            keep = {msg.id for msg in recent_turns if msg.images}
+            if with_images and not prompt_images and IMAGE_REFERENCE.search(prompt):
+                keep.add(with_images[-1].id)
+
+        attached = {}
+        for msg in with_images:
+            images = [image for image in msg.images if image not in prompt_images] if msg.id in keep else []
+            if self.images is not None:
+                images = [await self.images.for_llm(image) for image in images]
+            attached[msg.id] = images
+        metrics.counter("history_images_total", outcome="sent").inc(sum(len(i) for i in attached.values()))
+        metrics.counter("history_images_total", outcome="omitted").inc(
+            sum(len(msg.images) for msg in with_images) - sum(len(i) for i in attached.values())
+        )
+        return attached
+
+    def _window_start(self, branch: list[ChatMessage], tokens: list[int], artifact_index: int) -> int:
+        """Index of the oldest message kept: the latest turns within the budget, starting on a user message.
+
+        Turns from the artifact's on are kept even beyond the budget.
+        """
+        if self.budget_tokens <= 0 or sum(tokens) <= self.budget_tokens:
+            return 0
+        required = artifact_index
+        if required < len(branch):
+            while required > 0 and branch[required].role != "user":
+                required -= 1
+        start = len(branch)
+        used = 0
+        for i in range(len(branch) - 1, -1, -1):
+            used += tokens[i]
+            if used > self.budget_tokens and i < required:
+                break
+            if branch[i].role == "user":
+                start = i
+        return start
+
+    async def _summary(self, session_id: int, folded: list[ChatMessage], folded_messages: list[BaseMessage]) -> str:
+        """The rolling summary of the folded messages, extending the stored one when more have folded out."""
+        folded_ids = [msg.id for msg in folded]
+        previous = None
+        if self.db is not None:
+            try:
+                result = await self.db.exec(
+                    select(HistorySummary)
+                    .where(HistorySummary.session_id == session_id, HistorySummary.through_message_id.in_(folded_ids))
+                    .order_by(HistorySummary.through_message_id.desc())
+                )
+                previous = result.first()
+            except Exception as e:
+                logger.warning(f"Loading the history summary of session {session_id} failed: {e}")
+
+        covered = folded_ids.index(previous.through_message_id) + 1 if previous else 0
+        if covered == len(folded):
+            metrics.counter("history_summaries_total", outcome="reused").inc()
+            return previous.summary
+
+        new_messages = folded_messages[covered:]
+        if self.llm is not None:
+            try:
+                summary = await self._summarize(previous.summary if previous else "", new_messages)
+            except Exception as e:
+                logger.warning(f"Summarizing the history of session {session_id} failed: {e}")
+            else:
+                metrics.counter("history_summaries_total", outcome="extended").inc()
+                await self._store(session_id, folded_ids[-1], summary)
+                return summary
+        metrics.counter("history_summaries_total", outcome="digest").inc()
+        digest = "\n".join(
+            f"{'User' if m.type == 'human' else 'Assistant'}: {_text(m.content)[:DIGEST_CHARS]}" for m in new_messages
+        )
+        return f"{previous.summary}\n{digest}" if previous else digest
+
+    async def _store(self, session_id: int, through_message_id: int, summary: str):
+        if self.db is None:
+            return
+        try:
+            self.db.add(HistorySummary(session_id=session_id, through_message_id=through_message_id, summary=summary))
+            await self.db.commit()
+        except Exception as e:
+            # The summary is rebuilt on the next turn; the request's session must stay usable
+            await self.db.rollback()
+            logger.warning(f"Storing the history summary of session {session_id} failed: {e}")
+
+    async def _summarize(self, previous: str, messages: list[BaseMessage]) -> str:
+        turns = "\n".join(f"{'User' if m.type == 'human' else 'Assistant'}: {_text(m.content)}" for m in messages)
+        prompt = [
+            SystemMessage(content=SUMMARY_PROMPT),
+            HumanMessage(content=f"Previous summary:\n{previous or '(none)'}\n\nNew turns:\n{turns}"),
+        ]
+        async with llm_scheduler.slot(LLMPriority.INTERACTIVE):
+            response = await self.llm.ainvoke(prompt, config={
+                "callbacks": generation_callbacks(),
+                "metadata": {LLM_STAGE_KEY: "history_summary"},
+            })
+        return response.content.strip()
+
+
+def history_budgeter(db: AsyncSession, llm=None, artifact_in_prompt: bool = False) -> HistoryBudgeter:
+    return HistoryBudgeter(
+        db, settings.HISTORY_TOKEN_BUDGET, llm if settings.HISTORY_SUMMARY.lower() == "true" else None,
+        images=image_store, image_turns=settings.HISTORY_IMAGE_TURNS, artifact_in_prompt=artifact_in_prompt,
+    )
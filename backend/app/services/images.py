@@ -0,0 +1,162 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import re
+from collections import OrderedDict
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import select
+from app.core.config import settings
+from app.core.database import async_session
+from app.core.logger import logger
+from app.core.metrics import metrics
+from app.models.image import ImageBlob
+
+# Stored images are referenced by this URL (served by GET /api/images/{hash})
+IMAGE_URL_PREFIX = "/api/images/"
+ORIGINAL = "original"
+_DATA_URI = re.compile(r"^data:(?P<mime>[\w/+.-]+);base64,(?P<data>.+)$", re.DOTALL)
+
+
+def image_hash(image: str) -> str | None:
+    """The content hash of a stored image's URL, None for other references."""
+    return image[len(IMAGE_URL_PREFIX):] if image.startswith(IMAGE_URL_PREFIX) else None
+
+
+def data_uri(mime: str, data: bytes) -> str:
+    return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+def downscale(data: bytes, mime: str, max_edge: int, quality: int) -> tuple[bytes, str, int | None, int | None]:
+    """Scales an image down to `max_edge` pixels on its longer side.
+
+    Images that already fit, and formats PyMuPDF cannot decode, are
+    returned unchanged. Scaled images are re-encoded as JPEG at `quality`,
+    or as PNG when they have transparency.
+    """
+    import fitz  # PyMuPDF, also used to parse uploaded documents
+
+    try:
+        pix = fitz.Pixmap(data)
+    except Exception:
+        return data, mime, None, None
+    width, height = pix.width, pix.height
+    if max(width, height) <= max_edge:
+        return data, mime, width, height
+    scale = max_edge / max(width, height)
+    pix = fitz.Pixmap(pix, max(1, round(width * scale)), max(1, round(height * scale)), None)
+    if pix.alpha:
+        return pix.tobytes("png"), "image/png", pix.width, pix.height
+    if pix.colorspace is not None and pix.colorspace.n not in (1, 3):
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+    return pix.tobytes("jpg", jpg_quality=quality), "image/jpeg", pix.width, pix.height
+
+
+class ImageStore:
+    """Content-addressed store of chat images, with the resized variant sent to the LLM.
+
+    Uploaded data URIs are stored once per sha256 in the `image_blob`
+    table and replaced in messages by their URL, so a re-sent image costs
+    nothing to store. The variant the LLM gets (at most `max_edge` pixels,
+    JPEG `quality`) is computed once, stored next to the original, and kept
+    as a data URI in an in-process LRU. Storage is best effort: if the
+    database is unavailable the data URI is used as is.
+    """
+
+    def __init__(self, max_edge: int, quality: int, cache_size: int):
+        self.max_edge = max_edge
+        self.quality = quality
+        self.cache_size = max(1, cache_size)
+        self._variants: OrderedDict[str, str] = OrderedDict()
+
+    @property
+    def variant(self) -> str:
+        return f"{self.max_edge}px-q{self.quality}"
+
+    async def store(self, image: str) -> str:
+        """Stores an uploaded data URI; returns its URL. Other references are returned unchanged."""
+        match = _DATA_URI.match(image)
+        if not match:
+            return image
+        try:
+            data = base64.b64decode(match["data"], validate=True)
+        except (binascii.Error, ValueError):
+            return image
+        digest = hashlib.sha256(data).hexdigest()
+        statement = insert(ImageBlob).values(
+            hash=digest, variant=ORIGINAL, mime=match["mime"], data=data
+        ).on_conflict_do_nothing(index_elements=["hash", "variant"])
+        try:
+            async with async_session() as db:
+                result = await db.execute(statement)
+                await db.commit()
+        except Exception as e:
+            logger.warning(f"Storing image {digest[:12]} failed: {e}")
+            return image
+        metrics.counter("images_stored_total", outcome="new" if result.rowcount else "duplicate").inc()
+        return IMAGE_URL_PREFIX + digest
+
+    async def for_llm(self, image: str) -> str:
+        """The image as the LLM gets it: a data URI of the resized variant."""
+        image = await self.store(image)
+        digest = image_hash(image)
+        if digest is None:
+            # A remote URL, or a data URI that could not be stored
+            match = _DATA_URI.match(image)
+            if not match:
+                return image
+            data, mime, _, _ = await asyncio.to_thread(
+                downscale, base64.b64decode(match["data"]), match["mime"], self.max_edge, self.quality
+            )
+            return data_uri(mime, data)
+
+        cached = self._variants.get(digest)
+        if cached is not None:
+            self._variants.move_to_end(digest)
+            metrics.counter("image_variant_hits_total", tier="memory").inc()
+            return cached
+        blob = await self._load(digest, self.variant)
+        if blob is not None:
+            metrics.counter("image_variant_hits_total", tier="postgres").inc()
+        else:
+            original = await self._load(digest, ORIGINAL)
+            if original is None:
+                logger.warning(f"Image {digest[:12]} is missing from the image store")
+                return image
+            data, mime, width, height = await asyncio.to_thread(
+                downscale, original.data, original.mime, self.max_edge, self.quality
+            )
+            blob = ImageBlob(hash=digest, variant=self.variant, mime=mime, data=data, width=width, height=height)
+            metrics.histogram("image_downscale_ratio").observe(len(data) / max(1, len(original.data)))
+            await self._save(blob)
+        uri = data_uri(blob.mime, blob.data)
+        self._variants[digest] = uri
+        while len(self._variants) > self.cache_size:
+            self._variants.popitem(last=False)
+        return uri
+
+    async def original(self, digest: str) -> ImageBlob | None:
+        return await self._load(digest, ORIGINAL)
+
+    async def _load(self, digest: str, variant: str) -> ImageBlob | None:
+        try:
+            async with async_session() as db:
+                result = await db.exec(select(ImageBlob).where(ImageBlob.hash == digest, ImageBlob.variant == variant))
+                return result.first()
+        except Exception as e:
+            logger.warning(f"Loading image {digest[:12]} ({variant}) failed: {e}")
+            return None
+
+    async def _save(self, blob: ImageBlob):
+        statement = insert(ImageBlob).values(
+            hash=blob.hash, variant=blob.variant, mime=blob.mime, data=blob.data, width=blob.width, height=blob.height
+        ).on_conflict_do_nothing(index_elements=["hash", "variant"])
+        try:
+            async with async_session() as db:
+                await db.execute(statement)
+                await db.commit()
+        except Exception as e:
+            logger.warning(f"Storing image variant {blob.hash[:12]} ({blob.variant}) failed: {e}")
+
+
+image_store = ImageStore(settings.IMAGE_MAX_EDGE, settings.IMAGE_JPEG_QUALITY, settings.IMAGE_CACHE_SIZE)
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import select
+from langchain_core.messages import BaseMessage
+from app.core.config import settings
+from app.core.database import async_session
+from app.core.logger import logger
+from app.core.metrics import metrics
+from app.models.cache import LLMResponseCacheEntry
+from app.models.chat import utc_now
+
+
+class ResponseCache:
+    """Exact-match cache for small, deterministic LLM answers (routing, template selection).
+
+    Keys hash the namespace, prompt version, model and rendered messages, so
+    any change to the prompt or conversation is a miss. Entries live in an
+    in-process LRU with a TTL; with `persistent` they are also written to
+    the `llm_response_cache` table, which lets every worker share hits.
+    The Postgres tier is best effort: errors are logged and treated as
+    misses.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int, persistent: bool):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.persistent = persistent
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+
+    @staticmethod
+    def model_of(llm) -> str:
+        """Identifies the model answering (endpoint and model name, never the API key)."""
+        return f"{getattr(llm, 'openai_api_base', None) or ''}|{getattr(llm, 'model_name', '')}"
+
+    @staticmethod
+    def key(namespace: str, version: str, model: str, messages: list[BaseMessage]) -> str:
+        rendered = json.dumps(
+            [namespace, version, model, [(m.type, m.content) for m in messages]],
+            ensure_ascii=False, separators=(",", ":"), sort_keys=True,
+        )
+        return hashlib.sha256(rendered.encode("utf-8")).hexdigest()
+
+    async def get(self, namespace: str, key: str) -> str | None:
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                metrics.counter("response_cache_hits_total", namespace=namespace, tier="memory").inc()
+                return value
+            del self._entries[key]
+
+        if self.persistent:
+            value = await self._get_persistent(key)
+            if value is not None:
+                self._remember(key, value)
+                metrics.counter("response_cache_hits_total", namespace=namespace, tier="postgres").inc()
+                return value
+
+        metrics.counter("response_cache_misses_total", namespace=namespace).inc()
+        return None
+
+    async def set(self, namespace: str, key: str, value: str):
+        self._remember(key, value)
+        if self.persistent:
+            await self._set_persistent(namespace, key, value)
+
+    def _remember(self, key: str, value: str):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _get_persistent(self, key: str) -> str | None:
+        try:
+            async with async_session() as db:
+                statement = select(LLMResponseCacheEntry.value).where(
+                    LLMResponseCacheEntry.key == key,
+                    LLMResponseCacheEntry.expires_at > utc_now(),
+                )
+                result = await db.exec(statement)
+                return result.first()
+        except Exception as e:
+            logger.warning(f"Response cache lookup failed: {e}")
+            return None
+
+    async def _set_persistent(self, namespace: str, key: str, value: str):
+        expires_at = utc_now() + timedelta(seconds=self.ttl_seconds)
+        statement = insert(LLMResponseCacheEntry).values(
+            key=key, namespace=namespace, value=value, expires_at=expires_at, created_at=utc_now()
+        ).on_conflict_do_update(
+            index_elements=["key"],
+            set_={"value": value, "expires_at": expires_at},
+        )
+        try:
+            async with async_session() as db:
+                await db.execute(statement)
+                await db.commit()
+        except Exception as e:
+            logger.warning(f"Response cache write failed: {e}")
+
+
+response_cache = ResponseCache(
+    settings.RESPONSE_CACHE_SIZE,
+    settings.RESPONSE_CACHE_TTL_SECONDS,
+    settings.RESPONSE_CACHE_POSTGRES.lower() == "true",
+)
@@ -7,3 +7,8 @@ class AgentState(TypedDict):
     active_agent: Optional[str] = None
     intent: Optional[str] = None
     model_config: Optional[Dict[str, str]] = None
+    # Speculative run of the routed agent kept by the router (see app/agents/speculation.py)
+    speculation: Optional[Any] = None
+    # Current artifact (code) of each agent on the conversation branch, and the agent of the latest one
+    artifacts: Optional[Dict[str, str]] = None
+    artifact_agent: Optional[str] = None
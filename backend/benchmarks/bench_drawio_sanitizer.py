@@ -0,0 +1,91 @@
+"""
+Regression benchmark for Draw.io XML sanitization on pathological input.
+
+Compares the previous five-pass regex sanitizer (run once on the finished
+document) with DrawioXmlSanitizer, both on the whole document and fed in
+4-character stream deltas (split up front, so only the sanitizer is timed). The pathological cases target the backtracking
+of the old patterns: unclosed <Array> tags, <Array without a closing '/>',
+open <mxGeometry> tags followed by long whitespace, and long blank runs.
+Each input is doubled in size to show how the cost grows (~2x linear,
+~4x quadratic).
+
+Usage (from backend/):
+    python -m benchmarks.bench_drawio_sanitizer [--size 4000]
+"""
+import argparse
+import re
+import time
+
+from app.core.drawio import DrawioXmlSanitizer, sanitize_drawio_xml
+
+
+def legacy_sanitize(xml_content: str) -> str:
+    """The sanitizer previously used in routes.py."""
+    if not xml_content or '<mxfile' not in xml_content:
+        return xml_content
+    xml_content = re.sub(r'<Array[^/>]*?/>', '', xml_content, flags=re.DOTALL)
+    xml_content = re.sub(r'<Array[^>]*>[\s\S]*?</Array>', '', xml_content)
+    xml_content = re.sub(r'\s*<Array\s+points="[^"]*"\s*/>\s*', '', xml_content)
+    xml_content = re.sub(r'(<mxGeometry[^>]*>)\s+(</(mxGeometry|mxCell)>)', r'\1\2', xml_content)
+    xml_content = re.sub(r'\n\s*\n\s*\n', '\n\n', xml_content)
+    return xml_content
+
+
+def stream_deltas(xml_content: str) -> list[str]:
+    return [xml_content[i:i + 4] for i in range(0, len(xml_content), 4)]
+
+
+def streamed_sanitize(deltas: list[str]) -> str:
+    sanitizer = DrawioXmlSanitizer()
+    parts = [sanitizer.feed(delta) for delta in deltas]
+    parts.append(sanitizer.finalize())
+    return "".join(parts)
+
+
+def build_cases(size: int) -> dict[str, str]:
+    cell = (
+        '<mxCell id="e{i}" edge="1" parent="1" source="2" target="3">\n'
+        '  <mxGeometry relative="1" as="geometry">\n'
+        '    <Array points="10,20 30,40"/>\n'
+        '  </mxGeometry>\n'
+        '</mxCell>\n'
+    )
+    return {
+        "typical diagram": '<mxfile><root>' + "".join(cell.format(i=i) for i in range(size // 8)) + '</root></mxfile>',
+        "unclosed <Array>": '<mxfile>' + '<Array as="points"><mxPoint/>' * (size // 4),
+        "<Array without />": '<mxfile><Array points="' + '1,2 ' * size,
+        "open geometry + ws": '<mxfile>' + ('<mxGeometry as="geometry">' + ' ' * 40) * (size // 8),
+        "blank line runs": '<mxfile>' + '\n' + ' \n' * size * 4 + 'x',
+    }
+
+
+def measure(fn, xml: str, runs: int) -> float:
+    best = float("inf")
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn(xml)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--size", type=int, default=4000, help="base size of each pathological input")
+    args = arg_parser.parse_args()
+
+    sanitizers = (("legacy regex", legacy_sanitize), ("batch", sanitize_drawio_xml), ("streamed", streamed_sanitize))
+    print(f"{'input':<20} | {'chars':>8} | " + " | ".join(f"{name:>12}" for name, _ in sanitizers))
+    print("-" * (33 + 15 * len(sanitizers)))
+    for scale in (1, 2):
+        for name, xml in build_cases(args.size * scale).items():
+            # The legacy regexes take seconds on some inputs: measure them once
+            deltas = stream_deltas(xml)
+            timings = " | ".join(
+                f"{measure(fn, deltas if fn is streamed_sanitize else xml, 1 if fn is legacy_sanitize else 3) * 1000:>9.1f} ms"
+                for _, fn in sanitizers
+            )
+            print(f"{name:<20} | {len(xml):>8} | {timings}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Per-token CPU overhead of the chat graph streaming modes.
+
+Runs the real agent graph with a stand-in chat model (no network) and
+compares the consumer loop used previously, `astream_events(version="v1")`
+filtered by `metadata['langgraph_node']`, against the lean
+`astream(stream_mode=["messages", "custom"])` path. The Draw.io agent is
+selected explicitly via @drawio, so the router makes no LLM call.
+
+Usage (from backend/):
+    python -m benchmarks.bench_graph_streaming [--cells 1000] [--runs 3]
+"""
+import argparse
+import asyncio
+import time
+import warnings
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+
+import app.agents.drawio as drawio_module
+from app.agents.events import AGENT_END, AGENT_SELECTED
+from app.agents.graph import graph
+
+
+def install_stand_in_llm(cell_count: int):
+    body = " ".join(f'<mxCell id="{i}"/>' for i in range(cell_count))
+    response = f"<design_concept>Stand-in design.</design_concept><code>{body}</code>"
+
+    def get_stand_in_llm(state, temperature: float = 0.3):
+        return GenericFakeChatModel(messages=iter([AIMessage(content=response)]))
+
+    drawio_module.get_configured_llm = get_stand_in_llm
+
+
+def make_inputs() -> dict:
+    return {"messages": [HumanMessage(content="@drawio a web architecture")], "model_config": None}
+
+
+async def consume_events_v1() -> int:
+    tokens = 0
+    async for event in graph.astream_events(make_inputs(), version="v1"):
+        event_type = event["event"]
+        data = event["data"]
+        metadata = event.get("metadata", {})
+        node_name = metadata.get("langgraph_node", "")
+        if node_name == "router":
+            if event_type == "on_chain_end":
+                output = data.get("output")
+                if output and "intent" in output:
+                    _ = output["intent"]
+            continue
+        if node_name.endswith("_agent") and event_type == "on_chain_end":
+            pass
+        if event_type == "on_chat_model_stream":
+            chunk = data.get("chunk")
+            if chunk and chunk.content:
+                tokens += 1
+    return tokens
+
+
+async def consume_lean() -> int:
+    tokens = 0
+    async for mode, data in graph.astream(make_inputs(), stream_mode=["messages", "custom"]):
+        if mode == "custom":
+            if data.get("type") in (AGENT_SELECTED, AGENT_END):
+                pass
+            continue
+        chunk, _metadata = data
+        if chunk and chunk.content:
+            tokens += 1
+    return tokens
+
+
+async def measure(consumer, runs: int) -> tuple[int, float]:
+    best = float("inf")
+    tokens = 0
+    for _ in range(runs):
+        started = time.process_time()
+        tokens = await consumer()
+        best = min(best, time.process_time() - started)
+    return tokens, best
+
+
+async def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--cells", type=int, default=1000, help="mxCell elements streamed by the stand-in model")
+    arg_parser.add_argument("--runs", type=int, default=3, help="runs per mode (best is reported)")
+    args = arg_parser.parse_args()
+
+    warnings.filterwarnings("ignore", message=".*astream_events.*")
+    install_stand_in_llm(args.cells)
+
+    results = {
+        "astream_events(v1)": await measure(consume_events_v1, args.runs),
+        "astream(messages+custom)": await measure(consume_lean, args.runs),
+    }
+    baseline = results["astream_events(v1)"][1]
+    print(f"{'mode':<26} | {'tokens':>7} | {'CPU ms':>8} | {'us/token':>9} | {'relative':>8}")
+    print("-" * 70)
+    for name, (tokens, cpu) in results.items():
+        print(f"{name:<26} | {tokens:>7} | {cpu * 1000:>8.1f} | {cpu / max(tokens, 1) * 1e6:>9.1f} | {cpu / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+"""
+Prompt-token reduction of the history budgeter on recorded sessions.
+
+For every session (its latest branch, as the chat pipeline assembles it),
+compares the history the pipeline used to send (every turn with its full
+execution trace) with the budgeted history: superseded code replaced by a
+one-line note, and turns beyond HISTORY_TOKEN_BUDGET folded into a
+summary. Summaries are the offline digest (no LLM calls, nothing stored),
+so the folded part is an upper bound of what the LLM summary costs.
+Earlier images are re-sent as HISTORY_IMAGE_TURNS allows (the current
+prompt is taken to not refer to them).
+
+Without --from-db, runs on a synthetic Draw.io session whose diagram grows
+every turn, with a screenshot attached to every third prompt.
+
+Usage (from backend/):
+    python -m benchmarks.bench_history_compaction [--from-db] [--budget 12000] [--turns 20]
+"""
+import argparse
+import asyncio
+
+from sqlmodel import select
+
+from app.core.config import settings
+from app.core.database import async_session
+from app.models.chat import ChatMessage, ChatSession
+from app.services.history import HistoryBudgeter
+
+
+def latest_branch(messages: list[ChatMessage]) -> list[ChatMessage]:
+    """The latest message of each turn, as event_generator picks them."""
+    turn_to_latest = {}
+    for msg in messages:
+        t = msg.turn_index or 0
+        if t not in turn_to_latest or msg.id > turn_to_latest[t].id:
+            turn_to_latest[t] = msg
+    return [turn_to_latest[t] for t in sorted(turn_to_latest)]
+
+
+def synthetic_session(turns: int) -> list[ChatMessage]:
+    messages = []
+    cells = []
+    for turn in range(turns):
+        prompt = "Draw the architecture of a web shop on AWS" if turn == 0 else f"Add service number {turn}"
+        images = [f"/api/images/screenshot{turn}"] if turn % 3 == 0 else None
+        messages.append(ChatMessage(id=2 * turn + 1, role="user", content=prompt, images=images, turn_index=2 * turn))
+        cells += [
+            f'<mxCell id="svc{turn}-{i}" value="Service {turn}.{i}" style="rounded=1;whiteSpace=wrap;html=1;" '
+            f'vertex="1" parent="1"><mxGeometry x="{40 * i}" y="{80 * turn}" width="120" height="60" as="geometry"/></mxCell>'
+            for i in range(8)
+        ]
+        xml = '<mxGraphModel><root><mxCell id="0"/><mxCell id="1" parent="0"/>' + "\n".join(cells) + "</root></mxGraphModel>"
+        messages.append(ChatMessage(id=2 * turn + 2, role="assistant", content="", agent="drawio", turn_index=2 * turn + 1, steps=[
+            {"type": "agent_select", "name": "drawio", "status": "done"},
+            {"type": "tool_start", "name": "create_drawio", "content": "", "status": "done"},
+            {"type": "tool_end", "name": "Result", "content": xml, "status": "done"},
+        ]))
+    return messages
+
+
+async def report(name: str, branch: list[ChatMessage], budget: int) -> tuple[int, int]:
+    _, stats = await HistoryBudgeter(None, budget, image_turns=settings.HISTORY_IMAGE_TURNS).build(0, branch)
+    saved = 1 - stats["tokens"] / stats["full_tokens"] if stats["full_tokens"] else 0.0
+    print(
+        f"{name:<28} | {stats['messages']:>8} | {stats['full_tokens']:>10} | {stats['tokens']:>10} | "
+        f"{stats['folded_messages']:>6} | {stats['attached_images']:>3}/{stats['images']:<3} | {saved:>6.1%}"
+    )
+    return stats["full_tokens"], stats["tokens"]
+
+
+async def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--from-db", action="store_true", help="use the sessions stored in the database")
+    arg_parser.add_argument("--budget", type=int, default=settings.HISTORY_TOKEN_BUDGET, help="history token budget")
+    arg_parser.add_argument("--turns", type=int, default=20, help="turns of the synthetic session")
+    args = arg_parser.parse_args()
+
+    print(f"{'session':<28} | {'messages':>8} | {'full':>10} | {'budgeted':>10} | {'folded':>6} | {'images':>7} | {'saved':>6}")
+    print("-" * 96)
+    totals = [0, 0]
+    if args.from_db:
+        async with async_session() as db:
+            sessions = (await db.exec(select(ChatSession))).all()
+            for chat_session in sessions:
+                messages = (await db.exec(
+                    select(ChatMessage).where(ChatMessage.session_id == chat_session.id).order_by(ChatMessage.created_at)
+                )).all()
+                if messages:
+                    full, budgeted = await report(f"#{chat_session.id} {chat_session.title[:20]}", latest_branch(messages), args.budget)
+                    totals[0] += full
+                    totals[1] += budgeted
+    else:
+        for turns in sorted({5, 10, args.turns}):
+            full, budgeted = await report(f"synthetic drawio, {turns} turns", synthetic_session(turns), args.budget)
+            totals[0] += full
+            totals[1] += budgeted
+    if totals[0]:
+        print(f"\ntotal: {totals[0]} -> {totals[1]} tokens ({1 - totals[1] / totals[0]:.1%} fewer)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,138 @@
+"""
+Provider pool failover and hedging against two local stub providers.
+
+Starts two OpenAI-compatible stub servers in-process and streams through a
+PooledChatModel over them, reporting time to first token and the provider
+that answered for each scenario:
+
+  healthy          primary answers normally
+  primary 500      primary fails; the call fails over to the secondary
+  primary slow     primary takes --slow-ms to its first token, without and
+                   with hedging (the hedge deadline is the primary's p95
+                   time to first token, learned from the healthy calls)
+  circuit open     after repeated failures the primary is skipped
+
+Usage (from backend/):
+    python -m benchmarks.bench_provider_failover [--slow-ms 3000]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import uvicorn
+from langchain_core.messages import HumanMessage
+from langchain_openai import ChatOpenAI
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from app.core.config import settings
+from app.core.providers import PooledChatModel, Provider, ProviderPool
+
+
+class StubProvider:
+    """OpenAI-compatible streaming endpoint whose behaviour can be switched."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.mode = "ok"
+        self.ttft_ms = 50
+        self.requests = 0
+        self.port = None
+        app = Starlette(routes=[Route("/v1/chat/completions", self.completions, methods=["POST"])])
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="error"))
+
+    async def start(self):
+        self.task = asyncio.create_task(self.server.serve())
+        while not self.server.started:
+            await asyncio.sleep(0.01)
+        self.port = self.server.servers[0].sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.should_exit = True
+        await self.task
+
+    async def completions(self, request: Request):
+        self.requests += 1
+        body = await request.json()
+        if self.mode == "error":
+            return JSONResponse({"error": {"message": f"{self.name} is down"}}, status_code=500)
+        delay = self.ttft_ms / 1000
+
+        async def stream():
+            await asyncio.sleep(delay)
+            for word in f"answer from {self.name}".split():
+                chunk = {
+                    "id": "stub", "object": "chat.completion.chunk", "created": 0, "model": body["model"],
+                    "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(0.005)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+def pooled_model(pool: ProviderPool, hedge: bool) -> PooledChatModel:
+    clients = {
+        p.name: ChatOpenAI(api_key=p.api_key, base_url=p.base_url, model=p.model, streaming=True, max_retries=0)
+        for p in pool.providers
+    }
+    return PooledChatModel(pool=pool, clients=clients, hedge=hedge)
+
+
+async def timed_stream(llm: PooledChatModel) -> tuple[float, str]:
+    started = time.perf_counter()
+    ttft = None
+    text = ""
+    async for chunk in llm.astream([HumanMessage(content="hi")]):
+        if ttft is None:
+            ttft = time.perf_counter() - started
+        text += chunk.content
+    return ttft, text.strip()
+
+
+async def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--slow-ms", type=int, default=3000, help="primary time to first token when slow")
+    args = arg_parser.parse_args()
+
+    primary, secondary = StubProvider("primary"), StubProvider("secondary")
+    await primary.start()
+    await secondary.start()
+    pool = ProviderPool([
+        Provider(name=stub.name, base_url=f"http://127.0.0.1:{stub.port}/v1", api_key="stub", model="stub-model")
+        for stub in (primary, secondary)
+    ])
+    settings.LLM_HEDGE_MAX_DELAY_MS = args.slow_ms * 2
+
+    async def run(scenario: str, hedge: bool = False, calls: int = 1):
+        for _ in range(calls):
+            ttft, text = await timed_stream(pooled_model(pool, hedge))
+        health = ", ".join(f"{p.name}={p.health.score}" for p in pool.providers)
+        print(f"{scenario:<24} | {ttft * 1000:>8.0f} ms | {text:<24} | {health}")
+
+    print(f"{'scenario':<24} | {'TTFT':>11} | {'answer':<24} | health")
+    print("-" * 90)
+    try:
+        await run("healthy (x20)", calls=20)
+        primary.mode = "error"
+        await run("primary 500")
+        primary.mode, primary.ttft_ms = "ok", args.slow_ms
+        await run("primary slow, no hedge")
+        await run("primary slow, hedged", hedge=True)
+        primary.mode = "error"
+        for _ in range(3):
+            await run("primary 500 (again)")
+        before = primary.requests
+        await run("circuit open")
+        print(f"\nprimary requests while its circuit was open: {primary.requests - before}")
+    finally:
+        await primary.stop()
+        await secondary.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
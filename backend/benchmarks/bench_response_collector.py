@@ -0,0 +1,87 @@
+"""
+Peak memory and CPU of accumulating a streamed agent response.
+
+Compares the previous pattern, where the agent node merged every chunk with
+`full_response += chunk` and the route kept its own `full_response_content`
+copy, with a single ResponseCollector shared by the agent and the route.
+The stream mimics an OpenAI-compatible provider: small text deltas that all
+carry the same response metadata, and a final chunk with the finish reason
+and token usage.
+
+Usage (from backend/):
+    python -m benchmarks.bench_response_collector [--chars 65536] [--chunk-chars 4]
+"""
+import argparse
+import time
+import tracemalloc
+
+from langchain_core.messages import AIMessageChunk
+
+from app.core.streaming import ResponseCollector
+
+
+def build_chunks(chars: int, chunk_chars: int) -> list[AIMessageChunk]:
+    text = ('<mxCell id="n" value="API 网关" vertex="1" parent="1"/>\n' * (chars // 40 + 1))[:chars]
+    metadata = {"model_provider": "openai"}
+    chunks = [
+        AIMessageChunk(content=text[i:i + chunk_chars], id="run-bench", response_metadata=metadata)
+        for i in range(0, len(text), chunk_chars)
+    ]
+    chunks.append(AIMessageChunk(
+        content="", id="run-bench",
+        response_metadata={"model_provider": "openai", "finish_reason": "stop"},
+        usage_metadata={"input_tokens": 1200, "output_tokens": len(chunks), "total_tokens": 1200 + len(chunks)},
+    ))
+    return chunks
+
+
+def legacy(chunks: list[AIMessageChunk]) -> int:
+    full_response = None
+    full_response_content = ""
+    for chunk in chunks:
+        # Agent node
+        full_response = chunk if full_response is None else full_response + chunk
+        # Route
+        if chunk.content:
+            full_response_content += chunk.content
+    return len(full_response.content) + len(full_response_content)
+
+
+def collector(chunks: list[AIMessageChunk]) -> int:
+    response = ResponseCollector()
+    for chunk in chunks:
+        response.add(chunk)
+    message = response.message()
+    return len(message.content) + len(response.text)
+
+
+def measure(fn, chunks: list[AIMessageChunk]) -> tuple[float, int]:
+    started = time.process_time()
+    fn(chunks)
+    cpu = time.process_time() - started
+    tracemalloc.start()
+    fn(chunks)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu, peak
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--chars", type=int, default=65536, help="characters in the streamed response")
+    arg_parser.add_argument("--chunk-chars", type=int, default=4, help="characters per streamed chunk")
+    args = arg_parser.parse_args()
+
+    chunks = build_chunks(args.chars, args.chunk_chars)
+    print(f"{len(chunks)} chunks, {args.chars} characters\n")
+    print(f"{'accumulation':<20} | {'CPU ms':>9} | {'peak KiB':>9} | {'CPU':>7}")
+    print("-" * 55)
+    baseline = None
+    for name, fn in (("chunk += chunk", legacy), ("ResponseCollector", collector)):
+        cpu, peak = measure(fn, chunks)
+        baseline = baseline or cpu
+        print(f"{name:<20} | {cpu * 1000:>9.1f} | {peak / 1024:>9.1f} | {cpu / baseline:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
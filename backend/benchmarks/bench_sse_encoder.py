@@ -0,0 +1,76 @@
+"""
+Benchmark for SSE frame encoding.
+
+Compares the previous per-frame f-string + json.dumps approach (producing
+str that Starlette re-encodes to bytes) with SSEEncoder using the stdlib
+json and orjson backends, on a typical tool_code token stream and on
+doc_analysis_chunk frames.
+
+Usage (from backend/):
+    python -m benchmarks.bench_sse_encoder [--frames 200000]
+"""
+import argparse
+import json
+import time
+
+from app.core.sse import SSEEncoder, orjson
+
+
+def legacy_frames(frames: list[tuple[str, dict]]) -> int:
+    total = 0
+    for event, payload in frames:
+        frame = f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        # Starlette encodes str chunks before writing them
+        total += len(frame.encode("utf-8"))
+    return total
+
+
+def encoder_frames(frames: list[tuple[str, dict]], backend: str) -> int:
+    encode = SSEEncoder(backend).encode
+    total = 0
+    for event, payload in frames:
+        total += len(encode(event, payload))
+    return total
+
+
+def build_frames(count: int, event: str) -> list[tuple[str, dict]]:
+    tokens = ['<mxCell id="', '12', '" value="', 'API 网关', '" style="', 'rounded=1;', 'html=1;"', ' vertex="1"', '>\n']
+    frames = []
+    for i in range(count):
+        content = tokens[i % len(tokens)]
+        if event == "doc_analysis_chunk":
+            frames.append((event, {'content': content, 'index': i % 3, 'status': 'running', 'session_id': 1042}))
+        else:
+            frames.append((event, {'content': content, 'session_id': 1042}))
+    return frames
+
+
+def measure(fn, *args) -> float:
+    t0 = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - t0
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--frames", type=int, default=200_000, help="frames per scenario")
+    args = arg_parser.parse_args()
+
+    backends = ["json"] + (["auto"] if orjson is not None else [])
+    if orjson is None:
+        print("orjson not installed: only the stdlib backend is measured\n")
+
+    print(f"{'scenario':<20} | {'encoder':<17} | {'frames/sec':>12} | {'speedup':>7}")
+    print("-" * 65)
+    for event in ("tool_code", "doc_analysis_chunk"):
+        frames = build_frames(args.frames, event)
+        baseline = measure(legacy_frames, frames)
+        print(f"{event:<20} | {'legacy f-string':<17} | {args.frames / baseline:>12,.0f} | {1.0:>6.2f}x")
+        for backend in backends:
+            elapsed = measure(encoder_frames, frames, backend)
+            name = "SSEEncoder/" + ("orjson" if backend == "auto" else "json")
+            print(f"{event:<20} | {name:<17} | {args.frames / elapsed:>12,.0f} | {baseline / elapsed:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Micro-benchmark for StreamingTagParser.
+
+Streams a synthetic Draw.io response in small token-sized chunks and reports
+the average cost of `feed()` per chunk as the output grows. The incremental
+parser should stay flat; the legacy re-scanning parser grows linearly per
+chunk (quadratic overall).
+
+Usage (from backend/):
+    python -m benchmarks.bench_tag_parser [--chars 120000] [--chunk 4]
+"""
+import argparse
+import time
+
+from app.core.streaming import StreamingTagParser
+
+
+class LegacyStreamingTagParser:
+    """The previous buffer-rescanning implementation, kept for comparison."""
+
+    def __init__(self):
+        self.buffer = ""
+        self.state = 0
+        self.last_dc_len = 0
+        self.last_code_len = 0
+
+    def feed(self, chunk: str) -> list:
+        self.buffer += chunk
+        events = []
+        dc_start_pos = self.buffer.find('<design_concept>')
+        dc_end_pos = self.buffer.find('</design_concept>')
+        code_start_pos = self.buffer.find('<code>')
+        code_end_pos = self.buffer.find('</code>')
+
+        if self.state == 0 and dc_start_pos != -1:
+            self.state = 1
+            events.append(('design_concept_start', '', True))
+        if self.state == 1 and dc_start_pos != -1:
+            content_start = dc_start_pos + len('<design_concept>')
+            end = dc_end_pos if dc_end_pos != -1 else len(self.buffer)
+            dc_content = self.buffer[content_start:end].strip()
+            if len(dc_content) > self.last_dc_len:
+                events.append(('design_concept', dc_content[self.last_dc_len:], dc_end_pos == -1))
+                self.last_dc_len = len(dc_content)
+            if dc_end_pos != -1:
+                events.append(('design_concept_end', '', False))
+                self.state = 2
+        if self.state == 2 and code_start_pos != -1:
+            content_start = code_start_pos + len('<code>')
+            end = code_end_pos if code_end_pos != -1 else len(self.buffer)
+            code_content = self.buffer[content_start:end].strip()
+            if len(code_content) > self.last_code_len:
+                events.append(('code', code_content[self.last_code_len:], code_end_pos == -1))
+                self.last_code_len = len(code_content)
+            if code_end_pos != -1:
+                events.append(('code_end', '', False))
+                self.state = 3
+        return events
+
+
+def build_response(target_chars: int) -> str:
+    cells = []
+    i = 2
+    body_len = 0
+    while body_len < target_chars:
+        cell = (
+            f'        <mxCell id="{i}" value="Service {i}" style="rounded=1;whiteSpace=wrap;html=1;'
+            f'fillColor=#dae8fc;strokeColor=#6c8ebf;shadow=1;" vertex="1" parent="1">\n'
+            f'          <mxGeometry x="{(i % 8) * 200}" y="{(i // 8) * 100}" width="120" height="60" as="geometry" />\n'
+            f'        </mxCell>\n'
+        )
+        cells.append(cell)
+        body_len += len(cell)
+        i += 1
+    return (
+        "<design_concept>\nLayered microservice architecture with gateway, services and data stores.\n</design_concept>\n\n"
+        "<code>\n<mxfile host=\"app.diagrams.net\">\n  <diagram name=\"Page-1\">\n    <mxGraphModel>\n      <root>\n"
+        + "".join(cells)
+        + "      </root>\n    </mxGraphModel>\n  </diagram>\n</mxfile>\n</code>\n"
+    )
+
+
+def run(parser_cls, chunks: list[str], buckets: int) -> list[tuple[int, float]]:
+    """Returns (output_chars_so_far, avg_us_per_chunk) for each bucket."""
+    parser = parser_cls()
+    per_bucket = max(1, len(chunks) // buckets)
+    results = []
+    consumed = 0
+    for start in range(0, len(chunks), per_bucket):
+        batch = chunks[start:start + per_bucket]
+        t0 = time.perf_counter()
+        for chunk in batch:
+            parser.feed(chunk)
+        elapsed = time.perf_counter() - t0
+        consumed += sum(len(c) for c in batch)
+        results.append((consumed, elapsed / len(batch) * 1e6))
+    return results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--chars", type=int, default=120_000, help="approximate response size in characters")
+    arg_parser.add_argument("--chunk", type=int, default=4, help="characters per streamed token")
+    arg_parser.add_argument("--buckets", type=int, default=10, help="number of progress samples")
+    args = arg_parser.parse_args()
+
+    response = build_response(args.chars)
+    chunks = [response[i:i + args.chunk] for i in range(0, len(response), args.chunk)]
+    print(f"Response: {len(response)} chars, {len(chunks)} chunks of {args.chunk} chars\n")
+
+    legacy = run(LegacyStreamingTagParser, chunks, args.buckets)
+    current = run(StreamingTagParser, chunks, args.buckets)
+
+    print(f"{'output chars':>12} | {'legacy us/chunk':>15} | {'incremental us/chunk':>20}")
+    print("-" * 54)
+    for (chars, legacy_us), (_, current_us) in zip(legacy, current):
+        print(f"{chars:>12} | {legacy_us:>15.2f} | {current_us:>20.2f}")
+
+    legacy_total = sum(us for _, us in legacy)
+    current_total = sum(us for _, us in current)
+    print(f"\nMean per-chunk cost: legacy {legacy_total / len(legacy):.2f}us, incremental {current_total / len(current):.2f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Evaluates the router's local intent classifier against the LLM router.
+
+Labels are LLM router decisions: either logged ones (JSONL written with
+INTENT_LOG_PATH, whose latency_ms is the measured router call) or, with
+--live, decisions made now by calling the configured LLM router for every
+prompt. Without --data a small built-in prompt set is used with --live.
+
+For a sweep of confidence thresholds it reports the fast-path coverage
+(share of requests answered locally), the classifier's agreement with the
+LLM on those requests, end-to-end routing accuracy and the router latency
+saved per request. Classifier latency is reported as p50/p99.
+
+Usage (from backend/):
+    python -m benchmarks.eval_intent_classifier --data router_decisions.jsonl
+    python -m benchmarks.eval_intent_classifier --live [--data prompts.jsonl]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from langchain_core.messages import HumanMessage
+
+from app.agents.intent_classifier import IntentClassifier, intent_classifier
+from app.core.config import settings
+
+SAMPLE_PROMPTS = [
+    "Create a mind map about machine learning",
+    "帮我画一个关于项目管理的思维导图",
+    "Draw a flowchart of the user login process",
+    "画一个订单处理的流程图",
+    "Sequence diagram for OAuth2 authorization code flow",
+    "Gantt chart for a 3 month product launch",
+    "Bar chart of quarterly sales: Q1 120, Q2 150, Q3 90, Q4 200",
+    "用饼图展示市场份额",
+    "AWS architecture with ALB, ECS and RDS in draw.io",
+    "画一个微服务部署架构图",
+    "Make an infographic about climate change",
+    "制作一张关于健康饮食的信息图",
+    "Hello, what can you do?",
+    "你好",
+    "Explain the difference between TCP and UDP",
+    "Visualize how our team's onboarding works",
+    "Show the relationship between customers, orders and products",
+    "Compare iPhone and Android market share over the last five years",
+]
+
+
+def load_pairs(path: str) -> list[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def label_live(prompts: list[str]) -> list[dict]:
+    """Routes every prompt with the LLM router, the classifier disabled."""
+    from app.agents.dispatcher import classify_intent
+
+    settings.INTENT_CLASSIFIER_THRESHOLD = float("inf")
+    records = []
+    for prompt in prompts:
+        started = time.perf_counter()
+        result = await classify_intent({"messages": [HumanMessage(content=prompt)], "model_config": None})
+        records.append({"prompt": prompt, "intent": result["intent"], "latency_ms": (time.perf_counter() - started) * 1000})
+    return records
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--data", help="JSONL of {prompt, intent[, latency_ms]} router decisions")
+    arg_parser.add_argument("--live", action="store_true", help="label the prompts with the configured LLM router")
+    arg_parser.add_argument("--model", help="classifier model file (default: the one loaded by the app)")
+    arg_parser.add_argument("--llm-latency-ms", type=float, default=None,
+                            help="router latency to assume when the data carries none")
+    args = arg_parser.parse_args()
+    configured_threshold = settings.INTENT_CLASSIFIER_THRESHOLD
+
+    if args.data:
+        records = load_pairs(args.data)
+    elif args.live:
+        records = [{"prompt": prompt} for prompt in SAMPLE_PROMPTS]
+    else:
+        arg_parser.error("pass --data and/or --live")
+    if args.live:
+        records = asyncio.run(label_live([r["prompt"] for r in records]))
+
+    classifier = IntentClassifier.load(args.model) if args.model else intent_classifier
+    predictions, timings = [], []
+    for record in records:
+        started = time.perf_counter()
+        predictions.append(classifier.predict(record["prompt"]))
+        timings.append((time.perf_counter() - started) * 1_000_000)
+
+    llm_latencies = [r["latency_ms"] for r in records if r.get("latency_ms") is not None]
+    llm_latency = args.llm_latency_ms if args.llm_latency_ms is not None else (
+        sum(llm_latencies) / len(llm_latencies) if llm_latencies else None
+    )
+
+    print(f"{len(records)} decisions, classifier with {len(classifier.weights)} learned features")
+    print(f"classifier latency: p50 {percentile(timings, 0.5):.0f} us, p99 {percentile(timings, 0.99):.0f} us")
+    print(f"LLM router latency: {f'{llm_latency:.0f} ms' if llm_latency is not None else 'unknown (pass --llm-latency-ms)'}")
+    print()
+    print(f"{'threshold':>9} | {'coverage':>8} | {'agreement':>9} | {'accuracy':>8} | {'saved/request':>13}")
+    print("-" * 60)
+    for threshold in (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.99):
+        covered = [(p, r) for p, r in zip(predictions, records) if p[1] >= threshold]
+        agreed = sum(p[0] == r["intent"] for p, r in covered)
+        coverage = len(covered) / len(records)
+        # Uncovered requests go to the LLM router, which agrees with itself
+        accuracy = (agreed + len(records) - len(covered)) / len(records)
+        agreement = f"{agreed / len(covered):>9.1%}" if covered else f"{'-':>9}"
+        saved = f"{coverage * llm_latency:>10.0f} ms" if llm_latency is not None else f"{'-':>13}"
+        marker = " <- INTENT_CLASSIFIER_THRESHOLD" if threshold == configured_threshold else ""
+        print(f"{threshold:>9.2f} | {coverage:>8.1%} | {agreement} | {accuracy:>8.1%} | {saved}{marker}")
+
+
+if __name__ == "__main__":
+    main()
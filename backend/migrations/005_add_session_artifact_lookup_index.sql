@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS idx_session_artifact_lookup ON session_artifact (session_id, agent, turn_index DESC);
@@ -0,0 +1,14 @@
+-- Index the code of existing assistant messages (its step) for the current-artifact lookup
+INSERT INTO session_artifact (session_id, message_id, agent, turn_index, step_index, created_at)
+SELECT m.session_id, m.id, m.agent, m.turn_index, last_output.step_index, m.created_at
+FROM chatmessage m
+CROSS JOIN LATERAL (
+    SELECT e.position - 1 AS step_index
+    FROM json_array_elements(CASE WHEN json_typeof(m.steps) = 'array' THEN m.steps ELSE CAST('[]' AS json) END)
+        WITH ORDINALITY AS e(step, position)
+    WHERE e.step ->> 'type' = 'tool_end' AND COALESCE(e.step ->> 'content', '') <> ''
+    ORDER BY e.position DESC
+    LIMIT 1
+) last_output
+WHERE m.role = 'assistant' AND m.agent IS NOT NULL AND m.steps IS NOT NULL
+ON CONFLICT (message_id) DO NOTHING;
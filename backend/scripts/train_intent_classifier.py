@@ -0,0 +1,89 @@
+"""
+Trains the router's local intent classifier from logged routing decisions.
+
+Training pairs come from the JSONL files written with INTENT_LOG_PATH
+(one {"prompt": ..., "intent": ...} object per line) and, with --from-db,
+from stored conversations: every user message paired with the agent of
+the assistant message that answered it. Explicit @agent requests are
+skipped, as the router never classifies them.
+
+The model (keyword rules + hashed n-gram weights) is written as JSON to
+INTENT_MODEL_PATH, by default app/data/intent_model.json, and picked up
+on the next start.
+
+Usage (from backend/):
+    python -m scripts.train_intent_classifier --data router_decisions.jsonl [--from-db] [--epochs 10]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+
+from sqlmodel import select
+
+from app.agents.intent_classifier import INTENTS, IntentClassifier
+from app.core.config import settings
+from app.core.database import async_session
+from app.models.chat import ChatMessage
+
+DEFAULT_MODEL_PATH = os.path.join("app", "data", "intent_model.json")
+EXPLICIT_ROUTING = re.compile(r"@(mindmap|flow|flowchart|mermaid|charts?|drawio|infographic)\b", re.IGNORECASE)
+
+
+def load_jsonl(path: str) -> list[tuple[str, str]]:
+    pairs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                pairs.append((record["prompt"], record["intent"]))
+    return pairs
+
+
+async def load_from_db() -> list[tuple[str, str]]:
+    async with async_session() as db:
+        answers = (await db.exec(
+            select(ChatMessage).where(ChatMessage.role == "assistant", ChatMessage.parent_id.is_not(None))
+        )).all()
+        prompts = {
+            m.id: m.content for m in (await db.exec(
+                select(ChatMessage).where(ChatMessage.id.in_([a.parent_id for a in answers]))
+            )).all()
+        }
+    return [(prompts[a.parent_id], a.agent) for a in answers if a.parent_id in prompts and a.agent]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--data", action="append", default=[], help="JSONL file of router decisions (repeatable)")
+    arg_parser.add_argument("--from-db", action="store_true", help="also train on stored conversations")
+    arg_parser.add_argument("--epochs", type=int, default=10)
+    arg_parser.add_argument("--holdout", type=float, default=0.1, help="fraction kept aside to report accuracy")
+    arg_parser.add_argument("--output", default=settings.INTENT_MODEL_PATH or DEFAULT_MODEL_PATH)
+    args = arg_parser.parse_args()
+
+    pairs = [pair for path in args.data for pair in load_jsonl(path)]
+    if args.from_db:
+        pairs += asyncio.run(load_from_db())
+    pairs = [(prompt, intent) for prompt, intent in pairs if intent in INTENTS and prompt.strip() and not EXPLICIT_ROUTING.search(prompt)]
+    if not pairs:
+        arg_parser.error("no training pairs: pass --data and/or --from-db")
+
+    random.Random(0).shuffle(pairs)
+    held_out = int(len(pairs) * args.holdout)
+    train, test = pairs[held_out:], pairs[:held_out]
+    model = IntentClassifier.train(train, epochs=args.epochs)
+
+    for name, subset in (("train", train), ("holdout", test)):
+        if subset:
+            correct = sum(model.predict(prompt)[0] == intent for prompt, intent in subset)
+            print(f"{name:<8} accuracy: {correct / len(subset):.1%} ({len(subset)} pairs)")
+
+    model.save(args.output)
+    print(f"wrote {args.output} ({len(model.weights)} active features)")
+
+
+if __name__ == "__main__":
+    main()
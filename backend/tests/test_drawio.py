@@ -0,0 +1,67 @@
+import random
+
+import pytest
+
+from app.core.drawio import DrawioXmlSanitizer, sanitize_drawio_xml
+
+CELL = '<mxCell id="{i}" edge="1" parent="1"><mxGeometry relative="1" as="geometry">{inner}</mxGeometry></mxCell>'
+DIAGRAM = "<mxGraphModel><root>\n" + "\n".join(
+    CELL.format(i=i, inner=inner) for i, inner in enumerate([
+        '<Array as="points"><mxPoint x="1" y="2"/></Array>',
+        '\n  <Array as="points">\n    <Array><mxPoint/></Array>\n  </Array>\n',
+        '<mxPoint x="3" y="4" as="sourcePoint"/>',
+        '<Array as="points"/>',
+        '',
+    ])
+) + '\n<mxCell id="q" value="a &gt; b" style="x=\'>\'"/>\n</root></mxGraphModel>'
+
+
+def stream(text: str, seed: int) -> tuple[str, str]:
+    """Feeds `text` in random chunks; returns the concatenated output and `text`."""
+    rng = random.Random(seed)
+    sanitizer = DrawioXmlSanitizer()
+    out, pos = [], 0
+    while pos < len(text):
+        size = rng.randint(1, 8)
+        out.append(sanitizer.feed(text[pos:pos + size]))
+        pos += size
+    out.append(sanitizer.finalize())
+    return "".join(out), sanitizer.text
+
+
+def test_arrays_are_dropped_and_empty_geometry_collapsed():
+    sanitized = sanitize_drawio_xml(DIAGRAM)
+    assert "Array" not in sanitized
+    assert '<mxGeometry relative="1" as="geometry" />' in sanitized
+    assert '<mxPoint x="3" y="4" as="sourcePoint"/></mxGeometry>' in sanitized
+    assert 'style="x=\'>\'"' in sanitized
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_streamed_output_does_not_depend_on_chunking(seed):
+    emitted, text = stream(DIAGRAM, seed)
+    assert emitted == text == sanitize_drawio_xml(DIAGRAM)
+
+
+def test_text_without_sanitized_tags_is_unchanged():
+    xml = '<mxGraphModel><root><mxCell id="0"/><mxCell id="1" parent="0" value="&lt;Arr"/></root></mxGraphModel>'
+    assert sanitize_drawio_xml(xml) == xml
+    assert stream(xml, 0)[0] == xml
+
+
+def test_tags_split_across_chunks_are_resolved():
+    sanitizer = DrawioXmlSanitizer()
+    chunks = ['<root><mxGeom', 'etry as="geo', 'metry">', '  ', '</mxGeometry>', ' <Arr', 'ay><mxPoint/></Ar', 'ray></root>']
+    out = "".join(sanitizer.feed(chunk) for chunk in chunks) + sanitizer.finalize()
+    assert out == '<root><mxGeometry as="geometry" /></root>'
+
+
+def test_output_follows_the_stream_closely():
+    sanitizer = DrawioXmlSanitizer()
+    deltas = ['<mxCell id="', '2" value="', 'Start" vertex', '="1" parent="1">']
+    out = [sanitizer.feed(delta) for delta in deltas]
+    # Released as soon as a chunk closes a tag, not after dozens of tokens
+    assert "".join(out) == '<mxCell id="2" value="Start" vertex="1" parent="1">'
+    # Without a closing '>' only a few chunks are held
+    out = [sanitizer.feed(" label text") for _ in range(DrawioXmlSanitizer.MAX_BUFFERED_CHUNKS)]
+    assert out[-1]
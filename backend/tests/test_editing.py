@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+from langchain_core.messages import AIMessageChunk
+
+from app.agents import editing
+from app.core.streaming import RESPONSE_COLLECTOR_KEY, ResponseCollector, StreamingTagParser
+
+CODE = "graph TD\n" + "\n".join(f"    N{i}[Step {i}] --> N{i + 1}" for i in range(5))
+
+
+class FallbackLLM:
+    """Answers the regeneration prompt with the complete code."""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def astream(self, messages):
+        self.calls += 1
+        yield AIMessageChunk(content="<code>graph TD\n    A --> B</code>")
+
+
+@pytest.fixture(autouse=True)
+def edit_mode_on(monkeypatch):
+    monkeypatch.setattr(editing.settings, "PATCH_EDITS", "true")
+    monkeypatch.setattr(editing.settings, "PATCH_EDIT_MIN_CHARS", 10)
+
+
+def edit(reply: str, llm=None):
+    # The route's collector already holds the streamed reply
+    response = AIMessageChunk(content=reply)
+    collector = ResponseCollector()
+    collector.add(response)
+    config = {"configurable": {RESPONSE_COLLECTOR_KEY: collector}}
+    return asyncio.run(editing.apply_edit("mermaid", CODE, llm or FallbackLLM(), [], response, config, "Mermaid"))
+
+
+def test_applied_patch_is_appended_as_the_code_block():
+    reply = '<design_concept>Drop the second edge</design_concept>\n<patch>[{"op": "delete", "start": 3}]</patch>'
+    message = edit(reply)
+    code_start = message.content.index(StreamingTagParser.CODE_START_TAG)
+    assert message.content[:code_start].strip() == reply
+    expected = "\n".join(line for i, line in enumerate(CODE.split("\n"), 1) if i != 3)
+    assert message.content[code_start:] == f"<code>\n{expected}\n</code>"
+
+
+def test_rewrite_is_returned_unchanged():
+    reply = "<design_concept>Rewrite</design_concept><code>graph LR\n  X --> Y</code>"
+    assert edit(reply).content == reply
+
+
+@pytest.mark.parametrize("patch", [
+    '[{"op": "delete", "start": 99}]',
+    'not json',
+    '[{"op": "replace", "start": 2, "lines": 5}]',
+])
+def test_failed_patch_regenerates_the_full_code(patch):
+    llm = FallbackLLM()
+    message = edit(f"<design_concept>x</design_concept><patch>{patch}</patch>", llm)
+    assert llm.calls == 1
+    # The regenerated code streams after the failed patch, as the route's parser sees it
+    assert message.content.endswith("</patch><code>graph TD\n    A --> B</code>")
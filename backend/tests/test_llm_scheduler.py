@@ -0,0 +1,154 @@
+import asyncio
+
+from app.core.llm import LLMPriority, LLMScheduler, current_llm_session
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def run_calls(scheduler: LLMScheduler, calls: list[tuple[str, LLMPriority]]) -> list[str]:
+    """Queues `calls` (session, priority) behind a held slot; returns the order they ran in."""
+    order = []
+
+    async def call(session: str, priority: LLMPriority):
+        async with scheduler.slot(priority, session):
+            order.append(session)
+            await asyncio.sleep(0)
+
+    async def main():
+        release = asyncio.Event()
+
+        async def holder():
+            async with scheduler.slot(session="holder"):
+                await release.wait()
+
+        held = asyncio.create_task(holder())
+        await settle()
+        tasks = []
+        for session, priority in calls:
+            tasks.append(asyncio.create_task(call(session, priority)))
+            await settle()
+        release.set()
+        await asyncio.gather(held, *tasks)
+
+    asyncio.run(main())
+    return order
+
+
+def test_two_sessions_are_served_round_robin():
+    scheduler = LLMScheduler(max_in_flight=1)
+    calls = [("upload", LLMPriority.EXTRACTION)] * 4 + [("chat", LLMPriority.EXTRACTION)] * 2
+    assert run_calls(scheduler, calls) == ["upload", "chat", "upload", "chat", "upload", "upload"]
+    assert scheduler.in_flight == 0
+
+
+def test_more_urgent_priority_goes_first():
+    scheduler = LLMScheduler(max_in_flight=1)
+    calls = [("a", LLMPriority.SYNTHESIS), ("b", LLMPriority.EXTRACTION), ("c", LLMPriority.INTERACTIVE)]
+    assert run_calls(scheduler, calls) == ["c", "b", "a"]
+
+
+def test_session_with_fewer_calls_in_flight_goes_next():
+    scheduler = LLMScheduler(max_in_flight=2)
+    order = []
+
+    async def call(session: str, hold: asyncio.Event | None = None):
+        async with scheduler.slot(LLMPriority.EXTRACTION, session):
+            order.append(session)
+            if hold:
+                await hold.wait()
+
+    async def main():
+        hold_a, hold_other = asyncio.Event(), asyncio.Event()
+        long_a = asyncio.create_task(call("a", hold_a))
+        other = asyncio.create_task(call("other", hold_other))
+        await settle()
+        waiting = [asyncio.create_task(call("a")), asyncio.create_task(call("b"))]
+        await settle()
+        # "a" still has a call in flight, so "b" gets the freed slot although "a" queued first
+        hold_other.set()
+        await settle()
+        assert order[2:] == ["b", "a"]
+        hold_a.set()
+        await asyncio.gather(long_a, other, *waiting)
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_passes_its_slot_on():
+    scheduler = LLMScheduler(max_in_flight=1)
+
+    async def main():
+        release = asyncio.Event()
+
+        async def holder():
+            async with scheduler.slot(session="a"):
+                await release.wait()
+
+        async def call(session):
+            async with scheduler.slot(session=session):
+                return session
+
+        held = asyncio.create_task(holder())
+        await settle()
+        cancelled = asyncio.create_task(call("b"))
+        waiting = asyncio.create_task(call("c"))
+        await settle()
+        cancelled.cancel()
+        release.set()
+        assert await waiting == "c"
+        await held
+        assert scheduler.stats()["queued"]["interactive"] == 0
+        assert scheduler.in_flight == 0
+
+    asyncio.run(main())
+
+
+def test_session_defaults_to_the_context():
+    scheduler = LLMScheduler(max_in_flight=4)
+    seen = {}
+
+    async def main():
+        current_llm_session.set("s1")
+
+        async def call():
+            async with scheduler.slot():
+                seen.update(scheduler.stats()["sessions"])
+
+        # Child tasks (like the graph's steps) inherit the session
+        await asyncio.create_task(call())
+
+    asyncio.run(main())
+    assert seen == {"s1": 1}
+
+
+def test_generation_steps_are_scheduled_as_its_session(monkeypatch):
+    from contextlib import asynccontextmanager
+    from app.services import generation as generation_module
+
+    @asynccontextmanager
+    async def no_database():
+        yield None
+
+    monkeypatch.setattr(generation_module, "async_session", no_database)
+    seen = []
+
+    async def pipeline(db):
+        # coalesce_events runs the pipeline's steps in tasks with a copied context
+        async def step():
+            seen.append(current_llm_session.get())
+        await asyncio.ensure_future(step())
+        yield "done", {}
+
+    async def main():
+        registry = generation_module.GenerationRegistry()
+        existing = registry.start(pipeline, 0, session="42")
+        await existing.task
+        new = registry.start(pipeline, 0)
+        await new.task
+        return new.id
+
+    new_id = asyncio.run(main())
+    assert seen == ["42", new_id]
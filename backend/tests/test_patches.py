@@ -0,0 +1,133 @@
+import json
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from app.core.patches import (
+    DRAWIO_CELLS, JSON_PATCH, LINE_EDITS, PatchError, apply_patch, number_lines, parse_patch,
+)
+
+DIAGRAM = (
+    '<mxGraphModel><root><mxCell id="0"/><mxCell id="1" parent="0"/>'
+    '<mxCell id="a" value="A" vertex="1" parent="1"><mxGeometry x="0" y="0" width="80" height="40" as="geometry"/></mxCell>'
+    '<mxCell id="b" value="B" vertex="1" parent="1"><mxGeometry x="200" y="0" width="80" height="40" as="geometry"/></mxCell>'
+    '<mxCell id="e" edge="1" source="a" target="b" parent="1"/>'
+    '</root></mxGraphModel>'
+)
+
+
+def cells(xml: str) -> dict[str, ET.Element]:
+    return {cell.get("id"): cell for cell in ET.fromstring(xml).find("root")}
+
+
+def test_parse_patch_accepts_fenced_arrays_and_single_operations():
+    assert parse_patch('```json\n[{"op": "remove", "path": "/a"}]\n```') == [{"op": "remove", "path": "/a"}]
+    assert parse_patch('{"op": "remove", "path": "/a"}') == [{"op": "remove", "path": "/a"}]
+    with pytest.raises(PatchError):
+        parse_patch("[1, 2]")
+    with pytest.raises(PatchError):
+        parse_patch("not json")
+
+
+def test_json_patch_operations():
+    code = json.dumps({"nodes": [{"id": "a", "data": {"label": "A"}}], "edges": []})
+    ops = [
+        {"op": "replace", "path": "/nodes/0/data/label", "value": "Start"},
+        {"op": "add", "path": "/nodes/-", "value": {"id": "b"}},
+        {"op": "copy", "from": "/nodes/1", "path": "/nodes/-"},
+        {"op": "move", "from": "/nodes/2", "path": "/extra"},
+        {"op": "test", "path": "/extra/id", "value": "b"},
+        {"op": "add", "path": "/edges/0", "value": {"source": "a", "target": "b"}},
+    ]
+    assert json.loads(apply_patch(JSON_PATCH, code, ops)) == {
+        "nodes": [{"id": "a", "data": {"label": "Start"}}, {"id": "b"}],
+        "edges": [{"source": "a", "target": "b"}],
+        "extra": {"id": "b"},
+    }
+
+
+@pytest.mark.parametrize("op", [
+    {"op": "replace", "path": "/nodes/5", "value": 1},
+    {"op": "remove", "path": "/missing"},
+    {"op": "test", "path": "/nodes/0", "value": "other"},
+    {"op": "add", "path": "nodes", "value": 1},
+    {"op": "rename", "path": "/nodes"},
+    {"op": "replace", "path": 3, "value": 1},
+    {"op": "move", "from": ["nodes"], "path": "/x"},
+])
+def test_json_patch_errors(op):
+    with pytest.raises(PatchError):
+        apply_patch(JSON_PATCH, '{"nodes": ["a"]}', [op])
+
+
+def test_drawio_update_sets_and_removes_attributes():
+    code = apply_patch(DRAWIO_CELLS, DIAGRAM, [
+        {"op": "update", "id": "a", "attributes": {"value": "Start", "vertex": None}, "geometry": {"x": 40}},
+    ])
+    cell = cells(code)["a"]
+    assert cell.get("value") == "Start" and cell.get("vertex") is None
+    assert cell.find("mxGeometry").get("x") == "40"
+
+
+def test_drawio_add_replace_and_delete():
+    code = apply_patch(DRAWIO_CELLS, DIAGRAM, [
+        {"op": "add", "xml": '<mxCell id="c" value="C" vertex="1" parent="1"/>'},
+        {"op": "replace", "id": "b", "xml": '<mxCell id="b" value="B2" vertex="1" parent="1"/>'},
+    ])
+    assert list(cells(code)) == ["0", "1", "a", "b", "e", "c"]
+    assert cells(code)["b"].get("value") == "B2"
+    # Deleting a cell also deletes the edges connected to it
+    assert list(cells(apply_patch(DRAWIO_CELLS, code, [{"op": "delete", "id": "a"}]))) == ["0", "1", "b", "c"]
+
+
+@pytest.mark.parametrize("op", [
+    {"op": "update", "id": "missing", "attributes": {"value": "x"}},
+    {"op": "add", "xml": '<mxCell id="a"/>'},
+    {"op": "add", "xml": '<mxCell id="x"'},
+    {"op": "replace", "id": "a", "xml": '<mxCell id="a"/><mxCell id="z"/>'},
+    {"op": "update", "id": "a", "attributes": ["value", "x"]},
+    {"op": "update", "id": "a", "geometry": "x=1"},
+    {"op": "add", "xml": {"id": "z"}},
+])
+def test_drawio_errors(op):
+    with pytest.raises(PatchError):
+        apply_patch(DRAWIO_CELLS, DIAGRAM, [op])
+
+
+def test_failed_operation_applies_nothing():
+    ops = [{"op": "update", "id": "a", "attributes": {"value": "changed"}}, {"op": "delete", "id": "missing"}]
+    with pytest.raises(PatchError):
+        apply_patch(DRAWIO_CELLS, DIAGRAM, ops)
+    with pytest.raises(PatchError):
+        apply_patch(DRAWIO_CELLS, "<mxGraphModel><diagram>compressed</diagram></mxGraphModel>", ops[:1])
+
+
+def test_line_edits_use_the_original_line_numbers():
+    code = "graph TD\nA-->B\nB-->C\nC-->D"
+    ops = [
+        {"op": "insert", "after": 0, "lines": ["%% top"]},
+        {"op": "replace", "start": 2, "end": 3, "lines": ["A-->X"]},
+        {"op": "insert", "after": 4, "lines": "D-->E"},
+    ]
+    assert apply_patch(LINE_EDITS, code, ops) == "%% top\ngraph TD\nA-->X\nC-->D\nD-->E"
+    assert apply_patch(LINE_EDITS, code, [{"op": "delete", "start": 2}]) == "graph TD\nB-->C\nC-->D"
+
+
+@pytest.mark.parametrize("ops", [
+    [{"op": "replace", "start": 2, "end": 3, "lines": []}, {"op": "delete", "start": 3, "end": 4}],
+    [{"op": "delete", "start": 5}],
+    [{"op": "delete", "start": 3, "end": 1}],
+    [{"op": "insert", "lines": ["x"]}],
+    [{"op": "replace", "start": 2, "lines": 5}],
+    [{"op": "insert", "after": {"line": 1}, "lines": ["x"]}],
+    [],
+])
+def test_line_edit_errors(ops):
+    with pytest.raises(PatchError):
+        apply_patch(LINE_EDITS, "graph TD\nA-->B\nB-->C\nC-->D", ops)
+
+
+def test_number_lines_pads_to_the_widest_number():
+    numbered = number_lines("\n".join(f"line {i}" for i in range(1, 11)))
+    assert numbered.split("\n")[0] == " 1| line 1"
+    assert numbered.split("\n")[-1] == "10| line 10"
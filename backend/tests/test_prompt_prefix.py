@@ -0,0 +1,152 @@
+"""
+Every agent's system prompt starts with a byte-stable prefix.
+
+Providers cache prompt prefixes (DeepSeek/OpenAI prefix caching), which
+only pays off when requests share their leading bytes. For the router and
+every agent, this builds the system prompt of two different requests made
+hours apart on the same day (different prompt, history, current code and,
+for the infographic agent, template) with a recording model in place of
+the LLM, and checks that the two prompts are identical up to the end of
+the time context: only request-specific sections may follow it.
+"""
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from app.agents import charts, dispatcher, drawio, flow, general, infographic, mermaid, mindmap
+from app.agents.events import stream_agent_response
+from app.core import llm
+from app.core.config import settings
+
+AGENT_REPLY = "<design_concept>\nA concept\n</design_concept>\n<code>\ncode\n</code>"
+# The two requests: same day, any finer time context would differ
+REQUEST_TIMES = [datetime(2026, 3, 2, 9, 0, 0, tzinfo=timezone.utc), datetime(2026, 3, 2, 17, 42, 31, tzinfo=timezone.utc)]
+
+# agent (intent) -> (module, node, [(prompt, current code) of the two requests])
+AGENTS = {
+    "general": (general, general.general_agent_node, [("hello", ""), ("what can you do?", "")]),
+    "mindmap": (mindmap, mindmap.mindmap_agent_node, [
+        ("mind map of machine learning", ""), ("add a branch on ethics", "# Machine Learning\n## Supervised"),
+    ]),
+    "flowchart": (flow, flow.flow_agent_node, [
+        ("flowchart of a login process", ""), ("add a captcha step", '{"nodes": [], "edges": []}'),
+    ]),
+    "mermaid": (mermaid, mermaid.mermaid_agent_node, [
+        ("sequence diagram of an OAuth flow", ""), ("add a refresh token step", "sequenceDiagram\nA->>B: hi"),
+    ]),
+    "charts": (charts, charts.charts_agent_node, [
+        ("bar chart of quarterly sales", ""), ("make it a line chart", '{"series": [{"type": "bar"}]}'),
+    ]),
+    "drawio": (drawio, drawio.drawio_agent_node, [
+        ("AWS architecture for a web app", ""), ("add a CDN", "<mxGraphModel><root/></mxGraphModel>"),
+    ]),
+    "infographic": (infographic, infographic.infographic_agent_node, [
+        ("timeline of the space race", ""), ("add 1969", "infographic compare-binary-horizontal-simple-fold\ndata"),
+    ]),
+}
+ROUTER_REQUESTS = [("draw something about cats", []), ("now make it about dogs", [
+    HumanMessage(content="draw something about cats"),
+    AIMessage(content="### Execution Trace:\nagentName: mindmap\ntoolName: create_mindmap, toolsOutput: # Cats"),
+])]
+
+
+class RecordingChatModel(BaseChatModel):
+    """Chat model that records the prompts it gets and answers with a canned reply."""
+
+    reply: str
+    prompts: list = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "recording"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        self.prompts.append(messages)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.reply))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        return self._generate(messages)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        self.prompts.append(messages)
+        yield ChatGenerationChunk(message=AIMessageChunk(content=self.reply))
+
+
+class FrozenClock(datetime):
+    """`datetime` whose `now()` is set by the test."""
+
+    current = REQUEST_TIMES[0]
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.current.astimezone(tz) if tz else cls.current
+
+
+@pytest.fixture(autouse=True)
+def frozen_clock(monkeypatch):
+    monkeypatch.setattr(llm, "datetime", FrozenClock)
+    return FrozenClock
+
+
+@pytest.fixture(autouse=True)
+def router_without_shortcuts(monkeypatch):
+    # Always consult the router LLM, and keep its decisions out of the cache
+    monkeypatch.setattr(settings, "INTENT_CLASSIFIER_THRESHOLD", 2.0)
+    monkeypatch.setattr(dispatcher, "log_router_decision", lambda *args: None)
+
+
+def agent_system_prompt(monkeypatch, name: str, request: int) -> str:
+    module, node, requests = AGENTS[name]
+    prompt, current_code = requests[request]
+    model = RecordingChatModel(reply=AGENT_REPLY, prompts=[])
+    monkeypatch.setattr(module, "get_configured_llm", lambda state, **kwargs: model)
+    if name == "infographic":
+        # Template selection (first request only) picks a different template than the second's code
+        model.reply = "sequence-timeline-simple"
+        async def stream(llm, messages, config, agent):
+            model.reply = AGENT_REPLY
+            return await stream_agent_response(llm, messages, config, agent)
+
+        monkeypatch.setattr(infographic, "stream_agent_response", stream)
+    artifacts = {name: current_code} if current_code else {}
+    asyncio.run(node({"messages": [HumanMessage(content=prompt)], "artifacts": artifacts, "artifact_agent": name}, None))
+    return model.prompts[-1][0].content
+
+
+def router_system_prompt(monkeypatch, request: int) -> str:
+    prompt, history = ROUTER_REQUESTS[request]
+    model = RecordingChatModel(reply="mindmap", prompts=[])
+    monkeypatch.setattr(dispatcher, "get_configured_llm", lambda state, **kwargs: model)
+    asyncio.run(dispatcher.classify_intent({"messages": history + [HumanMessage(content=prompt)]}))
+    return model.prompts[-1][0].content
+
+
+def common_prefix_length(a: str, b: str) -> int:
+    length = min(len(a), len(b))
+    for i in range(length):
+        if a[i] != b[i]:
+            return i
+    return length
+
+
+@pytest.mark.parametrize("name", ["router", *AGENTS])
+def test_system_prompt_prefix_is_stable(monkeypatch, frozen_clock, name):
+    prompts = []
+    for request, now in enumerate(REQUEST_TIMES):
+        frozen_clock.current = now
+        if name == "router":
+            prompts.append(router_system_prompt(monkeypatch, request))
+        else:
+            prompts.append(agent_system_prompt(monkeypatch, name, request))
+    first, second = prompts
+    time_section = llm.get_time_instructions().lstrip("\n")
+    stable_end = first.find(llm.TIME_CONTEXT_HEADER)
+    assert stable_end >= 0, "the system prompt has no time context"
+    shared = common_prefix_length(first, second)
+    assert shared >= stable_end + len(time_section), (
+        f"prompts diverge at character {shared}: {first[shared:shared + 60]!r}"
+    )
@@ -0,0 +1,112 @@
+import asyncio
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+from app.core import ratelimit
+from app.core.ratelimit import AdaptiveRateLimiter, TokenBucket, estimate_tokens, retry_after_seconds
+
+
+@pytest.fixture
+def sleeps(monkeypatch) -> list[float]:
+    """Records the waits of `acquire` instead of sleeping."""
+    waits = []
+
+    async def sleep(seconds):
+        waits.append(seconds)
+
+    monkeypatch.setattr(ratelimit.asyncio, "sleep", sleep)
+    return waits
+
+
+def acquire(limiter: AdaptiveRateLimiter, tokens: float, times: int = 1):
+    async def run():
+        for _ in range(times):
+            await limiter.acquire(tokens)
+    asyncio.run(run())
+
+
+def test_bucket_allows_a_burst_then_spaces_reservations():
+    bucket = TokenBucket(rate=1.0)
+    now = bucket.updated
+    assert bucket.reserve(2, now) == 0.0
+    assert bucket.reserve(1, now) == pytest.approx(1.0)
+    # Queued callers wait in arrival order
+    assert bucket.reserve(1, now) == pytest.approx(2.0)
+    assert bucket.reserve(1, now + 10) == 0.0
+
+
+def test_acquire_waits_for_the_request_budget(sleeps):
+    limiter = AdaptiveRateLimiter("test", rpm=60, tpm=0)
+    acquire(limiter, 10, times=3)
+    assert sleeps[0] == pytest.approx(1.0, abs=0.05)
+
+
+def test_throttle_halves_configured_budgets_and_holds_callers(sleeps):
+    limiter = AdaptiveRateLimiter("test", rpm=120, tpm=60_000)
+    limiter.throttled(retry_after=5)
+    assert limiter.scale == 0.5
+    assert limiter.requests.rate == pytest.approx(1.0)
+    assert limiter.tokens.rate == pytest.approx(500)
+    acquire(limiter, 1)
+    assert sleeps[0] == pytest.approx(5, abs=0.05)
+
+
+def test_429s_of_one_burst_decrease_once():
+    limiter = AdaptiveRateLimiter("test", rpm=120, tpm=0)
+    limiter.throttled(None)
+    limiter.throttled(None)
+    assert limiter.scale == 0.5
+
+
+def test_success_recovers_additively_up_to_the_configured_rate():
+    limiter = AdaptiveRateLimiter("test", rpm=120, tpm=0)
+    limiter.throttled(None)
+    limiter.succeeded()
+    assert limiter.scale == pytest.approx(0.5 + ratelimit.INCREASE_STEP)
+    for _ in range(100):
+        limiter.succeeded()
+    assert limiter.scale == 1.0
+    assert limiter.requests.rate == pytest.approx(2.0)
+
+
+def test_unset_budgets_are_learned_from_observed_traffic(sleeps):
+    limiter = AdaptiveRateLimiter("test", rpm=0, tpm=0)
+    acquire(limiter, 400, times=10)
+    assert sleeps == []
+    limiter.throttled(None)
+    # 10 requests of 400 tokens within the first second, halved
+    assert limiter.base_rpm == pytest.approx(600)
+    assert limiter.base_tpm == pytest.approx(240_000)
+    assert limiter.requests.rate == pytest.approx(5.0)
+
+
+def test_only_the_unset_budget_is_learned(sleeps):
+    limiter = AdaptiveRateLimiter("test", rpm=120, tpm=0)
+    acquire(limiter, 400, times=2)
+    limiter.throttled(None)
+    # The configured request budget is scaled, not replaced by the observed rate
+    assert limiter.base_rpm == 120
+    assert limiter.requests.rate == pytest.approx(1.0)
+    assert limiter.base_tpm == pytest.approx(48_000)
+    assert limiter.tokens.rate == pytest.approx(400)
+
+
+def test_retry_after_formats():
+    assert retry_after_seconds(httpx.Response(429, headers={"retry-after-ms": "1500"})) == 1.5
+    assert retry_after_seconds(httpx.Response(429, headers={"retry-after": "7"})) == 7.0
+    date = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert retry_after_seconds(httpx.Response(429, headers={"retry-after": date})) == pytest.approx(30, abs=2)
+    assert retry_after_seconds(httpx.Response(429, headers={"retry-after": "soon"})) is None
+    assert retry_after_seconds(httpx.Response(429)) is None
+
+
+def test_estimate_tokens_counts_text_and_images():
+    request = httpx.Request("POST", "https://api.example.com/v1/chat/completions", json={"messages": [
+        {"role": "system", "content": "x" * 400},
+        {"role": "user", "content": [{"type": "text", "text": "y" * 40}, {"type": "image_url", "image_url": {}}]},
+    ]})
+    assert estimate_tokens(request) == 110 + ratelimit.IMAGE_TOKENS
+    assert estimate_tokens(httpx.Request("POST", "https://api.example.com", content=b"not json")) == 0.0
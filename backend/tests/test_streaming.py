@@ -0,0 +1,90 @@
+import random
+
+from app.core.streaming import StreamingTagParser
+
+RESPONSE = (
+    "Sure.\n<design_concept>\n  A three-step flow, left to right.  \n</design_concept>\n\n"
+    "<code>\ngraph LR\n  A --> B\n  B --> C\n</code>\nDone."
+)
+
+
+def parse(chunks: list[str]) -> tuple[StreamingTagParser, list]:
+    parser = StreamingTagParser()
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    events.extend(parser.finalize())
+    return parser, events
+
+
+def split(text: str, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    chunks, pos = [], 0
+    while pos < len(text):
+        size = rng.randint(1, 12)
+        chunks.append(text[pos:pos + size])
+        pos += size
+    return chunks
+
+
+def content(events: list, kind: str) -> str:
+    return "".join(text for evt_type, text, _ in events if evt_type == kind)
+
+
+def test_sections_are_extracted_and_stripped():
+    parser, events = parse([RESPONSE])
+    assert parser.design_concept == "A three-step flow, left to right."
+    assert parser.code == "graph LR\n  A --> B\n  B --> C"
+    assert [e[0] for e in events if not e[1]] == ["design_concept_start", "design_concept_end", "code_start", "code_end"]
+
+
+def test_output_does_not_depend_on_chunking():
+    whole, whole_events = parse([RESPONSE])
+    for seed in range(50):
+        parser, events = parse(split(RESPONSE, seed))
+        assert parser.design_concept == whole.design_concept
+        assert parser.code == whole.code
+        # Streamed deltas add up to the sections
+        assert content(events, "design_concept") == whole.design_concept
+        assert content(events, "code") == whole.code
+
+
+def test_tags_split_across_chunks():
+    parser, events = parse(["<design", "_concept>idea</desi", "gn_concept><co", "de>x = 1</c", "ode>"])
+    assert parser.design_concept == "idea"
+    assert parser.code == "x = 1"
+    assert content(events, "code") == "x = 1"
+
+
+def test_trailing_whitespace_is_held_until_more_text_follows():
+    parser = StreamingTagParser()
+    parser.feed("<design_concept>d</design_concept><code>a ")
+    assert parser.feed("  ") == []
+    assert parser.feed("b") == [("code", "   b", True)]
+
+
+def test_unclosed_sections_are_closed_on_finalize():
+    parser, events = parse(["<design_concept>idea</design_concept><code>graph TD\nA-->B"])
+    assert parser.code == "graph TD\nA-->B"
+    assert events[-1] == ("code_end", "", False)
+
+
+def test_code_is_recovered_when_design_concept_is_not_closed():
+    parser, events = parse(["<design_concept>idea\n<code>graph TD\nA-->B</code>"])
+    assert parser.design_concept == "idea"
+    assert parser.code == "graph TD\nA-->B"
+    assert ("code_start", "", False) in events
+
+
+def test_text_after_the_code_block_is_ignored():
+    parser, events = parse(["<design_concept>d</design_concept><code>c</code>", "<code>again</code>"])
+    assert parser.code == "c"
+    assert content(events, "code") == "c"
+
+
+def test_patch_reply_has_no_code_section():
+    # Edit mode: the patched code is delivered by the route, the parser must not end an empty code section
+    parser, events = parse(['<design_concept>Rename B</design_concept>\n<patch>[{"op": "delete", "start": 2}]</patch>'])
+    assert parser.code == ""
+    assert [e[0] for e in events] == ["design_concept_start", "design_concept", "design_concept_end"]
+    assert parser.feed("<code>late</code>") == []
@@ -613,10 +613,13 @@ export const ChatPanel = () => {
         }
         console.log('--------------------');
 
+        // One key per submission: repeated deliveries of this request share one generation
+        const idempotencyKey = crypto.randomUUID();
+
         try {
             const response = await fetch('/api/chat/completions', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: { 'Content-Type': 'application/json', 'Idempotency-Key': idempotencyKey },
                 body: JSON.stringify({
                     prompt: promptToUse,
                     images: imagesToUse,
@@ -839,6 +842,25 @@ export const ChatPanel = () => {
                                     }
                                     break;
 
+                                // Reasoning is streamed separately from the answer; wrap it back in
+                                // <think> tags so the message renderer shows it as a thinking block
+                                case 'thinking_start':
+                                    thoughtBuffer += '<think>';
+                                    updateLastMessage(thoughtBuffer, true, 'running', eventSessionId, true);
+                                    break;
+
+                                case 'thinking':
+                                    if (data.content) {
+                                        thoughtBuffer += data.content;
+                                        updateLastMessage(thoughtBuffer, true, 'running', eventSessionId, true);
+                                    }
+                                    break;
+
+                                case 'thinking_end':
+                                    thoughtBuffer += '</think>';
+                                    updateLastMessage(thoughtBuffer, true, 'running', eventSessionId, true);
+                                    break;
+
                                 case 'tool_code':
                                     if (data.content) {
                                         setStreamingCode(true);
@@ -129,8 +129,8 @@ const StepItem = ({ step, activeAgent, messageIndex, associatedResult, onRetry,
         }
     }, [step.content, step.isStreaming]);
 
-    // Hide "general" agent selection and agent_end markers
-    if (step.type === 'agent_end' || (step.type === 'agent_select' && (step.name === 'general' || step.name === 'general_agent'))) {
+    // Hide "general" agent selection, agent_end markers and token usage records
+    if (step.type === 'agent_end' || step.type === 'usage' || (step.type === 'agent_select' && (step.name === 'general' || step.name === 'general_agent'))) {
         return null;
     }
 
@@ -303,6 +303,7 @@ export const ExecutionTrace = ({ steps, thoughts = [], messageIndex, onRetry, on
         if (s.type === 'doc_analysis') return false;
         if (s.type === 'agent_select' && (s.name === 'general' || s.name === 'general_agent')) return false;
         if (s.type === 'agent_end') return false;
+        if (s.type === 'usage') return false;
         return true;
     });
     const hasVisibleSteps = visibleSteps.length > 0;
@@ -351,7 +352,7 @@ export const ExecutionTrace = ({ steps, thoughts = [], messageIndex, onRetry, on
 
                         for (let idx = 0; idx < steps.length; idx++) {
                             const step = steps[idx];
-                            if (step.type === 'doc_analysis') continue;
+                            if (step.type === 'doc_analysis' || step.type === 'usage') continue;
 
                             // Render design_concept with special component
                             if (step.type === 'design_concept') {